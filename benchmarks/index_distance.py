@@ -0,0 +1,101 @@
+#!/usr/bin/env python
+DESC = """Benchmark of the index collision backends of epp_utils.index_distance.
+
+Builds synthetic lanes of the given sizes, a mix of dual 10 bp indexes and 10X
+single index sets of four 8 bp oligos, with some planted collisions and near
+collisions, and times the all-pairs matrix path and multi-index hashing on
+each. The benchmark fails (exit status 1) if the two backends do not find the
+same pairs.
+
+    python benchmarks/index_distance.py [--sizes 500 2000 10000] [--repeat 3]
+"""
+
+import os
+import random
+import sys
+import time
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from epp_utils.index_distance import close_pairs, close_pairs_hashed  # noqa: E402
+
+
+def random_index(rng, length):
+    return "".join(rng.choice("ACGT") for _ in range(length))
+
+
+def mutate(rng, idx):
+    pos = rng.randrange(len(idx))
+    return idx[:pos] + rng.choice([c for c in "ACGT" if c != idx[pos]]) + idx[pos + 1 :]
+
+
+def synthetic_lane(size, seed=0):
+    """[idx1s, idx2s] columns of a lane of size entries."""
+    rng = random.Random(seed)
+    idx1s, idx2s = [], []
+    while len(idx1s) < size:
+        kind = rng.random()
+        if kind < 0.2:
+            # 10X single index set
+            for _ in range(4):
+                idx1s.append(random_index(rng, 8))
+                idx2s.append("")
+        elif kind < 0.25 and idx1s:
+            # Collision or near collision with an earlier entry
+            other = rng.randrange(len(idx1s))
+            idx1s.append(mutate(rng, idx1s[other]) if rng.random() < 0.5 else idx1s[other])
+            idx2s.append(idx2s[other])
+        else:
+            idx1s.append(random_index(rng, 10))
+            idx2s.append(random_index(rng, 10))
+    return [idx1s[:size], idx2s[:size]]
+
+
+def best_time(func, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main(args):
+    failed = False
+    print("{0:>8} {1:>8} {2:>12} {3:>12}".format("entries", "pairs", "matrix s", "hashing s"))
+    for size in args.sizes:
+        columns = synthetic_lane(size)
+        matrix_time, matrix_pairs = best_time(
+            lambda: close_pairs(columns, args.max_distance, threshold=None), args.repeat
+        )
+        hashed_time, hashed_pairs = best_time(
+            lambda: close_pairs_hashed(columns, args.max_distance), args.repeat
+        )
+        print(
+            "{0:>8} {1:>8} {2:>12.3f} {3:>12.3f}".format(
+                size, len(matrix_pairs), matrix_time, hashed_time
+            )
+        )
+        if matrix_pairs != hashed_pairs:
+            print("MISMATCH: the backends found different pairs for {0} entries".format(size))
+            failed = True
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description=DESC)
+    parser.add_argument(
+        "--sizes",
+        type=int,
+        nargs="+",
+        default=[100, 500, 2000, 5000, 10000],
+        help="Entries per lane",
+    )
+    parser.add_argument("--max_distance", type=int, default=1, help="Distance reported")
+    parser.add_argument(
+        "--repeat", type=int, default=3, help="Runs per backend, the best one is kept"
+    )
+    args = parser.parse_args()
+    sys.exit(main(args))
@@ -0,0 +1,149 @@
+#!/usr/bin/env python
+DESC = """Benchmark of the join of the demultiplexed samples with their laneBarcode rows.
+
+Builds a synthetic laneBarcode.html of a flowcell, as the list of row dicts
+given by flowcell_parser, with one Undetermined row per lane and some samples
+with several rows in a lane, and aggregates the rows of every sample of every
+lane the way set_sample_values of manage_demux_stats used to, scanning all rows
+for every sample, and through the DemuxTable of epp_utils.demux_stats, as it
+does now. The benchmark fails (exit status 1) if the two do not find the same
+row counts, reads and % bases >= Q30.
+
+The scan compares every sample with every row of the flowcell, it takes
+tens of seconds at the default size; --scan-samples times it on the first
+samples of every lane only, and extrapolates.
+
+    python benchmarks/lanebarcode_join.py [--lanes 8] [--samples 1500] [--scan-samples N]
+"""
+
+import math
+import os
+import re
+import sys
+import time
+from argparse import ArgumentParser
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from epp_utils.demux_stats import DemuxTable  # noqa: E402
+from epp_utils.lanebarcode import make_row  # noqa: E402
+
+
+def build_rows(lanes, samples):
+    rows = []
+    for lane in range(1, lanes + 1):
+        for n in range(samples):
+            # Every tenth sample has a second index in the lane
+            for index in range(2 if n % 10 == 0 else 1):
+                rows.append(
+                    {
+                        "Lane": str(lane),
+                        "Project": "A.Project_{}".format(n % 7),
+                        "Sample": "P{}_{}".format(10000 + n % 7, 101 + n),
+                        "Barcode sequence": "ACGTACG{}-TTGGCCAA".format("TA"[index]),
+                        "PF Clusters": "{:,}".format(1000000 + 17 * n + index),
+                        "% of thelane": "0.06",
+                        "% >= Q30bases": "{:.2f}".format(85 + n % 11),
+                    }
+                )
+        rows.append(
+            {
+                "Lane": str(lane),
+                "Project": "default",
+                "Sample": "Undetermined",
+                "Barcode sequence": "unknown",
+                "PF Clusters": "123,456",
+                "% of thelane": "2.10",
+                "% >= Q30bases": "88.00",
+            }
+        )
+    return rows
+
+
+def targets(lanes, samples):
+    """(lane, sample name) of the outputs of the demultiplexing step."""
+    return [
+        (str(lane), "P{}_{}".format(10000 + n % 7, 101 + n))
+        for lane in range(1, lanes + 1)
+        for n in range(samples)
+    ]
+
+
+def scan(rows, outputs, paired=True):
+    """(rows, reads, % bases >= Q30) of every output."""
+    proj_pattern = re.compile(r"(P\w+_\d+)")
+    found = []
+    for lane_no, current_name in outputs:
+        count = 0
+        reads = 0
+        q30 = 0.0
+        for entry in rows:
+            if lane_no == entry["Lane"]:
+                sample = entry["Sample"]
+                if sample != "Undetermined":
+                    sample = proj_pattern.search(sample).group(0)
+                if sample == current_name:
+                    count += 1
+                    clusters = int(entry["PF Clusters"].replace(",", ""))
+                    reads += clusters * 2 if paired else clusters
+                    q30 += float(entry["% >= Q30bases"])
+        found.append((count, reads, q30 / count if count else 0.0))
+    return found
+
+
+def columnar(records, outputs, paired=True):
+    table = DemuxTable(records)
+    lanes = [lane for lane, _ in outputs]
+    samples = [sample for _, sample in outputs]
+    stats = table.sample_stats(lanes, samples, paired)
+    return list(
+        zip(stats.rows.tolist(), stats.reads.tolist(), stats.udfs["% Bases >=Q30"].tolist())
+    )
+
+
+def same(a, b):
+    return a[:2] == b[:2] and math.isclose(a[2], b[2])
+
+
+def main(args):
+    rows = build_rows(args.lanes, args.samples)
+    outputs = targets(args.lanes, args.samples)
+    scanned = outputs
+    if args.scan_samples:
+        scanned = [
+            output
+            for output in outputs
+            if int(output[1].split("_")[1]) - 101 < args.scan_samples
+        ]
+    start = time.perf_counter()
+    expected = scan(rows, scanned)
+    before = (time.perf_counter() - start) * len(outputs) / len(scanned)
+    records = [make_row(row) for row in rows]
+    start = time.perf_counter()
+    result = columnar(records, outputs)
+    after = time.perf_counter() - start
+    print("{} lanes, {} samples per lane, {} rows".format(args.lanes, args.samples, len(rows)))
+    print(
+        "{0:8} {1:10.2f} s{2}".format(
+            "scan", before, " (extrapolated)" if len(scanned) < len(outputs) else ""
+        )
+    )
+    print("{0:8} {1:10.4f} s".format("columnar", after))
+    positions = {output: i for i, output in enumerate(outputs)}
+    if not all(same(result[positions[output]], found) for output, found in zip(scanned, expected)):
+        print("MISMATCH: the columnar join found other values")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description=DESC)
+    parser.add_argument("--lanes", type=int, default=8, help="Lanes of the flowcell")
+    parser.add_argument("--samples", type=int, default=1500, help="Samples per lane")
+    parser.add_argument(
+        "--scan-samples",
+        type=int,
+        help="Samples per lane joined by scanning, default all",
+    )
+    args = parser.parse_args()
+    sys.exit(main(args))
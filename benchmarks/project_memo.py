@@ -0,0 +1,131 @@
+#!/usr/bin/env python
+DESC = """Benchmark of the project fields lookups of the samplesheet row builders.
+
+Builds a flowcell of samples spread over a few projects, as genologics
+entities with their XML already loaded so that no LIMS is needed, and times
+reading the project name, reference genome and recipe of every sample through
+sample.project, as the row builders used to, and through a ProjectMemo. The
+benchmark fails (exit status 1) if the two do not give the same values.
+
+    python benchmarks/project_memo.py [--samples 1000] [--projects 5] [--repeat 5]
+"""
+
+import os
+import sys
+import time
+from argparse import ArgumentParser
+from xml.etree import ElementTree
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from genologics.entities import Project, Sample  # noqa: E402
+from genologics.lims import Lims  # noqa: E402
+
+from epp_utils.project_memo import SEQSETUP_PAT, ProjectMemo  # noqa: E402
+
+BASEURI = "http://lims.example.org"
+PROJECT_XML = """<prj:project xmlns:udf="http://genologics.com/ri/userdefined" xmlns:prj="http://genologics.com/ri/project" uri="{uri}" limsid="{id}">
+<name>A.Project_{n}</name>
+<udf:field type="String" name="Reference genome">hg38</udf:field>
+<udf:field type="String" name="Sequencing setup">151-10-10-151</udf:field>
+<udf:field type="String" name="Library construction method">Finished library (by user)</udf:field>
+{padding}
+</prj:project>"""
+# Projects carry many UDFs, all parsed on every project.udf access
+PADDING_UDFS = 60
+SAMPLE_XML = """<smp:sample xmlns:smp="http://genologics.com/ri/sample" uri="{uri}" limsid="{id}">
+<name>{id}</name>
+<project uri="{project_uri}" limsid="{project_id}"/>
+</smp:sample>"""
+
+
+def build_flowcell(samples, projects):
+    lims = Lims(BASEURI, "user", "password")
+    padding = "\n".join(
+        '<udf:field type="String" name="Field {0}">value {0}</udf:field>'.format(i)
+        for i in range(PADDING_UDFS)
+    )
+    project_entities = []
+    for n in range(projects):
+        project_id = "P{}".format(1000 + n)
+        project = Project(lims, id=project_id)
+        project.root = ElementTree.fromstring(
+            PROJECT_XML.format(uri=project.uri, id=project_id, n=n, padding=padding)
+        )
+        project_entities.append(project)
+    sample_entities = []
+    for n in range(samples):
+        project = project_entities[n % projects]
+        sample_id = "{}_{}".format(project.id, 101 + n)
+        sample = Sample(lims, id=sample_id)
+        sample.root = ElementTree.fromstring(
+            SAMPLE_XML.format(
+                uri=sample.uri, id=sample_id, project_uri=project.uri, project_id=project.id
+            )
+        )
+        sample_entities.append(sample)
+    return sample_entities
+
+
+def per_sample(samples):
+    rows = []
+    for sample in samples:
+        seq_setup = sample.project.udf.get("Sequencing setup", "")
+        if SEQSETUP_PAT.findall(seq_setup):
+            rc = "{}-{}".format(seq_setup.split("-")[0], seq_setup.split("-")[3])
+        else:
+            rc = "0-0"
+        rows.append(
+            (
+                sample.project.name.replace(".", "__"),
+                sample.project.udf.get("Reference genome", ""),
+                rc,
+                sample.project.udf["Library construction method"],
+            )
+        )
+    return rows
+
+
+def memoized(samples):
+    projects = ProjectMemo()
+    rows = []
+    for sample in samples:
+        project = projects.get(sample)
+        rows.append(
+            (project.name.replace(".", "__"), project.reference, project.recipe, project.library_method)
+        )
+    return rows
+
+
+def best_time(func, samples, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(samples)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best, result
+
+
+def main(args):
+    samples = build_flowcell(args.samples, args.projects)
+    before, expected = best_time(per_sample, samples, args.repeat)
+    after, result = best_time(memoized, samples, args.repeat)
+    print("{} samples, {} projects".format(args.samples, args.projects))
+    print("{0:12} {1:8.2f} ms".format("per sample", before * 1000))
+    print("{0:12} {1:8.2f} ms".format("memoized", after * 1000))
+    if result != expected:
+        print("MISMATCH: the memoized fields differ")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description=DESC)
+    parser.add_argument("--samples", type=int, default=1000, help="Samples on the flowcell")
+    parser.add_argument("--projects", type=int, default=5, help="Projects of the samples")
+    parser.add_argument(
+        "--repeat", type=int, default=5, help="Runs per variant, the best one is kept"
+    )
+    args = parser.parse_args()
+    sys.exit(main(args))
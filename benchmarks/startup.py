@@ -0,0 +1,143 @@
+#!/usr/bin/env python
+DESC = """Startup benchmark of the EPP scripts.
+
+Measures, for every script in scripts/, the time from process start to the
+point where main would be called: the script is run in a fresh interpreter
+without its __main__ block, so that all module level imports and data loads
+are paid for, and nothing else. The time of a bare interpreter start is
+subtracted.
+
+The timings are compared to a baseline file, and the benchmark fails (exit
+status 1) if a script got slower by more than the tolerance, if a script
+that used to import no longer does, or if there is no baseline. Timings depend
+on the machine, so the baseline is not committed: record it with --update on
+the machine the checks run on, before the change to measure.
+
+    python benchmarks/startup.py [--update] [--repeat 5] [scripts/foo.py ...]
+"""
+
+import glob
+import json
+import os
+import subprocess
+import sys
+import time
+from argparse import ArgumentParser
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE = os.path.join(REPO, "benchmarks", "startup_baseline.json")
+
+# Run in the child interpreter, the __main__ block of the script is skipped
+# since run_name is not __main__
+PROBE = """
+import runpy, sys
+script = sys.argv[1]
+sys.argv = [script]
+sys.path[:0] = [{scripts!r}, {repo!r}]
+try:
+    runpy.run_path(script, run_name="__startup__")
+except BaseException as e:
+    print("ERROR {{0}}: {{1}}".format(type(e).__name__, str(e).split("\\n")[0]))
+""".format(scripts=os.path.join(REPO, "scripts"), repo=REPO)
+
+
+def _run(args):
+    start = time.perf_counter()
+    out = subprocess.run(
+        [sys.executable] + args, capture_output=True, text=True, cwd=REPO
+    ).stdout
+    return time.perf_counter() - start, out
+
+
+def interpreter_time(repeat):
+    return min(_run(["-c", "pass"])[0] for _ in range(repeat))
+
+
+def measure(script, repeat, offset=0.0):
+    """Return the best startup time of script in seconds, or an error string."""
+    best = None
+    for _ in range(repeat):
+        elapsed, out = _run(["-c", PROBE, script])
+        errors = [line for line in out.splitlines() if line.startswith("ERROR ")]
+        if errors:
+            return errors[-1][len("ERROR ") :]
+        best = elapsed if best is None else min(best, elapsed)
+    return max(best - offset, 0.0)
+
+
+def compare(results, baseline, tolerance, min_delta):
+    """Return a list of regressions of results against baseline."""
+    regressions = []
+    for name, value in sorted(results.items()):
+        before = baseline.get(name)
+        if not isinstance(before, float):
+            continue
+        if not isinstance(value, float):
+            regressions.append("{0} no longer imports: {1}".format(name, value))
+        elif value > before * (1 + tolerance) and value - before > min_delta:
+            regressions.append(
+                "{0} startup {1:.3f} s, was {2:.3f} s".format(name, value, before)
+            )
+    return regressions
+
+
+def main(args):
+    scripts = args.scripts or sorted(glob.glob(os.path.join(REPO, "scripts", "*.py")))
+    offset = interpreter_time(args.repeat)
+    print("Interpreter start: {0:.3f} s".format(offset))
+
+    results = {}
+    for script in scripts:
+        name = os.path.basename(script)
+        results[name] = measure(os.path.abspath(script), args.repeat, offset)
+        if isinstance(results[name], float):
+            print("{0:45} {1:.3f} s".format(name, results[name]))
+        else:
+            print("{0:45} not importable: {1}".format(name, results[name]))
+
+    if args.update:
+        baseline = {}
+        if os.path.exists(args.baseline):
+            with open(args.baseline) as f:
+                baseline = json.load(f)
+        baseline.update(results)
+        with open(args.baseline, "w") as f:
+            json.dump(baseline, f, indent=2, sort_keys=True)
+        print("Baseline written to {0}".format(args.baseline))
+        return 0
+
+    if not os.path.exists(args.baseline):
+        print("No baseline at {0}, run with --update first".format(args.baseline))
+        return 1
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    regressions = compare(results, baseline, args.tolerance, args.min_delta)
+    for regression in regressions:
+        print("REGRESSION: {0}".format(regression))
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description=DESC)
+    parser.add_argument("scripts", nargs="*", help="Scripts to measure, default all")
+    parser.add_argument(
+        "--repeat", type=int, default=3, help="Runs per script, the best one is kept"
+    )
+    parser.add_argument("--baseline", default=BASELINE, help="Baseline JSON file")
+    parser.add_argument(
+        "--update", action="store_true", help="Write the results to the baseline"
+    )
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=0.25,
+        help="Relative slowdown allowed before failing",
+    )
+    parser.add_argument(
+        "--min_delta",
+        type=float,
+        default=0.05,
+        help="Absolute slowdown in seconds ignored as noise",
+    )
+    args = parser.parse_args()
+    sys.exit(main(args))
@@ -0,0 +1,233 @@
+import re
+from collections import namedtuple
+
+from genologics.entities import Artifact, Process
+
+from epp_utils.index_registry import registry
+from scilifelab_epps.reagent_index import reagent_sequence
+from scilifelab_epps.step_context import get_batch
+
+DESC = """This is a submodule for resolving the index (barcode) of the samples
+of a step, by walking their lineage back to the artifact carrying the reagent
+label.
+
+The BarcodeResolver expands the input artifacts of every ancestor step once,
+indexed by sample id, and memoizes the results by (sample, artifact) id, so all
+samples of a pool are resolved in a single pass that is roughly linear in the
+number of samples instead of re-walking the same parent steps for each one.
+"""
+
+# Pre-compile regexes in global scope:
+IDX_PAT = re.compile("([ATCG]{4,}N*)-?([ATCG]*)")
+TENX_SINGLE_PAT = re.compile("SI-(?:GA|NA)-[A-H][1-9][0-2]?")
+TENX_DUAL_PAT = re.compile("SI-(?:TT|NT|NN|TN|TS)-[A-H][1-9][0-2]?")
+SMARTSEQ_PAT = re.compile("SMARTSEQ[1-9]?-[1-9][0-9]?[A-P]")
+
+# Kit families of an index
+NOINDEX = "NoIndex"
+ILLUMINA = "Illumina"
+TENX_SINGLE = "10X single"
+TENX_DUAL = "10X dual"
+SMARTSEQ = "SMARTSEQ"
+
+IndexRecord = namedtuple("IndexRecord", ["i7", "i5", "kit"])
+IndexRecord.__doc__ = """Index of a sample.
+
+For 10X and SMARTSEQ indexes i7 holds the index set name and i5 is empty, as
+they stand for several index sequences, see expand_index.
+"""
+
+
+class IndexFormatError(ValueError):
+    "Raised if a reagent label has a bad format or an unknown index category."
+    pass
+
+
+def kit_family(label_or_idx: str) -> str:
+    if label_or_idx == NOINDEX:
+        return NOINDEX
+    if TENX_DUAL_PAT.findall(label_or_idx):
+        return TENX_DUAL
+    if TENX_SINGLE_PAT.findall(label_or_idx):
+        return TENX_SINGLE
+    if SMARTSEQ_PAT.findall(label_or_idx):
+        return SMARTSEQ
+    return ILLUMINA
+
+
+def check_label_format(label: str) -> bool:
+    """False if the label holds several index sequences, or none of the known
+    index categories."""
+    label = label.upper()
+    if not label or label == "NOINDEX":
+        return True
+    idx_matches = IDX_PAT.findall(label)
+    if len(idx_matches) > 1:
+        return False
+    return bool(
+        idx_matches
+        or TENX_SINGLE_PAT.findall(label)
+        or TENX_DUAL_PAT.findall(label)
+        or SMARTSEQ_PAT.findall(label)
+    )
+
+
+def expand_index(record: IndexRecord) -> list:
+    """List of (i7, i5) sequence pairs an index stands for."""
+    if record.kit == NOINDEX:
+        return [("", "")]
+    if record.kit in (TENX_SINGLE, TENX_DUAL):
+        if record.kit == TENX_DUAL:
+            i7, i5 = registry()[TENX_DUAL_PAT.findall(record.i7)[0]][:2]
+            return [(i7.replace(",", ""), i5.replace(",", ""))]
+        return [
+            (idx.replace(",", ""), "")
+            for idx in registry()[TENX_SINGLE_PAT.findall(record.i7)[0]]
+        ]
+    if record.kit == SMARTSEQ:
+        i7s, i5s = registry()[record.i7][:2]
+        return [(i7, i5) for i7 in i7s for i5 in i5s]
+    return [(record.i7.replace(",", ""), record.i5.replace(",", ""))]
+
+
+class BarcodeResolver:
+    """Per-run cache of the indexes of samples, shared between lookups.
+
+    strict_steps -- names of step types where a badly formatted reagent label
+                    raises IndexFormatError instead of being parsed as is.
+    """
+
+    def __init__(self, lims=None, strict_steps: tuple = ()):
+        self.lims = lims
+        self.strict_steps = set(strict_steps)
+        # Process id -> {sample id: [input artifact, ...]}
+        self._inputs = {}
+        # (sample id, artifact id) -> frozenset of index tuples
+        self._resolved = {}
+        # Artifact id -> index tuple or None, see artifact_index
+        self._artifact_indexes = {}
+        # Reagent label -> index tuple
+        self._labels = {}
+
+    def _inputs_by_sample(self, process: Process) -> dict:
+        """Expand the inputs of a process once, indexed by sample id."""
+        if process.id not in self._inputs:
+            inputs = process.all_inputs()
+            get_batch(process.lims, inputs)
+            index = {}
+            for art in inputs:
+                for sample in art.samples:
+                    index.setdefault(sample.id, []).append(art)
+            self._inputs[process.id] = index
+        return self._inputs[process.id]
+
+    def parse_label(self, label: str, lims=None) -> tuple:
+        """(idx1, idx2) tuple of a reagent label.
+
+        10X and SMARTSEQ labels give (set name, ""), labels without a sequence
+        are looked up in the reagent type index, and ("NoIndex", "") is returned if that
+        fails too.
+        """
+        label = label.upper().replace(" ", "")
+        if label not in self._labels:
+            idxs = (
+                TENX_SINGLE_PAT.findall(label)
+                or TENX_DUAL_PAT.findall(label)
+                or SMARTSEQ_PAT.findall(label)
+            )
+            if idxs:
+                # Put in tuple with empty string as second index to
+                # match expected type:
+                parsed = (idxs[0], "")
+            else:
+                try:
+                    parsed = IDX_PAT.findall(label)[0]
+                except IndexError:
+                    try:
+                        # we only have the reagent label name.
+                        sequence = reagent_sequence(lims or self.lims, label)
+                        parsed = IDX_PAT.findall(sequence)[0]
+                    except Exception:
+                        parsed = (NOINDEX, "")
+            self._labels[label] = parsed
+        return self._labels[label]
+
+    def _resolve_art(self, sample, art: Artifact, process: Process) -> frozenset:
+        labelled = len(art.samples) == 1 and art.reagent_labels
+        if labelled and self.strict_steps and process.type.name in self.strict_steps:
+            if not check_label_format(art.reagent_labels[0]):
+                raise IndexFormatError(
+                    "Sample {} has a bad format or unknown index category".format(
+                        sample.name
+                    )
+                )
+        key = (sample.id, art.id)
+        if key not in self._resolved:
+            if labelled:
+                found = frozenset([self.parse_label(art.reagent_labels[0], process.lims)])
+            elif art == sample.artifact or not art.parent_process:
+                found = frozenset()
+            else:
+                # Mark as in progress, in case of a cycle in the lineage
+                self._resolved[key] = frozenset()
+                found = frozenset(self.sample_indexes(sample, art.parent_process))
+            self._resolved[key] = found
+        return self._resolved[key]
+
+    def sample_indexes(self, sample, process: Process) -> set:
+        """Set of (idx1, idx2) tuples of sample, looking back from process."""
+        found = set()
+        for art in self._inputs_by_sample(process).get(sample.id, []):
+            found |= self._resolve_art(sample, art, process)
+        return found
+
+    def sample_records(self, sample, process: Process) -> list:
+        """IndexRecords of sample, sorted, looking back from process."""
+        return sorted(
+            IndexRecord(idxs[0], idxs[1], kit_family(idxs[0]))
+            for idxs in self.sample_indexes(sample, process)
+        )
+
+    def resolve_step(self, process: Process, outputs: list = None) -> dict:
+        """Resolve every sample of the analyte outputs of a step in one pass.
+
+        Returns a dict of sample id -> set of (idx1, idx2) tuples.
+        """
+        if outputs is None:
+            outputs = [out for out in process.all_outputs() if out.type == "Analyte"]
+        samples = {}
+        for out in outputs:
+            for sample in out.samples:
+                samples.setdefault(sample.id, sample)
+        get_batch(process.lims, list(samples.values()))
+        return {
+            sample_id: self.sample_indexes(sample, process)
+            for sample_id, sample in samples.items()
+        }
+
+    def artifact_index(self, artifact: Artifact):
+        """Index tuple of the closest ancestor of artifact carrying a reagent label,
+        following the input of each parent step. None if there is none."""
+        if artifact.id not in self._artifact_indexes:
+            found = None
+            if len(artifact.samples) == 1 and artifact.reagent_labels:
+                found = self.parse_label(artifact.reagent_labels[0], artifact.lims)
+            elif artifact != artifact.samples[0].artifact and artifact.parent_process:
+                previous = None
+                for io in artifact.parent_process.input_output_maps:
+                    if io[1] and io[1]["uri"].id == artifact.id:
+                        previous = io[0]["uri"]
+                if previous is not None:
+                    found = self.artifact_index(previous)
+            self._artifact_indexes[artifact.id] = found
+        return self._artifact_indexes[artifact.id]
+
+
+def find_barcode(sample_idxs: set, sample, process: Process, resolver: BarcodeResolver = None):
+    """Add the index tuples of sample, looking back from process, to sample_idxs.
+
+    Drop-in replacement of the recursive find_barcode functions of the scripts.
+    """
+    if resolver is None:
+        resolver = BarcodeResolver(process.lims)
+    sample_idxs.update(resolver.sample_indexes(sample, process))
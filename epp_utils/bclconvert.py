@@ -0,0 +1,185 @@
+import csv
+import re
+
+DESC = """This is a submodule for writing the lane data of a flowcell as a BCL
+Convert v2 samplesheet, and for validating the rows before they are written.
+
+The rows are the dicts built by the lane data engine of samplesheet_generator
+(lane, sn, pj, rc, fc, idx1, idx2). The [Reads] section takes the read cycles
+from the recipes of the projects and the index cycles from the longest indexes
+of the flowcell. Lanes may hold indexes shorter than the index reads, so every
+row carries the OverrideCycles of its lane, with the cycles past the index
+length masked.
+
+validate_rows checks the index characters, the index lengths within each lane
+and the duplicated rows and indexes in a single pass over the rows, so that the
+sheet does not need to be parsed again to be checked.
+"""
+
+FILE_FORMAT_VERSION = 2
+INDEX_PAT = re.compile("^[ACGTN]*$")
+SETTINGS = [
+    ("BarcodeMismatchesIndex1", 1),
+    ("BarcodeMismatchesIndex2", 1),
+    ("FastqCompressionFormat", "gzip"),
+]
+DATA_HEADER = ["Lane", "Sample_ID", "index", "index2", "OverrideCycles", "Sample_Project"]
+
+
+def read_cycles(data: list) -> tuple:
+    """(read 1, read 2) cycles of the flowcell, the longest of the recipes.
+
+    Rows of controls and of projects without a sequencing setup have the
+    recipe "0-0" and do not count.
+    """
+    read1 = read2 = 0
+    for line in data:
+        first, _, second = line.get("rc", "0-0").partition("-")
+        if first.isdigit():
+            read1 = max(read1, int(first))
+        if second.isdigit():
+            read2 = max(read2, int(second))
+    return (read1, read2)
+
+
+def index_cycles(data: list) -> tuple:
+    """(index 1, index 2) cycles of the flowcell, the longest of the indexes."""
+    return (
+        max((len(line.get("idx1", "")) for line in data), default=0),
+        max((len(line.get("idx2", "")) for line in data), default=0),
+    )
+
+
+def _index_segment(length: int, cycles: int) -> str:
+    if not length:
+        return "N{}".format(cycles)
+    if length < cycles:
+        return "I{}N{}".format(length, cycles - length)
+    return "I{}".format(length)
+
+
+def override_cycles(reads: tuple, indexes: tuple, lengths: tuple) -> str:
+    """OverrideCycles of a lane whose indexes have lengths, on a run of reads
+    and indexes cycles."""
+    segments = ["Y{}".format(reads[0])]
+    for length, cycles in zip(lengths, indexes):
+        if cycles:
+            segments.append(_index_segment(length, cycles))
+    if reads[1]:
+        segments.append("Y{}".format(reads[1]))
+    return ";".join(segments)
+
+
+def lane_index_lengths(data: list) -> dict:
+    """{lane: (index 1, index 2) length}, the longest of the lane."""
+    lengths = {}
+    for line in data:
+        idx1, idx2 = lengths.get(line["lane"], (0, 0))
+        lengths[line["lane"]] = (
+            max(idx1, len(line.get("idx1", ""))),
+            max(idx2, len(line.get("idx2", ""))),
+        )
+    return lengths
+
+
+def validate_rows(data: list) -> list:
+    """Errors of the rows of data, as log lines.
+
+    Checks, in one pass, that the indexes only hold ACGTN, that the samples of
+    a lane with several samples all have an index, that all indexes of a lane
+    have the same lengths, and that no row or index pair is repeated in a lane.
+    """
+    errors = []
+    lane_lengths = {}
+    lane_samples = {}
+    unindexed = {}
+    seen_rows = set()
+    seen_indexes = {}
+    for line in data:
+        lane = line["lane"]
+        idx1 = line.get("idx1", "").upper()
+        idx2 = line.get("idx2", "").upper()
+        for idx in (idx1, idx2):
+            if not INDEX_PAT.match(idx):
+                errors.append(
+                    "Sample {} in lane {} has the invalid index {}".format(line["sn"], lane, idx)
+                )
+        lane_lengths.setdefault(lane, set()).add((len(idx1), len(idx2)))
+        lane_samples.setdefault(lane, set()).add(line["sn"])
+        if not idx1 and not idx2:
+            unindexed.setdefault(lane, []).append(line["sn"])
+        row = (lane, line["sn"], idx1, idx2)
+        if row in seen_rows:
+            errors.append("Sample {} is listed twice in lane {}".format(line["sn"], lane))
+            continue
+        seen_rows.add(row)
+        other = seen_indexes.setdefault((lane, idx1, idx2), line["sn"])
+        if other != line["sn"]:
+            errors.append(
+                "Samples {} and {} have the same indexes {} in lane {}".format(
+                    other, line["sn"], "-".join(filter(None, (idx1, idx2))), lane
+                )
+            )
+    for lane in sorted(lane_lengths):
+        if len(lane_samples[lane]) > 1:
+            for sample in unindexed.get(lane, []):
+                errors.append("Sample {} has no index in lane {}".format(sample, lane))
+        if len(lane_lengths[lane]) > 1:
+            errors.append(
+                "Lane {} mixes index lengths {}".format(
+                    lane,
+                    ", ".join("{}+{}".format(*lengths) for lengths in sorted(lane_lengths[lane])),
+                )
+            )
+    return errors
+
+
+def write_bclconvert(data: list, stream, sort_key=None, platform=None):
+    """Write the rows of data to stream as a BCL Convert v2 samplesheet.
+
+    The rows are written in the order of sort_key if given. platform is the
+    InstrumentPlatform of the [Header] section, left out if None.
+    """
+    reads = read_cycles(data)
+    indexes = index_cycles(data)
+    lengths = lane_index_lengths(data)
+    overrides = {
+        lane: override_cycles(reads, indexes, lane_lengths)
+        for lane, lane_lengths in lengths.items()
+    }
+    header = DATA_HEADER if indexes[1] else [name for name in DATA_HEADER if name != "index2"]
+
+    writer = csv.writer(stream, lineterminator="\n")
+    writer.writerow(["[Header]"])
+    writer.writerow(["FileFormatVersion", FILE_FORMAT_VERSION])
+    if data:
+        writer.writerow(["RunName", data[0]["fc"]])
+    if platform:
+        writer.writerow(["InstrumentPlatform", platform])
+    writer.writerow([])
+    writer.writerow(["[Reads]"])
+    writer.writerow(["Read1Cycles", reads[0]])
+    if reads[1]:
+        writer.writerow(["Read2Cycles", reads[1]])
+    if indexes[0]:
+        writer.writerow(["Index1Cycles", indexes[0]])
+    if indexes[1]:
+        writer.writerow(["Index2Cycles", indexes[1]])
+    writer.writerow([])
+    writer.writerow(["[BCLConvert_Settings]"])
+    for name, value in SETTINGS:
+        if name != "BarcodeMismatchesIndex2" or indexes[1]:
+            writer.writerow([name, value])
+    writer.writerow([])
+    writer.writerow(["[BCLConvert_Data]"])
+    writer.writerow(header)
+    for line in sorted(data, key=sort_key) if sort_key else data:
+        values = {
+            "Lane": line["lane"],
+            "Sample_ID": line["sn"],
+            "index": line.get("idx1", "").upper(),
+            "index2": line.get("idx2", "").upper(),
+            "OverrideCycles": overrides[line["lane"]],
+            "Sample_Project": line["pj"],
+        }
+        writer.writerow([values[name] for name in header])
@@ -0,0 +1,159 @@
+from collections import namedtuple
+
+from epp_utils.lanebarcode import UNDETERMINED, sample_key
+from epp_utils.lazy import lazy_import
+
+np = lazy_import("numpy")
+
+DESC = """This is a submodule for computing the per-sample demultiplexing
+statistics of a flowcell from the rows of its laneBarcode.html as columns.
+
+The LaneBarcodeRow of the report are turned once into NumPy arrays, one per
+column. The output artifacts of the demultiplexing step are joined to their
+rows by (lane, sample) codes, and the rows of a sample repeated in a lane (one
+per index) are aggregated with bincount: reads, read pairs and yields are
+summed, the percentages averaged, with empty cells counted as 0. The
+undetermined reads included in a lane, the QC thresholds and the undetermined
+percentage of every lane are array operations as well, so that the statistics
+of a flowcell with thousands of samples are a handful of passes over the
+columns instead of nested loops over artifacts and rows.
+"""
+
+# LaneBarcodeRow field -> artifact UDF, averaged over the rows of a sample
+AVERAGED = (
+    ("pct_lane", "% of Raw Clusters Per Lane"),
+    ("pct_perfect", "% Perfect Index Read"),
+    ("pct_one_mismatch", "% One Mismatch Reads (Index)"),
+    ("pct_pf", "%PF"),
+    ("mean_quality", "Ave Q Score"),
+    ("pct_q30", "% Bases >=Q30"),
+)
+# LaneBarcodeRow field -> artifact UDF, summed over the rows of a sample
+# (Mbases, divided by 1000 into Gb)
+SUMMED = (("yield_mbases", "Yield PF (Gb)"),)
+
+SampleStats = namedtuple("SampleStats", ["rows", "reads", "read_pairs", "udfs", "missing"])
+SampleStats.__doc__ = """Statistics of the samples of a list of (lane, sample).
+
+rows        -- int array, laneBarcode rows of each sample, 0 if it has none
+reads       -- int array, reads (clusters, times two if paired), with the
+               included undetermined reads added once per row
+read_pairs  -- float array, read pairs (reads if single-end)
+udfs        -- dict of artifact UDF -> float array, from AVERAGED and SUMMED
+missing     -- dict of artifact UDF -> int array, empty cells of each sample
+"""
+
+
+class DemuxTable(object):
+    """The rows of a laneBarcode.html as columns.
+
+    Arguments:
+    rows    -- iterable of LaneBarcodeRow, in file order
+    """
+
+    def __init__(self, rows):
+        rows = list(rows)
+        self.lane = np.array([row.lane for row in rows], dtype=object)
+        self.sample = np.array([sample_key(row.sample) for row in rows], dtype=object)
+        self.undetermined = self.sample == UNDETERMINED
+        barcode = np.array([row.barcode for row in rows], dtype=object)
+        self.no_index = (barcode == "unknown") & ~self.undetermined
+        self.clusters = np.array([row.clusters for row in rows], dtype=np.int64)
+        self.columns = {
+            field: np.array(
+                [np.nan if getattr(row, field) is None else getattr(row, field) for row in rows],
+                dtype=np.float64,
+            )
+            for field, _ in AVERAGED + SUMMED
+        }
+
+    def __len__(self):
+        return len(self.lane)
+
+    def lanes(self) -> list:
+        """Lanes of the rows, sorted."""
+        return sorted(set(self.lane))
+
+    def no_index_lanes(self) -> set:
+        """Lanes with a sample row without barcode sequence."""
+        return set(self.lane[self.no_index])
+
+    def sample_positions(self, lane: str):
+        """Positions of the sample rows of lane, the Undetermined row left out."""
+        return np.flatnonzero((self.lane == lane) & ~self.undetermined)
+
+    def last_sample(self, lane: str):
+        """Sample of the last row of lane, None if the lane has no rows."""
+        positions = np.flatnonzero(self.lane == lane)
+        return self.sample[positions[-1]] if len(positions) else None
+
+    def undetermined_reads(self, paired: bool) -> dict:
+        """{lane: reads} of the Undetermined row of every lane, the last one if
+        there are several."""
+        factor = 2 if paired else 1
+        return {
+            lane: int(clusters) * factor
+            for lane, clusters in zip(self.lane[self.undetermined], self.clusters[self.undetermined])
+        }
+
+    def sample_stats(self, lanes, samples, paired: bool, included=None) -> SampleStats:
+        """SampleStats of the samples of lanes, rows of samples being matched
+        to the rows with the same lane and sample.
+
+        included -- {lane: undetermined reads added to every row of the lane}
+        """
+        lanes = np.asarray(lanes, dtype=object)
+        samples = np.asarray(samples, dtype=object)
+        keys = np.concatenate([self.lane + "\t" + self.sample, lanes + "\t" + samples])
+        if not len(keys):
+            keys = keys.astype(str)
+        codes, inverse = np.unique(keys, return_inverse=True)
+        row_code, target_code = inverse[: len(self)], inverse[len(self) :]
+        size = len(codes)
+
+        undet = np.zeros(len(self), dtype=np.int64)
+        for lane, reads in (included or {}).items():
+            undet[self.lane == lane] = reads
+        factor = 2 if paired else 1
+        row_reads = self.clusters * factor + undet
+        row_pairs = self.clusters + undet / 2 if paired else row_reads
+
+        counts = np.bincount(row_code, minlength=size)
+        reads = np.bincount(row_code, weights=row_reads, minlength=size)
+        pairs = np.bincount(row_code, weights=row_pairs, minlength=size)
+        rows = counts[target_code]
+        divisor = np.maximum(rows, 1)
+
+        udfs = {}
+        missing = {}
+        for field, udf in AVERAGED + SUMMED:
+            column = self.columns[field]
+            empty = np.isnan(column)
+            total = np.bincount(row_code, weights=np.where(empty, 0.0, column), minlength=size)
+            values = total[target_code]
+            udfs[udf] = values / 1000 if (field, udf) in SUMMED else values / divisor
+            missing[udf] = np.bincount(row_code, weights=empty, minlength=size)[target_code].astype(np.int64)
+        return SampleStats(
+            rows,
+            reads[target_code].astype(np.int64),
+            pairs[target_code],
+            udfs,
+            missing,
+        )
+
+
+def qc_passed(q30, read_pairs, q30_threshold, expected_pairs):
+    """Bool array of the samples reaching both the % bases >= Q30 and the read
+    pairs thresholds."""
+    return (np.asarray(q30) >= q30_threshold) & (
+        np.asarray(expected_pairs) <= np.asarray(read_pairs)
+    )
+
+
+def undetermined_percent(undetermined_reads, lane_reads):
+    """Percentage of undetermined reads of every lane, rounded to 2 decimals,
+    NaN for lanes without reads."""
+    undetermined_reads = np.asarray(undetermined_reads, dtype=np.float64)
+    total = undetermined_reads + np.asarray(lane_reads, dtype=np.float64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return np.round(np.where(total > 0, undetermined_reads / total * 100, np.nan), 2)
@@ -0,0 +1,192 @@
+from itertools import combinations
+from math import comb
+
+from epp_utils.lazy import lazy_import
+
+np = lazy_import("numpy")
+
+DESC = """This is a submodule for finding index sequences that are too close to
+each other within a pool or lane.
+
+The distance of two indexes is the number of mismatching bases over the length
+of the shorter one, as computed by the my_distance functions of the scripts.
+Instead of comparing every pair of strings in Python, the indexes are encoded
+as a uint8 matrix, one-hot expanded, and the number of matching bases of all
+pairs is obtained by a matrix product, computed by blocks of rows so that the
+memory use stays bounded for lanes with thousands of index entries.
+
+As all pairs still have to be compared, larger lanes are handled by multi-index
+hashing, see close_pairs_hashed, which only compares the entries sharing an
+exact segment of their indexes.
+"""
+
+# Rows of the distance matrix computed at once
+BLOCK_SIZE = 1024
+# Entries above which close_pairs uses multi-index hashing, see
+# benchmarks/index_distance.py
+HASHING_THRESHOLD = 5000
+# Bucket keys per index in multi-index hashing
+MAX_KEYS = 32
+
+
+def my_distance(idx_a: str, idx_b: str) -> int:
+    """Mismatches of two indexes, over the length of the shorter one."""
+    return sum(1 for a, b in zip(idx_a, idx_b) if a != b)
+
+
+def encode(indexes: list):
+    """Encode indexes as a uint8 matrix, padded with 0, and their lengths.
+
+    Returns (codes, lengths, symbols), the codes being 1-based positions in the
+    alphabet of the indexes, of size symbols.
+    """
+    raw = [idx.encode("ascii", "replace") for idx in indexes]
+    lengths = np.fromiter((len(idx) for idx in raw), dtype=np.int32, count=len(raw))
+    width = int(lengths.max()) if len(raw) else 0
+    chars = np.zeros((len(raw), width), dtype=np.uint8)
+    for row, idx in enumerate(raw):
+        chars[row, : len(idx)] = np.frombuffer(idx, dtype=np.uint8)
+    alphabet = np.unique(chars[chars > 0])
+    codes = np.where(chars > 0, np.searchsorted(alphabet, chars) + 1, 0).astype(np.uint8)
+    return codes, lengths, len(alphabet)
+
+
+def _one_hot(codes, symbols: int):
+    """float32 matrix of the codes, one column per (position, symbol).
+
+    Padding (code 0) has no column, so it matches nothing.
+    """
+    n, width = codes.shape
+    one_hot = np.zeros((n, width, symbols + 1), dtype=np.float32)
+    rows, cols = np.indices(codes.shape)
+    one_hot[rows, cols, codes] = 1
+    return one_hot[:, :, 1:].reshape(n, width * symbols)
+
+
+def close_pairs(
+    columns: list,
+    max_distance: int = 1,
+    block_size: int = BLOCK_SIZE,
+    threshold: int = HASHING_THRESHOLD,
+):
+    """Find the pairs of entries at a distance of at most max_distance.
+
+    columns   -- lists of indexes of the same length, e.g. [idx1s, idx2s]. The
+                 distance of two entries is the sum of the distances of their
+                 indexes in every column, an empty index adds nothing.
+    threshold -- number of entries above which close_pairs_hashed is used
+                 instead of comparing all pairs.
+
+    Returns (i, j, distance) tuples with i < j, ordered by i then j.
+    """
+    n = len(columns[0]) if columns else 0
+    if n < 2:
+        return []
+    if threshold is not None and n > threshold:
+        return close_pairs_hashed(columns, max_distance)
+    encoded = [encode(column) for column in columns]
+    one_hots = np.hstack([_one_hot(codes, symbols) for codes, _, symbols in encoded])
+    pairs = []
+    for start in range(0, n - 1, block_size):
+        stop = min(start + block_size, n)
+        # Only the pairs (i, j) with j > i are of interest
+        matches = one_hots[start:stop] @ one_hots[start + 1 :].T
+        compared = sum(
+            np.minimum(lengths[start:stop, None], lengths[None, start + 1 :])
+            for _, lengths, _ in encoded
+        )
+        distances = compared - np.rint(matches).astype(np.int32)
+        upper = np.arange(start, stop)[:, None] < np.arange(start + 1, n)[None, :]
+        rows, cols = np.nonzero((distances <= max_distance) & upper)
+        for row, col in zip(rows.tolist(), cols.tolist()):
+            pairs.append((start + row, start + 1 + col, int(distances[row, col])))
+    return pairs
+
+
+def _segments(length: int, parts: int) -> list:
+    """Split range(length) in parts contiguous (start, stop) segments."""
+    bounds = [length * part // parts for part in range(parts + 1)]
+    return list(zip(bounds[:-1], bounds[1:]))
+
+
+def _merge(segments: list) -> list:
+    """Merge adjacent (start, stop) segments."""
+    merged = []
+    for start, stop in segments:
+        if merged and merged[-1][1] == start:
+            merged[-1] = (merged[-1][0], stop)
+        else:
+            merged.append((start, stop))
+    return merged
+
+
+def _segment_count(length: int, max_distance: int) -> int:
+    """Number of segments to split indexes of length in.
+
+    Out of m segments, two indexes within max_distance have at least
+    m - max_distance segments in common, so they share one of the
+    comb(m, max_distance) keys made of the other segments. More segments give
+    more selective keys, but more keys per index: take the largest m with at
+    most MAX_KEYS keys.
+    """
+    segments = max_distance + 1
+    while segments < length and comb(segments + 1, max_distance) <= MAX_KEYS:
+        segments += 1
+    return segments
+
+
+def close_pairs_hashed(columns: list, max_distance: int = 1) -> list:
+    """Same as close_pairs, with multi-index hashing instead of all pairs.
+
+    Entries are grouped by the lengths of their indexes. For every pair of
+    groups, the indexes are truncated to the common lengths and concatenated,
+    split in segments, and bucketed by every combination of all segments but
+    max_distance of them (pigeonhole principle, see _segment_count). Only the
+    entries sharing a bucket are compared, so the cost grows with the number of
+    entries and of close pairs, instead of with the square of the entries.
+    """
+    n = len(columns[0]) if columns else 0
+    if n < 2:
+        return []
+    groups = {}
+    for i in range(n):
+        groups.setdefault(tuple(len(column[i]) for column in columns), []).append(i)
+    shapes = sorted(groups)
+
+    found = {}
+    for a, shape_a in enumerate(shapes):
+        for shape_b in shapes[a:]:
+            common = [min(la, lb) for la, lb in zip(shape_a, shape_b)]
+            members = {0: groups[shape_a], 1: groups[shape_b]}
+            keys = {
+                i: "".join(column[i][:width] for column, width in zip(columns, common))
+                for i in set(members[0]) | set(members[1])
+            }
+            length = sum(common)
+            if length <= max_distance:
+                # Everything is close enough, nothing to bucket on
+                subsets = [()]
+                segments = []
+            else:
+                segments = _segments(length, _segment_count(length, max_distance))
+                subsets = combinations(range(len(segments)), len(segments) - max_distance)
+            sides = (0,) if shape_a == shape_b else (0, 1)
+            for subset in subsets:
+                kept = _merge([segments[s] for s in subset])
+                buckets = {}
+                for side in sides:
+                    for i in members[side]:
+                        key = "".join(keys[i][start:stop] for start, stop in kept)
+                        buckets.setdefault((side, key), []).append(i)
+                for (side, key), bucket in buckets.items():
+                    if side == 1:
+                        continue
+                    others = bucket if len(sides) == 1 else buckets.get((1, key), [])
+                    for i in bucket:
+                        for j in others:
+                            pair = (i, j) if i < j else (j, i)
+                            if i != j and pair not in found:
+                                d = my_distance(keys[i], keys[j])
+                                if d <= max_distance:
+                                    found[pair] = d
+    return sorted((i, j, d) for (i, j), d in found.items())
@@ -0,0 +1,231 @@
+import hashlib
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+import zlib
+from functools import lru_cache
+
+DESC = """This is a submodule for looking up the index sequences of named index
+kits (Chromium 10X sets, SMARTSEQ3 plates) from a packed binary registry.
+
+The kits are compiled once into data/index_registry.bin: sequences are 2-bit
+encoded, and an open addressing hash table maps kit names to their entries. At
+runtime the file is memory-mapped, and a lookup hashes the name and decodes a
+single entry, so no Python dict of all the kits is built and no module of
+literals is compiled or JSON file parsed.
+
+Rebuild the registry after changing a kit source, the check fails in the mean
+time:
+
+    python -m epp_utils.index_registry [--check]
+
+If the registry file is missing, or was built from other sources than the
+current ones (its header holds their digest), it is compiled in memory from
+the sources, with a warning in the latter case.
+"""
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+REGISTRY_PATH = os.path.join(DATA_DIR, "index_registry.bin")
+SOURCES = ("Chromium_10X_indexes.py", "SMARTSEQ3_indexes.json")
+
+MAGIC = b"NGIIDX\x00\x01"
+# magic, kit count, slot count, digest of the sources
+_HEADER = struct.Struct("<8sII20s")
+# crc32 of the name, offset of the entry (0 for an empty slot)
+_SLOT = struct.Struct("<II")
+_BASES = "ACGT"
+_CODES = {base: code for code, base in enumerate(_BASES)}
+# Packed byte -> its 4 bases
+_DECODE = [
+    "".join(_BASES[(byte >> shift) & 3] for shift in (6, 4, 2, 0)) for byte in range(256)
+]
+
+
+def load_sources() -> dict:
+    """Kit name -> sequences of all index kit sources of the data directory.
+
+    Values are lists of sequences (10X) or lists of lists of sequences
+    (SMARTSEQ3 i7s and i5s), as in the sources.
+    """
+    sys.path.insert(0, os.path.dirname(DATA_DIR))
+    try:
+        from data.Chromium_10X_indexes import Chromium_10X_indexes
+    finally:
+        sys.path.pop(0)
+    with open(os.path.join(DATA_DIR, "SMARTSEQ3_indexes.json")) as f:
+        smartseq3_indexes = json.load(f)
+    kits = dict(Chromium_10X_indexes)
+    for name, groups in smartseq3_indexes.items():
+        if name in kits:
+            raise ValueError("Index kit {} is defined twice".format(name))
+        kits[name] = groups
+    return kits
+
+
+def sources_digest() -> bytes:
+    digest = hashlib.sha1()
+    for source in SOURCES:
+        with open(os.path.join(DATA_DIR, source), "rb") as f:
+            digest.update(f.read())
+    return digest.digest()
+
+
+def _pack_sequence(seq: str) -> bytes:
+    if not seq or any(base not in _CODES for base in seq):
+        raise ValueError("Cannot pack index sequence {!r}".format(seq))
+    packed = bytearray()
+    for start in range(0, len(seq), 4):
+        chunk = seq[start : start + 4]
+        byte = 0
+        for base in chunk.ljust(4, "A"):
+            byte = (byte << 2) | _CODES[base]
+        packed.append(byte)
+    return bytes([len(seq)]) + bytes(packed)
+
+
+def _pack_entry(name: str, value: list) -> bytes:
+    """Entry layout: name length, name, nested flag, group count, then for every
+    group its sequence count and the packed sequences."""
+    nested = bool(value) and isinstance(value[0], list)
+    groups = value if nested else [value]
+    encoded_name = name.encode("utf-8")
+    entry = bytearray(struct.pack("<B", len(encoded_name)) + encoded_name)
+    entry += struct.pack("<BB", nested, len(groups))
+    for group in groups:
+        entry += struct.pack("<H", len(group))
+        for seq in group:
+            entry += _pack_sequence(seq)
+    return bytes(entry)
+
+
+def compile_registry(kits: dict, digest: bytes = b"\x00" * 20) -> bytes:
+    """Pack kits into the registry format."""
+    slots = 1
+    while slots < 2 * len(kits):
+        slots *= 2
+    table = [(0, 0)] * slots
+    entries = bytearray()
+    base = _HEADER.size + slots * _SLOT.size
+    for name in sorted(kits):
+        crc = zlib.crc32(name.encode("utf-8"))
+        slot = crc & (slots - 1)
+        while table[slot][1]:
+            slot = (slot + 1) & (slots - 1)
+        table[slot] = (crc, base + len(entries))
+        entries += _pack_entry(name, kits[name])
+    header = _HEADER.pack(MAGIC, len(kits), slots, digest)
+    return header + b"".join(_SLOT.pack(*slot) for slot in table) + bytes(entries)
+
+
+class IndexRegistry:
+    """Read-only mapping of kit name -> sequences over a packed registry buffer.
+
+    Values are built on lookup, the same shape as in the kit sources.
+    """
+
+    def __init__(self, buffer):
+        self.buffer = buffer
+        magic, self.kits, self.slots, self.digest = _HEADER.unpack_from(buffer, 0)
+        if magic != MAGIC:
+            raise ValueError("Not an index registry")
+
+    @classmethod
+    def open(cls, path: str = REGISTRY_PATH):
+        with open(path, "rb") as f:
+            return cls(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ))
+
+    def _find(self, name: str):
+        """Offset of the entry of name, after its name, or None."""
+        encoded_name = name.encode("utf-8")
+        crc = zlib.crc32(encoded_name)
+        slot = crc & (self.slots - 1)
+        while True:
+            slot_crc, offset = _SLOT.unpack_from(self.buffer, _HEADER.size + slot * _SLOT.size)
+            if not offset:
+                return None
+            if slot_crc == crc:
+                length = self.buffer[offset]
+                if self.buffer[offset + 1 : offset + 1 + length] == encoded_name:
+                    return offset + 1 + length
+            slot = (slot + 1) & (self.slots - 1)
+
+    def _decode(self, offset: int) -> list:
+        nested, group_count = struct.unpack_from("<BB", self.buffer, offset)
+        offset += 2
+        groups = []
+        for _ in range(group_count):
+            (count,) = struct.unpack_from("<H", self.buffer, offset)
+            offset += 2
+            group = []
+            for _ in range(count):
+                length = self.buffer[offset]
+                size = (length + 3) // 4
+                packed = self.buffer[offset + 1 : offset + 1 + size]
+                group.append("".join(_DECODE[byte] for byte in packed)[:length])
+                offset += 1 + size
+            groups.append(group)
+        return groups if nested else groups[0]
+
+    def __getitem__(self, name: str) -> list:
+        offset = self._find(name)
+        if offset is None:
+            raise KeyError(name)
+        return self._decode(offset)
+
+    def __contains__(self, name: str) -> bool:
+        return self._find(name) is not None
+
+    def __len__(self) -> int:
+        return self.kits
+
+    def get(self, name: str, default=None):
+        offset = self._find(name)
+        return default if offset is None else self._decode(offset)
+
+
+@lru_cache(maxsize=None)
+def registry() -> IndexRegistry:
+    """The index registry of the repository, mapped once per run."""
+    digest = sources_digest()
+    if os.path.exists(REGISTRY_PATH):
+        packed = IndexRegistry.open(REGISTRY_PATH)
+        if packed.digest == digest:
+            return packed
+        logging.warning(
+            "{} is out of date, using the index kit sources instead".format(REGISTRY_PATH)
+        )
+    return IndexRegistry(compile_registry(load_sources(), digest))
+
+
+def main(args):
+    if args.check:
+        if not os.path.exists(args.path):
+            print("{} does not exist".format(args.path))
+            return 1
+        if IndexRegistry.open(args.path).digest != sources_digest():
+            print("{} is out of date, rebuild it".format(args.path))
+            return 1
+        print("{} is up to date".format(args.path))
+        return 0
+    kits = load_sources()
+    packed = compile_registry(kits, sources_digest())
+    tmp_path = args.path + ".tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(packed)
+    os.replace(tmp_path, args.path)
+    print("Wrote {} kits, {} bytes, to {}".format(len(kits), len(packed), args.path))
+    return 0
+
+
+if __name__ == "__main__":
+    from argparse import ArgumentParser
+
+    parser = ArgumentParser(description=DESC)
+    parser.add_argument("--path", default=REGISTRY_PATH, help="Registry file")
+    parser.add_argument(
+        "--check", action="store_true", help="Fail if the registry is out of date"
+    )
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,232 @@
+import time
+from collections import namedtuple
+
+from epp_utils.index_distance import close_pairs
+
+DESC = """This is a submodule for proposing how to place pools on the lanes of a
+flowcell so that no lane holds two indexes that are too close to each other.
+
+Pools and lanes are treated as a graph colouring problem: pools are the
+vertices, two pools are linked if any of their indexes are within max_distance
+of each other (found with the distance engine of epp_utils.index_distance), and
+every lane is a colour. A pool loaded on several lanes is split in copies,
+which are linked since they have the same indexes, and a pool whose own samples
+collide is split in sub-pools first. The colouring is built with DSatur, most
+constrained pool first and least loaded lane first, and then balanced by moving
+and swapping pools between lanes, as long as no conflict is introduced, until
+no move lowers the most loaded lane or the time limit is reached.
+"""
+
+Pool = namedtuple("Pool", ["name", "samples", "weight", "copies"])
+Pool.__doc__ = """A pool to place on the flowcell.
+
+samples -- dict of sample name -> list of its indexes (index and index2
+           concatenated, as checked by check_index_distance)
+weight  -- expected reads of the pool, in any unit, e.g. lanes
+copies  -- number of lanes the pool is loaded on
+"""
+Pool.__new__.__defaults__ = (1.0, 1)
+
+Assignment = namedtuple("Assignment", ["lanes", "loads", "conflicts", "splits"])
+Assignment.__doc__ = """Proposed placement of pools on lanes.
+
+lanes     -- list, for every lane, of the names of the (sub-)pools placed on it
+loads     -- list of the expected reads of every lane
+conflicts -- (pool, pool, lane) that could not be kept apart
+splits    -- dict of pool name -> names of the sub-pools it was split in
+"""
+
+# Seconds spent at most on balancing the lanes
+TIME_LIMIT = 5.0
+
+
+def _conflict_graph(groups: list, max_distance: int) -> list:
+    """Set of the linked groups of every group of indexes."""
+    owners = []
+    indexes = []
+    for owner, group in enumerate(groups):
+        for index in group:
+            owners.append(owner)
+            indexes.append(index)
+    links = [set() for _ in groups]
+    for i, j, _ in close_pairs([indexes], max_distance):
+        a, b = owners[i], owners[j]
+        if a != b:
+            links[a].add(b)
+            links[b].add(a)
+    return links
+
+
+def _dsatur(links: list, colours: int, weights: list, balance: bool = True):
+    """Colour the vertices of links with at most colours colours.
+
+    Free colours are taken least loaded first if balance, else lowest first,
+    which keeps the number of colours used low. Returns the colour of every
+    vertex; vertices without a free colour get the colour with the fewest
+    conflicts.
+    """
+    colour_of = [None] * len(links)
+    loads = [0.0] * colours
+    saturation = [set() for _ in links]
+    remaining = set(range(len(links)))
+    while remaining:
+        vertex = max(
+            remaining, key=lambda v: (len(saturation[v]), len(links[v]), weights[v], -v)
+        )
+        remaining.discard(vertex)
+        free = [c for c in range(colours) if c not in saturation[vertex]]
+        if free:
+            colour = min(free, key=lambda c: (loads[c], c)) if balance else free[0]
+        else:
+            colour = min(
+                range(colours),
+                key=lambda c: (
+                    sum(1 for n in links[vertex] if colour_of[n] == c),
+                    loads[c],
+                    c,
+                ),
+            )
+        colour_of[vertex] = colour
+        loads[colour] += weights[vertex]
+        for neighbour in links[vertex]:
+            saturation[neighbour].add(colour)
+    return colour_of
+
+
+def _balance(links: list, colour_of: list, colours: int, weights: list, deadline: float):
+    """Move and swap vertices between colours to lower the highest load, without
+    adding conflicts."""
+    loads = [0.0] * colours
+    members = [set() for _ in range(colours)]
+    for vertex, colour in enumerate(colour_of):
+        loads[colour] += weights[vertex]
+        members[colour].add(vertex)
+
+    def fits(vertex, colour, leaving=None):
+        return all(
+            colour_of[n] != colour or n == leaving for n in links[vertex]
+        )
+
+    def move(vertex, colour):
+        old = colour_of[vertex]
+        members[old].discard(vertex)
+        loads[old] -= weights[vertex]
+        members[colour].add(vertex)
+        loads[colour] += weights[vertex]
+        colour_of[vertex] = colour
+
+    improved = True
+    while improved and time.monotonic() < deadline:
+        improved = False
+        top = max(range(colours), key=lambda c: loads[c])
+        for vertex in sorted(members[top], key=lambda v: -weights[v]):
+            for colour in sorted(range(colours), key=lambda c: loads[c]):
+                if colour == top:
+                    continue
+                if loads[colour] + weights[vertex] < loads[top] and fits(vertex, colour):
+                    move(vertex, colour)
+                    improved = True
+                    break
+                for other in members[colour]:
+                    delta = weights[vertex] - weights[other]
+                    if (
+                        0 < delta
+                        and loads[colour] + delta < loads[top]
+                        and fits(vertex, colour, leaving=other)
+                        and fits(other, top, leaving=vertex)
+                    ):
+                        move(vertex, colour)
+                        move(other, top)
+                        improved = True
+                        break
+                if improved:
+                    break
+            if improved:
+                break
+    return colour_of
+
+
+def split_pool(pool: Pool, max_distance: int = 1) -> list:
+    """Split pool in sub-pools whose samples do not collide.
+
+    Returns [pool] if its samples do not collide. The weight is shared between
+    the sub-pools by their number of samples.
+    """
+    names = list(pool.samples)
+    links = _conflict_graph([pool.samples[name] for name in names], max_distance)
+    if not any(links):
+        return [pool]
+    colour_of = _dsatur(links, len(names), [1.0] * len(names), balance=False)
+    used = sorted(set(colour_of))
+    sub_pools = []
+    for part, colour in enumerate(used, 1):
+        samples = {
+            name: pool.samples[name] for name, c in zip(names, colour_of) if c == colour
+        }
+        sub_pools.append(
+            Pool(
+                "{} ({}/{})".format(pool.name, part, len(used)),
+                samples,
+                pool.weight * len(samples) / len(names),
+                pool.copies,
+            )
+        )
+    return sub_pools
+
+
+def assign_lanes(
+    pools: list, lanes: int, max_distance: int = 1, time_limit: float = TIME_LIMIT
+) -> Assignment:
+    """Propose a placement of pools on lanes without index conflicts, with the
+    expected reads balanced between the lanes."""
+    deadline = time.monotonic() + time_limit
+    splits = {}
+    units = []
+    for pool in pools:
+        sub_pools = split_pool(pool, max_distance)
+        if len(sub_pools) > 1:
+            splits[pool.name] = [sub_pool.name for sub_pool in sub_pools]
+        for sub_pool in sub_pools:
+            for copy in range(sub_pool.copies):
+                name = sub_pool.name
+                if sub_pool.copies > 1:
+                    name = "{} [{}/{}]".format(name, copy + 1, sub_pool.copies)
+                units.append((name, sub_pool, sub_pool.weight / sub_pool.copies))
+
+    groups = [
+        [index for indexes in sub_pool.samples.values() for index in indexes]
+        for _, sub_pool, _ in units
+    ]
+    weights = [weight for _, _, weight in units]
+    links = _conflict_graph(groups, max_distance)
+    colour_of = _dsatur(links, lanes, weights)
+    colour_of = _balance(links, colour_of, lanes, weights, deadline)
+
+    assigned = [[] for _ in range(lanes)]
+    loads = [0.0] * lanes
+    for (name, _, weight), colour in zip(units, colour_of):
+        assigned[colour].append(name)
+        loads[colour] += weight
+    conflicts = [
+        (units[a][0], units[b][0], colour_of[a] + 1)
+        for a in range(len(units))
+        for b in sorted(links[a])
+        if a < b and colour_of[a] == colour_of[b]
+    ]
+    return Assignment(assigned, loads, conflicts, splits)
+
+
+def describe(assignment: Assignment) -> list:
+    """Lines describing assignment, for the logs of a step."""
+    lines = []
+    for pool, sub_pools in sorted(assignment.splits.items()):
+        lines.append(
+            "Pool {} has colliding indexes, split it in {}".format(pool, ", ".join(sub_pools))
+        )
+    for lane, (names, load) in enumerate(zip(assignment.lanes, assignment.loads), 1):
+        lines.append("Lane {}: {} (expected reads {:g})".format(lane, ", ".join(names) or "-", load))
+    for pool_a, pool_b, lane in assignment.conflicts:
+        lines.append(
+            "Pools {} and {} still have close indexes in lane {}".format(pool_a, pool_b, lane)
+        )
+    return lines
@@ -0,0 +1,167 @@
+import re
+from collections import namedtuple
+from html.parser import HTMLParser
+
+from scilifelab_epps.metrics import nas_open
+
+DESC = """This is a submodule for reading the laneBarcode.html report of
+bcl2fastq.
+
+The report is parsed as a stream: iter_rows feeds the file to an HTML event
+parser by chunks and yields a compact LaneBarcodeRow for every row of the
+lane/barcode table as soon as it is complete, with the numeric columns parsed
+once ("1,234" -> 1234), so that the memory use does not grow with the markup of
+the file. The table is read the same way as the LaneBarcodeParser of
+flowcell_parser: it is the third table of the page, and the header cell texts,
+line breaks dropped, name the columns.
+
+The rows of a sample are identified by their lane and sample_key, the NGI
+sample name found in the Sample column (or "Undetermined").
+"""
+
+PROJ_PAT = re.compile(r"(P\w+_\d+)")
+UNDETERMINED = "Undetermined"
+# Position of the lane/barcode table among the tables of the page
+SAMPLE_TABLE = 2
+CHUNK_SIZE = 64 * 1024
+
+LaneBarcodeRow = namedtuple(
+    "LaneBarcodeRow",
+    [
+        "lane",
+        "project",
+        "sample",
+        "barcode",
+        "clusters",
+        "pct_lane",
+        "pct_perfect",
+        "pct_one_mismatch",
+        "yield_mbases",
+        "pct_pf",
+        "pct_q30",
+        "mean_quality",
+        "q30_text",
+    ],
+)
+LaneBarcodeRow.__doc__ = """A row of the lane/barcode table of laneBarcode.html.
+
+clusters     -- int, the PF Clusters column, or Clusters in older reports
+pct_*, yield_mbases, mean_quality
+             -- float, None if the cell is empty or NaN
+q30_text     -- str, the % >= Q30bases cell as written in the report, copied
+                as is to the demux CSV
+"""
+
+
+def parse_int(value: str) -> int:
+    return int(value.replace(",", ""))
+
+
+def parse_float(value: str):
+    """Float of a cell, None if empty or NaN."""
+    if value == "" or value == "NaN":
+        return None
+    return float(value.replace(",", ""))
+
+
+# Header cell text -> (LaneBarcodeRow field, parser)
+COLUMNS = {
+    "Lane": ("lane", str),
+    "Project": ("project", str),
+    "Sample": ("sample", str),
+    "Barcode sequence": ("barcode", str),
+    "PF Clusters": ("clusters", parse_int),
+    "Clusters": ("clusters", parse_int),
+    "% of thelane": ("pct_lane", parse_float),
+    "% Perfectbarcode": ("pct_perfect", parse_float),
+    "% One mismatchbarcode": ("pct_one_mismatch", parse_float),
+    "Yield (Mbases)": ("yield_mbases", parse_float),
+    "% PFClusters": ("pct_pf", parse_float),
+    "% >= Q30bases": ("pct_q30", parse_float),
+    "Mean QualityScore": ("mean_quality", parse_float),
+}
+# Header cell text -> LaneBarcodeRow field keeping the cell text unparsed
+RAW_COLUMNS = {"% >= Q30bases": "q30_text"}
+
+
+def make_row(cells: dict) -> LaneBarcodeRow:
+    """LaneBarcodeRow of the {header: cell text} of a row, as given by the
+    LaneBarcodeParser of flowcell_parser. Missing columns are None."""
+    values = dict.fromkeys(LaneBarcodeRow._fields)
+    for header, text in cells.items():
+        if header in RAW_COLUMNS:
+            values[RAW_COLUMNS[header]] = text
+        if header not in COLUMNS:
+            continue
+        field, parse = COLUMNS[header]
+        try:
+            values[field] = parse(text.strip())
+        except ValueError:
+            raise ValueError("Invalid {} \"{}\" in laneBarcode.html".format(header, text))
+    return LaneBarcodeRow(**values)
+
+
+class _TableParser(HTMLParser):
+    """HTML event handler collecting the rows of the lane/barcode table."""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.tables = 0
+        self.headers = []
+        self.rows = []
+        self._cells = None
+        self._text = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag == "table":
+            self.tables += 1
+        elif self.tables != SAMPLE_TABLE + 1:
+            return
+        elif tag == "tr":
+            self._cells = []
+        elif tag in ("th", "td"):
+            self._text = []
+
+    def handle_endtag(self, tag):
+        if self.tables != SAMPLE_TABLE + 1:
+            return
+        if tag in ("th", "td") and self._text is not None:
+            text = "".join(self._text)
+            if tag == "th":
+                self.headers.append(text.strip())
+            elif self._cells is not None:
+                self._cells.append(text)
+            self._text = None
+        elif tag == "tr" and self._cells:
+            self.rows.append(make_row(dict(zip(self.headers, self._cells))))
+            self._cells = None
+
+    def handle_data(self, data):
+        if self._text is not None:
+            self._text.append(data)
+
+
+def iter_rows(path: str, chunk_size: int = CHUNK_SIZE):
+    """Yield the LaneBarcodeRow of the rows of laneBarcode.html at path, in
+    file order, reading it by chunks. The reads are accounted for as NAS I/O
+    by the active RunMetrics, if any."""
+    parser = _TableParser()
+    with nas_open(path) as f:
+        while True:
+            chunk = f.read(chunk_size)
+            if not chunk:
+                break
+            parser.feed(chunk)
+            yield from parser.rows
+            parser.rows = []
+    parser.close()
+    yield from parser.rows
+
+
+def sample_key(name: str) -> str:
+    """NGI sample name in the Sample column of a row, name if none."""
+    if name == UNDETERMINED:
+        return name
+    match = PROJ_PAT.search(name)
+    return match.group(0) if match else name
+
@@ -0,0 +1,47 @@
+import importlib.util
+import json
+import os
+import sys
+from functools import lru_cache
+
+DESC = """This is a submodule for deferring the cost of imports and data loads
+until they are needed.
+
+EPPs are short-lived processes spawned for every button click, and most code
+paths of a script do not need pandas, numpy, couchdb and the like. A module
+imported with lazy_import() is only loaded the first time one of its attributes
+is accessed:
+
+    pd = lazy_import("pandas")
+
+Data files of the repository are read on first use with load_data_json(), and
+kept for the rest of the run.
+"""
+
+DATA_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+
+
+def lazy_import(name: str):
+    """Return module name, to be loaded on first attribute access.
+
+    If the module is already loaded, it is returned as is. A missing module
+    raises ImportError here, not at first use.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = importlib.util.find_spec(name)
+    if spec is None:
+        raise ImportError("No module named '{}'".format(name), name=name)
+    loader = importlib.util.LazyLoader(spec.loader)
+    spec.loader = loader
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    loader.exec_module(module)
+    return module
+
+
+@lru_cache(maxsize=None)
+def load_data_json(file_name: str):
+    """Parse a JSON file of the data directory of the repository, once per run."""
+    with open(os.path.join(DATA_DIR, file_name), "r") as file:
+        return json.loads(file.read())
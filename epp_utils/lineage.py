@@ -0,0 +1,241 @@
+import json
+
+from genologics.entities import Process
+
+from epp_utils.udf_tools import get_art_tuples
+from scilifelab_epps.step_context import get_batch
+
+DESC = """This is a submodule for walking the artifact lineage of a step
+backwards through its ancestor steps, e.g. to find the last known value of a UDF.
+
+The LineageGraph expands every ancestor step once per run, indexes its
+input/output tuples by artifact id and memoizes lookups, so resolving a UDF for
+all artifacts of a step costs O(depth) requests in total instead of re-expanding
+the same parent steps for every artifact.
+"""
+
+
+class LineageGraph:
+    """Per-run cache of the lineage of artifacts, shared between UDF lookups.
+
+    max_depth limits how many steps back a lookup will go (None = no limit).
+    """
+
+    def __init__(self, max_depth: int = None):
+        self.max_depth = max_depth
+        # Process id -> {artifact id: [art_tuple, ...]}
+        self._tuples = {}
+        # Hop key -> previous hop (process, art_tuple) or None
+        self._previous = {}
+        # (hop key, target udfs) -> (found, value, key of hop where found)
+        self._found = {}
+        # Hop key -> (output history entry, input history entry)
+        self._history = {}
+
+    @staticmethod
+    def _art(art_tuple: tuple, i: int):
+        try:
+            return art_tuple[i]["uri"]
+        except (TypeError, KeyError, IndexError):
+            return None
+
+    def _hop_key(self, process: Process, art_tuple: tuple) -> tuple:
+        input_art = self._art(art_tuple, 0)
+        output_art = self._art(art_tuple, 1)
+        return (
+            process.id,
+            input_art.id if input_art else None,
+            output_art.id if output_art else None,
+        )
+
+    def _index(self, process: Process) -> dict:
+        """Expand the analyte tuples of a process once, indexed by artifact id."""
+        if process.id not in self._tuples:
+            artifacts = [
+                side["uri"]
+                for io in process.input_output_maps
+                for side in io
+                if side and side.get("uri") is not None
+            ]
+            get_batch(process.lims, artifacts)
+
+            index = {}
+            for art_tuple in get_art_tuples(process):
+                ids = {art.id for art in (self._art(art_tuple, 0), self._art(art_tuple, 1)) if art}
+                for art_id in ids:
+                    index.setdefault(art_id, []).append(art_tuple)
+            self._tuples[process.id] = index
+        return self._tuples[process.id]
+
+    def tuples(self, process: Process) -> list:
+        """Analyte I/O tuples of process, sorted as by udf_tools.get_art_tuples."""
+        self._index(process)
+        return get_art_tuples(process)
+
+    def previous(self, process: Process, art_tuple: tuple):
+        """Return the (process, art_tuple) hop that produced the input of art_tuple.
+
+        Returns None if there is no previous step, or if the input artifact
+        does not match exactly one tuple of the previous step.
+        """
+        key = self._hop_key(process, art_tuple)
+        if key not in self._previous:
+            hop = None
+            input_art = self._art(art_tuple, 0)
+            pp = input_art.parent_process if input_art else None
+            if pp:
+                matching = self._index(pp).get(input_art.id, [])
+                if len(matching) == 1:
+                    hop = (pp, matching[0])
+            self._previous[key] = hop
+        return self._previous[key]
+
+    def _history_entries(self, process: Process, art_tuple: tuple) -> tuple:
+        key = self._hop_key(process, art_tuple)
+        if key not in self._history:
+            output_art = self._art(art_tuple, 1)
+            input_art = self._art(art_tuple, 0)
+            out_entry = {}
+            in_entry = {}
+            if output_art:
+                out_entry = {
+                    "Derived sample ID": output_art.id,
+                    "Derived sample UDFs": dict(output_art.udf.items()),
+                }
+            if input_art:
+                if input_art.parent_process:
+                    in_entry.update(
+                        {
+                            "Input sample parent step name": input_art.parent_process.type.name,
+                            "Input sample parent step ID": input_art.parent_process.id,
+                        }
+                    )
+                in_entry.update(
+                    {
+                        "Input sample ID": input_art.id,
+                        "Input sample UDFs": dict(input_art.udf.items()),
+                    }
+                )
+            self._history[key] = (out_entry, in_entry)
+        return self._history[key]
+
+    def _lookup(self, art_tuple: tuple, target_udfs: tuple) -> tuple:
+        """Look for the target UDFs on the output, then on the input, of a tuple.
+
+        Returns (found, value, side) where side is 1 for output and 0 for input.
+        """
+        for side in (1, 0):
+            art = self._art(art_tuple, side)
+            if art:
+                udfs = art.udf
+                for target_udf in target_udfs:
+                    if target_udf in udfs:
+                        return True, udfs[target_udf], side
+        return False, None, None
+
+    def fetch_last(
+        self,
+        currentStep: Process,
+        art_tuple: tuple,
+        target_udfs: str or list,
+        use_current=True,
+        print_history=False,
+        on_fail=AssertionError(),
+    ):
+        """Look for target UDF backwards through the lineage, see udf_tools.fetch_last.
+
+        Target UDF can be supplied as a string, or as a prioritized list of strings.
+
+        If "print_history" == True, will return both the target metric and the lookup history as a string.
+        """
+
+        if type(target_udfs) == str:
+            target_udfs = [target_udfs]
+        target_udfs = tuple(target_udfs)
+
+        path = []
+        found = (False, None, None)
+        hop = (currentStep, art_tuple)
+        while hop is not None:
+            key = self._hop_key(*hop)
+            path.append((key, hop))
+            if len(path) > 1 or use_current:
+                memo = self._found.get((key, target_udfs))
+                if memo is None:
+                    is_found, value, side = self._lookup(hop[1], target_udfs)
+                    if is_found:
+                        memo = (True, value, (key, side))
+                if memo is not None:
+                    found = memo
+                    break
+            if self.max_depth is not None and len(path) > self.max_depth:
+                break
+            hop = self.previous(*hop)
+
+        # Share the outcome with every hop of the path that was looked at, unless
+        # the walk was cut short by max_depth
+        if found[0] or hop is None:
+            for i, (key, _) in enumerate(path):
+                if i > 0 or use_current:
+                    self._found[(key, target_udfs)] = found
+
+        history = []
+        if print_history:
+            history = self._build_history(path, found, use_current)
+
+        if found[0]:
+            if print_history:
+                return found[1], json.dumps(history, indent=2)
+            return found[1]
+
+        if print_history:
+            print(json.dumps(history, indent=2))
+        if issubclass(type(on_fail), BaseException):
+            raise on_fail
+        return on_fail
+
+    def _build_history(self, path: list, found: tuple, use_current: bool) -> list:
+        # Extend the path with memoized hops up to where the UDF was found
+        hops = [hop for _, hop in path]
+        if found[0]:
+            found_key, side = found[2]
+            hop = hops[-1]
+            while self._hop_key(*hop) != found_key:
+                hop = self.previous(*hop)
+                hops.append(hop)
+        else:
+            side = None
+
+        history = []
+        for i, (process, art_tuple) in enumerate(hops):
+            entry = {"Step name": process.type.name, "Step ID": process.id}
+            if i > 0 or use_current:
+                out_entry, in_entry = self._history_entries(process, art_tuple)
+                entry.update(out_entry)
+                if not (i == len(hops) - 1 and side == 1):
+                    entry.update(in_entry)
+            history.append(entry)
+        return history
+
+    def fetch_last_all(
+        self,
+        currentStep: Process,
+        target_udfs: str or list,
+        art_tuples: list = None,
+        use_current=True,
+        on_fail=None,
+    ) -> list:
+        """Resolve target UDF for all analyte tuples of a step in one backward sweep.
+
+        Returns a list of values in the order of art_tuples (defaults to
+        udf_tools.get_art_tuples(currentStep)). Artifacts sharing ancestry share
+        the lookups. on_fail defaults to None, to not stop at the first missing value.
+        """
+        if art_tuples is None:
+            art_tuples = self.tuples(currentStep)
+        return [
+            self.fetch_last(
+                currentStep, art_tuple, target_udfs, use_current=use_current, on_fail=on_fail
+            )
+            for art_tuple in art_tuples
+        ]
@@ -0,0 +1,63 @@
+import re
+from collections import namedtuple
+
+DESC = """This is a submodule for reading the project fields used when building
+the rows of samplesheets and index tables once per project instead of once per
+sample.
+
+Every access to project.udf parses the UDFs of the project XML again, and the
+row builders read several of them for every sample, while a pool is usually
+made of the samples of a handful of projects. The ProjectMemo reads the fields
+of a project the first time one of its samples is seen, with the recipe parsed
+from the sequencing setup, and hands out the same ProjectInfo afterwards.
+"""
+
+SEQSETUP_PAT = re.compile("[0-9]+-[0-9A-z]+-[0-9A-z]+-[0-9]+")
+
+ProjectInfo = namedtuple(
+    "ProjectInfo",
+    ["id", "name", "reference", "seq_setup", "recipe", "library_method", "reads_min"],
+)
+ProjectInfo.__doc__ = """Fields of a project used by the row builders.
+
+recipe         -- read cycles of the sequencing setup, as "<read 1>-<read 2>",
+                  or "0-0" if the setup does not match SEQSETUP_PAT
+library_method -- 'Library construction method' UDF, None if not set
+reads_min      -- 'Reads Min' UDF, reads expected for every sample, None if
+                  not set
+"""
+
+
+def recipe(seq_setup: str) -> str:
+    if SEQSETUP_PAT.findall(seq_setup):
+        return "{}-{}".format(seq_setup.split("-")[0], seq_setup.split("-")[3])
+    return "0-0"
+
+
+class ProjectMemo:
+    """Per-run memo of ProjectInfo by project id."""
+
+    def __init__(self):
+        self._projects = {}
+
+    def project(self, project) -> ProjectInfo:
+        if project.id not in self._projects:
+            udf = project.udf
+            seq_setup = udf.get("Sequencing setup", "")
+            self._projects[project.id] = ProjectInfo(
+                project.id,
+                project.name,
+                udf.get("Reference genome", ""),
+                seq_setup,
+                recipe(seq_setup),
+                udf.get("Library construction method"),
+                udf.get("Reads Min"),
+            )
+        return self._projects[project.id]
+
+    def get(self, sample):
+        """ProjectInfo of the project of sample, None if it has none."""
+        project = sample.project
+        if project is None:
+            return None
+        return self.project(project)
@@ -8,13 +8,20 @@ UDFs in in the Genonolics Clarity LIMS API.
 """
 
 
-def put(art: Artifact, target_udf: str, val, on_fail=AssertionError()):
+def put(art: Artifact, target_udf: str, val, on_fail=AssertionError(), buffer=None):
     """Try to put UDF on artifact, optionally without causing fatal error.
     Evaluates true on success and error (default) or on_fail param on failue.
+
+    If a scilifelab_epps.write_buffer.WriteBuffer is supplied, the artifact is
+    only marked dirty and on_fail is applied when the buffer is flushed.
     """
 
     art.udf[target_udf] = val
 
+    if buffer is not None:
+        buffer.add(art, on_fail=on_fail)
+        return True
+
     try:
         art.put()
         return True
@@ -136,14 +143,28 @@ def fetch_last(
     use_current=True,
     print_history=False,
     on_fail=AssertionError(),
+    lineage=None,
 ):
     """Recursively look for target UDF.
 
     Target UDF can be supplied as a string, or as a prioritized list of strings.
 
     If "print_history" == True, will return both the target metric and the lookup history as a string.
+
+    If an epp_utils.lineage.LineageGraph is supplied as "lineage", the lookup is
+    delegated to it, so that ancestor steps shared between calls are only expanded once.
     """
 
+    if lineage is not None:
+        return lineage.fetch_last(
+            currentStep,
+            art_tuple,
+            target_udfs,
+            use_current=use_current,
+            print_history=print_history,
+            on_fail=on_fail,
+        )
+
     # Convert to list, to enable iteration
     if type(target_udfs) == str:
         target_udfs = [target_udfs]
@@ -0,0 +1,180 @@
+"""asyncio facade over a genologics Lims instance.
+
+For the heaviest EPPs (demux stats, samplesheets, index checks), hundreds of
+artifacts and samples can be resolved concurrently in one event loop instead
+of one request at a time. The facade wraps an existing synchronous Lims: the
+requests are run in a bounded executor over the pooled session of
+scilifelab_epps.fanout, and the entities it fetches are the regular
+genologics instances from lims.cache. Code downstream of a prefetch is thus
+the same for both paths, which is what keeps their output identical.
+
+The async path is opt-in, enabled by setting the SCILIFELAB_EPPS_ASYNC
+environment variable:
+
+    process = async_lims.prefetch_step(lims, pid)
+
+which uses AsyncLims.prefetch_step when enabled, and StepContext otherwise.
+"""
+
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from genologics.entities import Process
+
+from scilifelab_epps.fanout import install_pooled_session, max_workers
+from scilifelab_epps.lims_cache import invalidate
+from scilifelab_epps.step_context import BATCH_SIZE, StepContext, get_batch
+
+ENV_VAR = "SCILIFELAB_EPPS_ASYNC"
+
+
+def enabled():
+    """Return True if the asyncio code path is switched on."""
+    return os.environ.get(ENV_VAR, "").lower() in ("1", "true", "yes")
+
+
+def run(coro):
+    """Run coro to completion in a new event loop and return its result."""
+    return asyncio.run(coro)
+
+
+def prefetch_step(lims, process):
+    """Prefetch a step on the async path if enabled, with a StepContext
+    otherwise, and return its Process."""
+    if not enabled():
+        return StepContext(lims, process).process
+
+    async def _prefetch():
+        async with AsyncLims(lims) as alims:
+            return await alims.prefetch_step(process)
+
+    return run(_prefetch())
+
+
+def replace_files(lims, entity, file_to_upload):
+    """Replace the files of entity by file_to_upload, on the async path if
+    enabled."""
+    if not enabled():
+        for f in entity.files:
+            lims.request_session.delete(f.uri)
+            invalidate(lims, f.uri)
+        uploaded = lims.upload_new_file(entity, file_to_upload)
+        invalidate(lims, entity.uri)
+        return uploaded
+
+    async def _replace():
+        async with AsyncLims(lims) as alims:
+            return await alims.replace_files(entity, file_to_upload)
+
+    return run(_replace())
+
+
+class AsyncLims(object):
+    """Async access to the Clarity REST API through a synchronous Lims.
+
+    Arguments:
+    lims         -- Lims instance
+
+    Keyword Arguments:
+    concurrency  -- maximum number of requests in flight, defaults to the
+                    fan-out cap of scilifelab_epps.fanout
+    batch_size   -- number of entities per batch retrieve request
+    """
+
+    def __init__(self, lims, concurrency=None, batch_size=BATCH_SIZE):
+        self.lims = lims
+        self.concurrency = concurrency or max_workers()
+        self.batch_size = batch_size
+        install_pooled_session(lims, pool_size=self.concurrency)
+        self._executor = ThreadPoolExecutor(max_workers=self.concurrency)
+
+    async def _call(self, func, *args, **kwargs):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, lambda: func(*args, **kwargs))
+
+    async def get(self, uri, params=dict()):
+        """GET uri and return the response XML as an ElementTree."""
+        return await self._call(self.lims.get, uri, params=params)
+
+    async def get_entity(self, entity, force=False):
+        await self._call(entity.get, force=force)
+        return entity
+
+    async def get_entities(self, entities, force=False):
+        """GET every entity not loaded yet, concurrently, once per URI."""
+        unique = {}
+        for entity in entities:
+            if entity is not None and (force or entity.root is None):
+                unique.setdefault(entity.uri, entity)
+        await asyncio.gather(*[self.get_entity(e, force) for e in unique.values()])
+        return entities
+
+    async def get_batch(self, instances, force=False):
+        """Batch retrieve instances, with the chunks requested concurrently."""
+        unique = {}
+        for instance in instances:
+            unique.setdefault(instance.id, []).append(instance)
+        ids = list(unique)
+        chunks = [
+            [i for art_id in ids[n : n + self.batch_size] for i in unique[art_id]]
+            for n in range(0, len(ids), self.batch_size)
+        ]
+        await asyncio.gather(
+            *[self._call(get_batch, self.lims, chunk, force) for chunk in chunks]
+        )
+        return [siblings[0] for siblings in unique.values()]
+
+    async def prefetch_step(self, process):
+        """Async counterpart of StepContext.prefetch; returns the Process."""
+        if not isinstance(process, Process):
+            process = Process(self.lims, id=process)
+        await self.get_entity(process)
+
+        io_artifacts = [
+            side["uri"]
+            for io in process.input_output_maps
+            for side in io
+            if side and side.get("uri") is not None
+        ]
+        artifacts = await self.get_batch(
+            io_artifacts + process.all_inputs() + process.all_outputs()
+        )
+
+        samples = [s for art in artifacts for s in art.samples]
+        containers = [art.location[0] for art in artifacts if art.location]
+        # Parent processes are needed to walk the lineage, e.g. for barcodes
+        parents = [art.parent_process for art in process.all_inputs()]
+        samples, _, _ = await asyncio.gather(
+            self.get_batch(samples),
+            self.get_batch([c for c in containers if c is not None]),
+            self.get_entities(parents),
+        )
+        await self.get_entities([s.project for s in samples])
+        return process
+
+    async def delete(self, uri):
+        response = await self._call(self.lims.request_session.delete, uri)
+        invalidate(self.lims, uri)
+        return response
+
+    async def upload_new_file(self, entity, file_to_upload):
+        """Upload a file and attach it to entity, returns the File."""
+        return await self._call(self.lims.upload_new_file, entity, file_to_upload)
+
+    async def replace_files(self, entity, file_to_upload):
+        """Delete the files attached to entity, then upload a new one."""
+        await asyncio.gather(*[self.delete(f.uri) for f in entity.files])
+        uploaded = await self.upload_new_file(entity, file_to_upload)
+        invalidate(self.lims, entity.uri)
+        return uploaded
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return False
@@ -10,12 +10,11 @@ Copyright (C) 2013 Johannes Alneberg
 import logging
 import sys
 import os
-import pkg_resources
-from pkg_resources import DistributionNotFound
 from shutil import copy
 from requests import HTTPError
 from genologics.entities import Artifact
 from genologics.config import MAIN_LOG
+from scilifelab_epps.metrics import RunMetrics
 from logging.handlers import RotatingFileHandler
 from time import strftime, localtime
 import csv
@@ -47,7 +46,12 @@ def unique_check(l,msg):
     elif len(l)!=1:
         raise NotUniqueError("Multiple items found for {0}".format(msg))
 
-def set_field(element):    
+def set_field(element, buffer=None):
+    """Put element, or mark it dirty in buffer (a WriteBuffer) if given.
+    Failures are logged as warnings and not raised."""
+    if buffer is not None:
+        buffer.add(element, on_fail=None)
+        return
     try:
         element.put()
     except (TypeError, HTTPError) as e:
@@ -66,11 +70,18 @@ class EppLogger(object):
     of the same process from the genologics LIMS GUI, the previous log 
     files can be prepended. Also a main log file can be used that is
     supposed to be common for all scripts executed on the server.
+    The LIMS requests and NAS file I/O of the run are accounted for, and
+    summarized in the logs on exit.
     
     """
 
     PACKAGE = 'genologics'
+    METRICS_ENV_VAR = 'SCILIFELAB_EPPS_METRICS_FILE'
     def __enter__(self):
+        # pkg_resources is slow to import, only pay for it once logging starts
+        import pkg_resources
+        from pkg_resources import DistributionNotFound
+
         logging.info('Executing file: {0}'.format(sys.argv[0]))
         logging.info('with parameters: {0}'.format(sys.argv[1:]))
         try:
@@ -84,6 +95,13 @@ class EppLogger(object):
         return self
 
     def __exit__(self,exc_type,exc_val,exc_tb):
+        self.metrics.uninstrument_io()
+        logging.info(self.metrics.summary())
+        if self.metrics_file:
+            try:
+                self.metrics.write(self.metrics_file)
+            except IOError as e:
+                logging.warning('Metrics could not be written: {0}'.format(e))
         # If no exception has occured in block, turn off logging.
         if not exc_type:
             logging.shutdown()
@@ -92,7 +110,8 @@ class EppLogger(object):
         # Do not repress possible exception
         return False
 
-    def __init__(self,log_file=None,level=logging.INFO,lims=None,prepend=False):
+    def __init__(self,log_file=None,level=logging.INFO,lims=None,prepend=False,
+                 metrics_file=None):
         """ Initialize the logger with custom settings.
 
         Arguments:
@@ -102,11 +121,19 @@ class EppLogger(object):
         level   -- Logging level, default logging.INFO
         lims    -- Lims instance, needed for prepend to work
         prepend -- If True, prepend old log file to new, requires lims
+        metrics_file -- file to write the run metrics to as JSON, defaults
+                        to the SCILIFELAB_EPPS_METRICS_FILE environment variable
         """
         self.lims = lims
         self.log_file = log_file
         self.level = level
         self.prepend = prepend
+        self.metrics_file = metrics_file or os.environ.get(self.METRICS_ENV_VAR)
+
+        self.metrics = RunMetrics()
+        if lims is not None:
+            self.metrics.instrument(lims)
+        self.metrics.instrument_io()
 
         if prepend and self.log_file:
             self.prepend_old_log()
@@ -317,7 +344,9 @@ class CopyField(object):
                     s_field_name will be used.
 
     The copy_udf() function takes a log file as optional argument.
-    If this is given the changes will be logged there.
+    If this is given the changes will be logged there. It also takes an
+    optional WriteBuffer, in which case the destination element is only
+    marked dirty and written when the buffer is flushed.
 
     Written by Maya Brandi and Johannes Alnberg
     """
@@ -344,10 +373,13 @@ class CopyField(object):
             except:
                 return None
 
-    def _set_udf(self, elt, udf_name, val):
+    def _set_udf(self, elt, udf_name, val, buffer=None):
         try:
             elt.udf[udf_name] = val
-            elt.put()
+            if buffer is not None:
+                buffer.add(elt, on_fail=SystemExit(-1))
+            else:
+                elt.put()
             return True
         except (TypeError, HTTPError) as e:
             print("Error while updating element: {0}".format(e), file=sys.stderr)
@@ -380,10 +412,10 @@ class CopyField(object):
         logging.info("Updated {d_elt_type} udf: {d_udf}, from {su} to "
                                                             "{nv}.".format(**d))
 
-    def copy_udf(self, changelog_f = None):
+    def copy_udf(self, changelog_f = None, buffer = None):
         if self.s_field != self.old_dest_udf:
             self._log_before_change(changelog_f)
-            log = self._set_udf(self.d_elt, self.d_udf_name, self.s_field)
+            log = self._set_udf(self.d_elt, self.d_udf_name, self.s_field, buffer)
             self._log_after_change()
             return log
         else:
@@ -0,0 +1,115 @@
+"""Concurrent fan-out of independent LIMS GETs and queries.
+
+Per-artifact lookups such as lims.get_processes(inputartifactlimsid=...) are
+independent of each other but are done one after the other in most scripts.
+fan_out() runs them over a bounded thread pool, sharing one pooled requests
+session with keep-alive and retry/backoff, installed on the Lims instance
+with install_pooled_session().
+
+The concurrency cap defaults to MAX_WORKERS and can be lowered (or raised)
+with the SCILIFELAB_EPPS_MAX_WORKERS environment variable, so that the LIMS
+does not get overloaded.
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+ENV_VAR = "SCILIFELAB_EPPS_MAX_WORKERS"
+MAX_WORKERS = 8
+RETRIES = 3
+BACKOFF_FACTOR = 0.5
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+def max_workers(default=MAX_WORKERS):
+    """Return the concurrency cap, from the environment if set."""
+    try:
+        return max(1, int(os.environ.get(ENV_VAR, default)))
+    except ValueError:
+        return default
+
+
+def pooled_session(pool_size=None, retries=RETRIES, backoff_factor=BACKOFF_FACTOR):
+    """Return a requests Session with a keep-alive connection pool that is at
+    least as large as the thread pool, retrying idempotent requests with
+    exponential backoff on connection errors and 429/5xx responses."""
+    pool_size = pool_size or max_workers()
+    retry = Retry(
+        total=retries,
+        backoff_factor=backoff_factor,
+        status_forcelist=RETRY_STATUSES,
+        allowed_methods=frozenset(["GET", "HEAD"]),
+        raise_on_status=False,
+    )
+    adapter = HTTPAdapter(
+        pool_connections=pool_size, pool_maxsize=pool_size, max_retries=retry
+    )
+    session = requests.Session()
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+    return session
+
+
+def install_pooled_session(lims, pool_size=None, **kwargs):
+    """Replace the request session of lims with a pooled_session, once."""
+    if not getattr(lims, "_pooled_session", False):
+        lims.request_session = pooled_session(pool_size, **kwargs)
+        lims.adapter = lims.request_session.get_adapter("https://")
+        lims._pooled_session = True
+    return lims.request_session
+
+
+def fan_out(func, items, workers=None):
+    """Call func on every item concurrently and return the results in order.
+
+    The first exception raised by func is re-raised, once all calls are done.
+    """
+    items = list(items)
+    workers = min(workers or max_workers(), len(items)) or 1
+    if workers == 1:
+        return [func(item) for item in items]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(func, items))
+
+
+def get_entities(lims, entities, workers=None):
+    """GET the entities that are not yet loaded, concurrently, once each."""
+    install_pooled_session(lims)
+    unique = {}
+    for entity in entities:
+        if entity is not None and entity.root is None:
+            unique.setdefault(entity.uri, entity)
+    fan_out(lambda e: e.get(), unique.values(), workers)
+    return entities
+
+
+def get_processes_per_artifact(lims, artifact_ids, workers=None, **kwargs):
+    """Run lims.get_processes(inputartifactlimsid=id, **kwargs) for every id
+    concurrently and return a dict of id -> list of processes."""
+    install_pooled_session(lims)
+    artifact_ids = list(dict.fromkeys(artifact_ids))
+    results = fan_out(
+        lambda art_id: lims.get_processes(inputartifactlimsid=art_id, **kwargs),
+        artifact_ids,
+        workers,
+    )
+    return dict(zip(artifact_ids, results))
+
+
+def workflow_stages_per_artifact(lims, artifacts, workers=None):
+    """Return a dict of artifact id -> workflow_stages_and_statuses, with the
+    artifacts, stages and workflows involved fetched concurrently."""
+    artifacts = list(artifacts)
+    get_entities(lims, artifacts, workers)
+    stages = {art.id: art.workflow_stages_and_statuses for art in artifacts}
+    get_entities(lims, [s[0] for art_stages in stages.values() for s in art_stages], workers)
+    get_entities(
+        lims,
+        [s[0].workflow for art_stages in stages.values() for s in art_stages],
+        workers,
+    )
+    return stages
@@ -0,0 +1,237 @@
+"""Offline audit of index collisions in the samplesheets written so far.
+
+Reads the samplesheets that samplesheet_generator wrote to the NAS, one
+directory per platform and year, and reports, for every flowcell and lane, the
+pairs of indexes that are identical or one mismatch apart, the same way
+samplesheet_generator.check_index_distance checks a lane before writing it
+(index and index2 concatenated, compared over the length of the shorter).
+No LIMS request is made. The files are parsed and checked in a process pool
+and the report is written as they come in, so thousands of samplesheets can be
+audited in one go:
+
+    python -m scilifelab_epps.index_audit [--years 2023 2024] [--out report.tsv]
+
+To check a new index kit against past pooling patterns, give its indexes with
+--index SEQ[-SEQ2] or --kit NAME (10X and SMARTSEQ3 kits, see
+epp_utils.index_registry): they are added to every lane, and only the pairs
+involving them are reported. The NovaSeq samplesheets hold the i5 index as read
+for the Reagent Version of the flowcell, reverse-complemented for v1.0
+reagents, and the version is not written in the sheet: in those lanes the
+candidates are added in both orientations, the reverse-complemented ones named
+"<candidate i5 rc>" in the report.
+
+The report is tab-separated, one row per pair, or one row per lane with
+--summary.
+"""
+
+import csv
+import os
+import sys
+from argparse import ArgumentParser
+from multiprocessing import Pool
+
+from epp_utils.barcodes import TENX_SINGLE_PAT
+from epp_utils.index_distance import close_pairs
+
+ROOT = "/srv/ngi-nas-ns/samplesheets"
+PLATFORMS = ("novaseq", "NovaSeqXPlus", "nextseq")
+PAIR_COLUMNS = (
+    "platform",
+    "year",
+    "flowcell",
+    "lane",
+    "sample_a",
+    "index_a",
+    "sample_b",
+    "index_b",
+    "distance",
+    "kind",
+)
+SUMMARY_COLUMNS = (
+    "platform",
+    "year",
+    "flowcell",
+    "lane",
+    "entries",
+    "collisions",
+    "similar",
+    "error",
+)
+# Sample name of the indexes given on the command line
+CANDIDATE = "<candidate>"
+# Sample name of the candidates with their i5 index reverse-complemented
+CANDIDATE_RC = "<candidate i5 rc>"
+# Platforms whose samplesheets may hold reverse-complemented i5 indexes
+RC_I5_PLATFORMS = ("novaseq",)
+COMPLEMENT = {"A": "T", "C": "G", "G": "C", "T": "A"}
+
+
+def find_samplesheets(root=ROOT, platforms=PLATFORMS, years=None):
+    """Yield (platform, year, path) of the samplesheets under root, sorted."""
+    for platform in platforms:
+        platform_dir = os.path.join(root, platform)
+        if not os.path.isdir(platform_dir):
+            continue
+        for year in sorted(os.listdir(platform_dir)):
+            if years and year not in years:
+                continue
+            year_dir = os.path.join(platform_dir, year)
+            if not os.path.isdir(year_dir):
+                continue
+            for name in sorted(os.listdir(year_dir)):
+                if name.endswith(".csv"):
+                    yield platform, year, os.path.join(year_dir, name)
+
+
+def _field(row, columns, name):
+    position = columns.get(name)
+    return row[position] if position is not None and position < len(row) else ""
+
+
+def read_lanes(path):
+    """Return {(flowcell, lane): [(sample, index), ...]} of a samplesheet.
+
+    The index is index and index2 concatenated, as in check_index_distance.
+    Sections before the column header row, if any, are skipped.
+    """
+    lanes = {}
+    default_flowcell = os.path.splitext(os.path.basename(path))[0]
+    with open(path, newline="") as f:
+        reader = csv.reader(f)
+        columns = None
+        for row in reader:
+            if columns is None:
+                if "Lane" in row and "index" in row:
+                    columns = {name: i for i, name in enumerate(row)}
+                continue
+            if not row or row[0].startswith("["):
+                break
+            flowcell = _field(row, columns, "FCID") or default_flowcell
+            sample = _field(row, columns, "Sample_ID") or _field(row, columns, "Sample_Name")
+            index = _field(row, columns, "index") + _field(row, columns, "index2")
+            lane = _field(row, columns, "Lane")
+            lanes.setdefault((flowcell, lane), []).append((sample, index))
+    if columns is None:
+        raise ValueError("No Lane and index columns")
+    return lanes
+
+
+def audit_file(job):
+    """Audit one samplesheet, return (pair rows, summary rows)."""
+    platform, year, path, candidates = job
+    pair_rows = []
+    summary_rows = []
+    try:
+        lanes = read_lanes(path)
+    except (OSError, ValueError, csv.Error) as e:
+        name = os.path.splitext(os.path.basename(path))[0]
+        summary_rows.append((platform, year, name, "", 0, 0, 0, str(e)))
+        return pair_rows, summary_rows
+    added = lane_candidates(candidates, platform)
+    for (flowcell, lane), samples in sorted(lanes.items()):
+        entries = samples + added
+        collisions = similar = 0
+        for i, j, d in close_pairs([[index for _, index in entries]]):
+            sample_a, index_a = entries[i]
+            sample_b, index_b = entries[j]
+            if candidates and not {sample_a, sample_b} & {CANDIDATE, CANDIDATE_RC}:
+                continue
+            if {sample_a, sample_b} <= {CANDIDATE, CANDIDATE_RC}:
+                continue
+            kind = "collision" if d == 0 else "similar"
+            if d == 0:
+                collisions += 1
+            else:
+                similar += 1
+            pair_rows.append(
+                (platform, year, flowcell, lane, sample_a, index_a, sample_b, index_b, d, kind)
+            )
+        summary_rows.append(
+            (platform, year, flowcell, lane, len(samples), collisions, similar, "")
+        )
+    return pair_rows, summary_rows
+
+
+def candidate_indexes(indexes=(), kits=()):
+    """(i7, i5) indexes of the --index and --kit arguments, i5 empty for single
+    indexes."""
+    candidates = []
+    for index in indexes:
+        i7, _, i5 = index.upper().partition("-")
+        candidates.append((i7, i5))
+    if kits:
+        from epp_utils.index_registry import registry
+
+        for name in kits:
+            value = registry()[name]
+            if value and isinstance(value[0], list):
+                # SMARTSEQ3, every i7 with every i5
+                candidates += [(i7, i5) for i7 in value[0] for i5 in value[1]]
+            elif TENX_SINGLE_PAT.match(name):
+                # 10X single index set, one entry per oligo
+                candidates += [(i7, "") for i7 in value]
+            else:
+                candidates.append((value[0], value[1]))
+    return candidates
+
+
+def reverse_complement(seq):
+    return "".join(reversed([COMPLEMENT.get(base, base) for base in seq]))
+
+
+def lane_candidates(candidates, platform):
+    """(sample, index) entries of the candidates in a lane of platform, with
+    the indexes concatenated as in read_lanes.
+
+    On the platforms of RC_I5_PLATFORMS, the dual index candidates are also
+    given with their i5 reverse-complemented.
+    """
+    entries = [(CANDIDATE, i7 + i5) for i7, i5 in candidates]
+    if platform in RC_I5_PLATFORMS:
+        entries += [
+            (CANDIDATE_RC, i7 + reverse_complement(i5)) for i7, i5 in candidates if i5
+        ]
+    return entries
+
+
+def main(args):
+    candidates = candidate_indexes(args.index, args.kit)
+    jobs = (
+        (platform, year, path, candidates)
+        for platform, year, path in find_samplesheets(args.root, args.platforms, args.years)
+    )
+    out = open(args.out, "w", newline="") if args.out else sys.stdout
+    try:
+        writer = csv.writer(out, delimiter="\t", lineterminator="\n")
+        writer.writerow(SUMMARY_COLUMNS if args.summary else PAIR_COLUMNS)
+        with Pool(args.processes) as pool:
+            for pair_rows, summary_rows in pool.imap(audit_file, jobs, chunksize=16):
+                writer.writerows(summary_rows if args.summary else pair_rows)
+                for platform, year, flowcell, _, _, _, _, error in summary_rows:
+                    if error:
+                        print(
+                            "Cannot audit {0}/{1}/{2}: {3}".format(platform, year, flowcell, error),
+                            file=sys.stderr,
+                        )
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--root", default=ROOT, help="Samplesheet directory")
+    parser.add_argument(
+        "--platforms", nargs="+", default=PLATFORMS, help="Platform directories"
+    )
+    parser.add_argument("--years", nargs="+", help="Years to audit, default all")
+    parser.add_argument(
+        "--index", nargs="+", default=[], help="Candidate indexes, as SEQ or SEQ-SEQ2"
+    )
+    parser.add_argument("--kit", nargs="+", default=[], help="Candidate index kits")
+    parser.add_argument(
+        "--summary", action="store_true", help="One row per lane instead of per pair"
+    )
+    parser.add_argument("--processes", type=int, help="Worker processes, default all CPUs")
+    parser.add_argument("--out", help="Report file, default stdout")
+    main(parser.parse_args())
@@ -0,0 +1,295 @@
+"""Optional persistent cache of LIMS entity XML.
+
+Several EPP scripts are triggered back to back on the same step, and each of
+them downloads the same process, artifacts, samples and projects again. The
+LimsCache keeps the XML of every entity fetched by URI in an sqlite database,
+so that later scripts can reuse it:
+
+- entries are revalidated with If-None-Match / If-Modified-Since when the
+  server sent an ETag or Last-Modified header, and refetched otherwise, so that
+  edits made in the LIMS between two runs are seen
+- with a TTL (0 by default), entries younger than the TTL are served without
+  a round-trip, which is only safe when the step is not edited in between
+- entities matching an immutable prefix (reagent types, container types, ...),
+  the steps and processes of completed steps, the containers of the outputs of
+  completed steps, and entities explicitly marked immutable are always served
+  from the cache; a process is known to be completed from the current-state
+  of its step, fetched (once, through the cache) along with the process
+- entities written through the same Lims instance (PUT, POST, batch update,
+  DELETE) are invalidated, writes done outside of it are dropped with
+  invalidate()
+
+Query GETs (with parameters) are never cached, since their result changes when
+entities are created.
+
+The cache is installed on a Lims instance with install_cache(), or through
+cache_from_env() which only does so when the SCILIFELAB_EPPS_LIMS_CACHE
+environment variable is set (to a database path, or to 1 for the default path,
+in the cache directory of the user).
+"""
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+from xml.etree import ElementTree
+
+import requests
+from genologics.lims import TIMEOUT
+
+ENV_VAR = "SCILIFELAB_EPPS_LIMS_CACHE"
+DEFAULT_PATH = os.path.join(
+    os.path.expanduser("~"), ".cache", "scilifelab_epps", "lims_cache.sqlite"
+)
+# Mutable entities are revalidated on every GET unless a TTL is set
+DEFAULT_TTL = 0
+IMMUTABLE_PREFIXES = (
+    "reagenttypes/",
+    "containertypes/",
+    "processtypes/",
+    "configuration/",
+    "instruments/",
+)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS entities (
+    uri TEXT PRIMARY KEY,
+    body BLOB NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    fetched REAL NOT NULL,
+    immutable INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS immutable_uris (
+    uri TEXT PRIMARY KEY
+)
+"""
+
+
+class LimsCache(object):
+    """sqlite backed store of entity XML keyed by URI.
+
+    Keyword Arguments:
+    path   -- sqlite database file, created with user-only permissions
+    ttl    -- seconds during which a mutable entry is served without
+              revalidation, 0 to always revalidate
+    """
+
+    def __init__(self, path=DEFAULT_PATH, ttl=DEFAULT_TTL):
+        self.path = path
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.revalidated = 0
+        # The connection is shared with the fan-out and async worker threads
+        self._lock = threading.RLock()
+        directory = os.path.dirname(os.path.abspath(path))
+        if not os.path.isdir(directory):
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+        # The cache holds LIMS data, do not make it readable to others, and
+        # do not follow a symlink planted at its path
+        os.close(os.open(path, os.O_CREAT | os.O_WRONLY | os.O_NOFOLLOW, 0o600))
+        self.db = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self.db.executescript(_SCHEMA)
+        self.db.commit()
+
+    def lookup(self, uri):
+        """Return (body, etag, last_modified, fresh) or None if uri is not cached."""
+        with self._lock:
+            row = self.db.execute(
+                "SELECT body, etag, last_modified, fetched, immutable FROM entities "
+                "WHERE uri = ?",
+                (uri,),
+            ).fetchone()
+        if row is None:
+            return None
+        body, etag, last_modified, fetched, immutable = row
+        fresh = bool(immutable) or time.time() - fetched < self.ttl
+        return body, etag, last_modified, fresh
+
+    def store(self, uri, body, etag=None, last_modified=None, immutable=False):
+        immutable = (
+            immutable
+            or any(p in uri for p in IMMUTABLE_PREFIXES)
+            or self.is_immutable(uri)
+        )
+        with self._lock, self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO entities "
+                "(uri, body, etag, last_modified, fetched, immutable) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (uri, body, etag, last_modified, time.time(), int(immutable)),
+            )
+
+    def touch(self, uri):
+        with self._lock, self.db:
+            self.db.execute(
+                "UPDATE entities SET fetched = ? WHERE uri = ?", (time.time(), uri)
+            )
+
+    def mark_immutable(self, uri):
+        """Serve uri from the cache from now on, e.g. for a closed process,
+        whether it is already cached or not."""
+        with self._lock, self.db:
+            self.db.execute("INSERT OR IGNORE INTO immutable_uris (uri) VALUES (?)", (uri,))
+            self.db.execute("UPDATE entities SET immutable = 1 WHERE uri = ?", (uri,))
+
+    def is_immutable(self, uri):
+        with self._lock:
+            return (
+                self.db.execute("SELECT 1 FROM immutable_uris WHERE uri = ?", (uri,)).fetchone()
+                is not None
+            )
+
+    def note_closed(self, root):
+        """Mark the entities known to be final from the XML root of an entity:
+        a completed step and its process, and the container of an artifact
+        output by a completed step."""
+        tag = root.tag.split("}")[-1]
+        if tag == "step" and root.get("current-state", "").lower() == "completed":
+            step_uri = root.get("uri", "")
+            self.mark_immutable(step_uri)
+            self.mark_immutable(step_uri.replace("/steps/", "/processes/"))
+        elif tag == "artifact":
+            parent = root.find("parent-process")
+            container = root.find("location/container")
+            if (
+                parent is not None
+                and container is not None
+                and self.is_immutable(parent.get("uri", ""))
+            ):
+                self.mark_immutable(container.get("uri"))
+
+    def invalidate(self, uri):
+        """Drop uri, along with the entries of the same entity in other states."""
+        stateless = uri.split("?")[0]
+        with self._lock, self.db:
+            self.db.execute(
+                "DELETE FROM entities WHERE uri = ? OR uri LIKE ?",
+                (stateless, stateless + "?%"),
+            )
+
+    def clear(self):
+        with self._lock, self.db:
+            self.db.execute("DELETE FROM entities")
+            self.db.execute("DELETE FROM immutable_uris")
+
+    def close(self):
+        self.db.close()
+
+
+def invalidate(lims, *uris):
+    """Drop uris from the cache installed on lims, if any, e.g. after writes
+    done through lims.request_session."""
+    cache = getattr(lims, "lims_cache", None)
+    if cache is not None:
+        for uri in uris:
+            cache.invalidate(uri)
+
+
+def _written_uris(uri, data):
+    """URIs of the entities affected by a PUT/POST of data to uri."""
+    if not uri.rstrip("/").endswith("batch/update"):
+        return [uri]
+    try:
+        root = ElementTree.fromstring(data)
+    except ElementTree.ParseError:
+        return []
+    return [node.attrib["uri"] for node in root if "uri" in node.attrib]
+
+
+def install_cache(lims, path=DEFAULT_PATH, ttl=DEFAULT_TTL):
+    """Make entity GETs of lims go through a LimsCache and return the cache.
+
+    Writes done through lims invalidate the written entities.
+    """
+    cache = LimsCache(path, ttl=ttl)
+    # Processes without a step (404), not looked up again during the run
+    stepless = set()
+    original_get = lims.get
+    original_put = lims.put
+    original_post = lims.post
+    original_delete = lims.delete
+
+    def check_closed(uri, root):
+        cache.note_closed(root)
+        if root.tag.split("}")[-1] == "process" and uri not in stepless:
+            try:
+                # Marks the process immutable if its step is completed
+                get(uri.replace("/processes/", "/steps/"))
+            except requests.exceptions.HTTPError:
+                stepless.add(uri)
+
+    def get(uri, params=dict()):
+        if params:
+            return original_get(uri, params=params)
+        cached = cache.lookup(uri)
+        headers = {"accept": "application/xml"}
+        if cached is not None:
+            body, etag, last_modified, fresh = cached
+            if fresh:
+                cache.hits += 1
+                return ElementTree.fromstring(body)
+            if etag:
+                headers["If-None-Match"] = etag
+            if last_modified:
+                headers["If-Modified-Since"] = last_modified
+        try:
+            r = lims.request_session.get(
+                uri,
+                auth=(lims.username, lims.password),
+                headers=headers,
+                timeout=TIMEOUT,
+            )
+        except requests.exceptions.Timeout as e:
+            raise type(e)("{0}, Error trying to reach {1}".format(str(e), uri))
+        if r.status_code == 304 and cached is not None:
+            cache.revalidated += 1
+            cache.touch(uri)
+            root = ElementTree.fromstring(cached[0])
+        else:
+            cache.misses += 1
+            root = lims.parse_response(r)
+            cache.store(
+                uri, r.content, r.headers.get("ETag"), r.headers.get("Last-Modified")
+            )
+        check_closed(uri, root)
+        return root
+
+    def put(uri, data, params=dict()):
+        cache.invalidate(uri)
+        return original_put(uri, data, params=params)
+
+    def post(uri, data, params=dict()):
+        for written in _written_uris(uri, data):
+            cache.invalidate(written)
+        return original_post(uri, data, params=params)
+
+    def delete(uri, params=dict()):
+        cache.invalidate(uri)
+        return original_delete(uri, params=params)
+
+    lims.get = get
+    lims.put = put
+    lims.post = post
+    lims.delete = delete
+    lims.lims_cache = cache
+    return cache
+
+
+def cache_from_env(lims):
+    """Install the cache if the SCILIFELAB_EPPS_LIMS_CACHE variable is set.
+
+    Returns the LimsCache, or None if caching is not enabled.
+    """
+    setting = os.environ.get(ENV_VAR, "")
+    if setting.lower() in ("", "0", "false", "no"):
+        return None
+    path = DEFAULT_PATH if setting.lower() in ("1", "true", "yes") else setting
+    ttl = float(os.environ.get(ENV_VAR + "_TTL", DEFAULT_TTL))
+    try:
+        return install_cache(lims, path=path, ttl=ttl)
+    except (sqlite3.Error, OSError) as e:
+        logging.warning("LIMS cache disabled, unable to open {0}: {1}".format(path, e))
+        return None
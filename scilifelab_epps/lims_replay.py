@@ -0,0 +1,374 @@
+"""Record and replay of the LIMS REST exchanges of an EPP run.
+
+Benchmarking or profiling the EPPs normally needs a live Clarity server. This
+module captures every exchange of a real run into a fixture directory, and
+serves it back from a local stand-in HTTP server, with a configurable latency
+per request to emulate production round-trip times.
+
+Record a run against the real LIMS (which it talks to as usual, writes
+included):
+
+    python -m scilifelab_epps.lims_replay record --fixture fx/demux_384 -- \\
+        scripts/manage_demux_stats.py --pid 24-123456 ...
+
+Replay it offline, with 40 ms per request, and report request count and wall
+time:
+
+    python -m scilifelab_epps.lims_replay replay --fixture fx/demux_384 \\
+        --latency 0.04 -- scripts/manage_demux_stats.py --pid 24-123456 ...
+
+The server can also be started on its own with the serve command, and a script
+pointed at it with the run command. No change to the scripts is needed: the
+runner patches genologics.lims.Lims in its own process before running the
+script, so that all instances record, or talk to the stand-in server.
+
+Fixture layout:
+    meta.json       -- base URI of the recorded server
+    exchanges.jsonl -- one line per exchange, in order: method, path, request
+                       body digest, status, content type and body file
+    bodies/         -- the response bodies
+
+Recording into an existing fixture replaces it. Credentials and request
+headers are not recorded.
+"""
+
+import hashlib
+import io
+import json
+import logging
+import os
+import random
+import runpy
+import shutil
+import sys
+import threading
+import time
+from argparse import ArgumentParser
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+from genologics.lims import Lims
+
+META = "meta.json"
+EXCHANGES = "exchanges.jsonl"
+BODIES = "bodies"
+# Stands in for the server address in digests of request bodies, so that
+# bodies holding URIs match whichever server they were sent to
+BASE_PLACEHOLDER = "{BASEURI}/"
+
+
+def _request_key(url):
+    """Path and sorted query string of url, the server address left out."""
+    parts = urlsplit(url)
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return parts.path + ("?" + query if query else "")
+
+
+def _body_digest(body, baseuri):
+    if not body:
+        return None
+    if isinstance(body, str):
+        body = body.encode("utf-8")
+    if not isinstance(body, bytes):
+        return None
+    body = body.replace(baseuri.encode("utf-8"), BASE_PLACEHOLDER.encode("utf-8"))
+    return hashlib.sha1(body).hexdigest()
+
+
+class Recorder(object):
+    """Writes the exchanges of Lims instances to a fixture directory.
+
+    A fixture holds a single run: recording into an existing fixture replaces
+    its exchanges and bodies.
+    """
+
+    def __init__(self, fixture):
+        self.fixture = fixture
+        self.count = 0
+        self._lock = threading.Lock()
+        shutil.rmtree(os.path.join(fixture, BODIES), ignore_errors=True)
+        if os.path.exists(os.path.join(fixture, META)):
+            os.remove(os.path.join(fixture, META))
+        os.makedirs(os.path.join(fixture, BODIES))
+        self._index = open(os.path.join(fixture, EXCHANGES), "w")
+
+    def record(self, lims, response):
+        request = response.request
+        # Reading the content consumes streamed responses, put it back for
+        # Lims.get_file_contents, which hands out response.raw
+        content = response.content
+        response.raw = io.BytesIO(content)
+        with self._lock:
+            if not os.path.exists(os.path.join(self.fixture, META)):
+                with open(os.path.join(self.fixture, META), "w") as meta:
+                    json.dump({"baseuri": lims.baseuri}, meta)
+            body_file = os.path.join(BODIES, "{0:06d}".format(self.count))
+            with open(os.path.join(self.fixture, body_file), "wb") as f:
+                f.write(content)
+            exchange = {
+                "method": request.method,
+                "path": _request_key(request.url),
+                "digest": _body_digest(request.body, lims.baseuri),
+                "status": response.status_code,
+                "content_type": response.headers.get("Content-Type"),
+                "body": body_file,
+            }
+            self._index.write(json.dumps(exchange) + "\n")
+            self._index.flush()
+            self.count += 1
+
+    def close(self):
+        self._index.close()
+
+
+def install_recorder(fixture):
+    """Make every Lims instance record its exchanges into fixture.
+
+    All requests of genologics go through Lims.validate_response, which is
+    wrapped at class level. Returns the Recorder.
+    """
+    recorder = Recorder(fixture)
+    original = Lims.validate_response
+
+    def validate_response(self, response, accept_status_codes=[200]):
+        recorder.record(self, response)
+        return original(self, response, accept_status_codes)
+
+    Lims.validate_response = validate_response
+    return recorder
+
+
+def redirect_lims(url):
+    """Make every Lims instance created from now on talk to url."""
+    original = Lims.__init__
+
+    def __init__(self, baseuri, username, password, *args, **kwargs):
+        original(self, url, username or "replay", password or "replay", *args, **kwargs)
+
+    Lims.__init__ = __init__
+
+
+class Fixture(object):
+    """Recorded exchanges, looked up by method, path and request body."""
+
+    def __init__(self, fixture):
+        self.fixture = fixture
+        with open(os.path.join(fixture, META)) as meta:
+            self.baseuri = json.load(meta)["baseuri"]
+        self._exact = {}
+        self._by_path = {}
+        self._served = {}
+        self._lock = threading.Lock()
+        with open(os.path.join(fixture, EXCHANGES)) as index:
+            for line in index:
+                exchange = json.loads(line)
+                exact = (exchange["method"], exchange["path"], exchange["digest"])
+                self._exact.setdefault(exact, []).append(exchange)
+                path = (exchange["method"], exchange["path"])
+                self._by_path.setdefault(path, []).append(exchange)
+
+    def _next(self, key, exchanges):
+        # Replay repeated requests in the recorded order, the last one sticks
+        with self._lock:
+            n = self._served.get(key, 0)
+            self._served[key] = n + 1
+        return exchanges[min(n, len(exchanges) - 1)]
+
+    def lookup(self, method, path, digest):
+        """Return (status, content type, body) or None if not recorded."""
+        exact = (method, path, digest)
+        if exact in self._exact:
+            exchange = self._next(exact, self._exact[exact])
+        elif (method, path) in self._by_path:
+            exchange = self._next((method, path), self._by_path[(method, path)])
+        else:
+            return None
+        with open(os.path.join(self.fixture, exchange["body"]), "rb") as f:
+            body = f.read()
+        return exchange["status"], exchange["content_type"], body
+
+
+class ReplayServer(ThreadingHTTPServer):
+    """Local stand-in for the LIMS, serving a Fixture.
+
+    Keyword Arguments:
+    latency  -- seconds added to every request
+    jitter   -- up to that many seconds added at random on top of latency
+    """
+
+    daemon_threads = True
+
+    def __init__(self, fixture, host="127.0.0.1", port=0, latency=0.0, jitter=0.0):
+        self.fixture = Fixture(fixture)
+        self.latency = latency
+        self.jitter = jitter
+        self.requests = {}
+        self.unmatched = []
+        self._stats_lock = threading.Lock()
+        ThreadingHTTPServer.__init__(self, (host, port), _ReplayHandler)
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return "http://{0}:{1}/".format(host, port)
+
+    def count(self, method, path, matched):
+        with self._stats_lock:
+            self.requests[method] = self.requests.get(method, 0) + 1
+            if not matched:
+                self.unmatched.append("{0} {1}".format(method, path))
+
+    def summary(self):
+        total = sum(self.requests.values())
+        methods = ", ".join(
+            "{0} {1}".format(n, method) for method, n in sorted(self.requests.items())
+        )
+        return "{0} requests ({1}), {2} not in the fixture".format(
+            total, methods or "none", len(self.unmatched)
+        )
+
+    def start(self):
+        """Serve from a background thread and return the server."""
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return self
+
+
+class _ReplayHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def _reply(self):
+        server = self.server
+        length = int(self.headers.get("Content-Length") or 0)
+        body = self.rfile.read(length) if length else None
+        path = _request_key(self.path)
+        digest = _body_digest(body, server.url)
+        if server.latency or server.jitter:
+            time.sleep(server.latency + random.uniform(0, server.jitter))
+
+        found = server.fixture.lookup(self.command, path, digest)
+        server.count(self.command, path, found is not None)
+        if found is None:
+            logging.warning("Not in the fixture: {0} {1}".format(self.command, path))
+            if self.command == "PUT" and body:
+                # Writes that were not recorded are accepted and echoed
+                status, content_type, content = 200, "application/xml", body
+            else:
+                status, content_type, content = 404, "text/plain", b"Not recorded"
+        else:
+            status, content_type, content = found
+            content = content.replace(
+                server.fixture.baseuri.encode("utf-8"), server.url.encode("utf-8")
+            )
+
+        self.send_response(status)
+        if content_type:
+            self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    do_GET = do_PUT = do_POST = do_DELETE = _reply
+
+    def log_message(self, format, *args):
+        logging.debug(format % args)
+
+
+def run_script(script, args):
+    """Run an EPP script as __main__ with args, return its wall time."""
+    script = os.path.abspath(script)
+    sys.argv = [script] + list(args)
+    # Scripts import their siblings and the repository packages
+    sys.path[:0] = [os.path.dirname(script), os.path.dirname(os.path.dirname(script))]
+    start = time.time()
+    try:
+        runpy.run_path(script, run_name="__main__")
+    except SystemExit as e:
+        if e.code not in (None, 0):
+            logging.warning("{0} exited with {1}".format(script, e.code))
+    return time.time() - start
+
+
+def _script_args(args):
+    if not args.command:
+        raise SystemExit("No script given")
+    return args.command[0], args.command[1:]
+
+
+def main(args):
+    if args.mode == "serve":
+        server = ReplayServer(
+            args.fixture, port=args.port, latency=args.latency, jitter=args.jitter
+        )
+        print("Replaying {0} on {1}".format(args.fixture, server.url))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        print(server.summary())
+        return
+
+    script, script_args = _script_args(args)
+    if args.mode == "record":
+        recorder = install_recorder(args.fixture)
+        wall_time = run_script(script, script_args)
+        recorder.close()
+        print(
+            "Recorded {0} requests in {1:.2f} s to {2}".format(
+                recorder.count, wall_time, args.fixture
+            )
+        )
+    elif args.mode == "run":
+        redirect_lims(args.url)
+        wall_time = run_script(script, script_args)
+        print("Ran {0} in {1:.2f} s".format(os.path.basename(script), wall_time))
+    elif args.mode == "replay":
+        server = ReplayServer(
+            args.fixture, port=args.port, latency=args.latency, jitter=args.jitter
+        ).start()
+        redirect_lims(server.url)
+        wall_time = run_script(script, script_args)
+        server.shutdown()
+        print(
+            "Ran {0} in {1:.2f} s: {2}".format(
+                os.path.basename(script), wall_time, server.summary()
+            )
+        )
+        for request in server.unmatched:
+            print("  not in the fixture: {0}".format(request))
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(
+        description=__doc__.split("\n\n")[0],
+        usage="%(prog)s {record,replay,serve,run} [options] -- script.py [args]",
+    )
+    parser.add_argument(
+        "mode", choices=["record", "replay", "serve", "run"], help="What to do"
+    )
+    parser.add_argument("--fixture", help="Fixture directory")
+    parser.add_argument(
+        "--url", help="Base URI of a running replay server, for the run mode"
+    )
+    parser.add_argument(
+        "--port", type=int, default=0, help="Port of the replay server, 0 = any"
+    )
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="Seconds added to every request"
+    )
+    parser.add_argument(
+        "--jitter",
+        type=float,
+        default=0.0,
+        help="Up to that many seconds added at random to every request",
+    )
+    # Everything after -- is the script to run and its arguments
+    argv = sys.argv[1:]
+    split = argv.index("--") if "--" in argv else len(argv)
+    args = parser.parse_args(argv[:split])
+    args.command = argv[split + 1 :]
+    if args.mode != "run" and not args.fixture:
+        parser.error("--fixture is required for {0}".format(args.mode))
+    if args.mode == "run" and not args.url:
+        parser.error("--url is required for run")
+    main(args)
@@ -0,0 +1,265 @@
+"""Request accounting and latency instrumentation of an EPP run.
+
+RunMetrics counts the LIMS requests of a Lims instance per method, the bytes
+sent and received, and keeps a latency histogram per entity type (artifacts,
+samples, artifacts/batch, ...). It also times file I/O under the NGI NAS
+mount, which is often the other place where an EPP spends its time: the scripts
+open their NAS files with nas_open, or time the code reading or writing them
+with nas_io, which account for the run of the active RunMetrics, if any.
+
+EppLogger installs it on the Lims it is given and writes a one line summary to
+the individual and main logs on exit, e.g.
+
+    LIMS requests: 412 (400 GET, 12 PUT), 3.1 MB in, 0.2 MB out, 18.40 s;
+    artifacts 380 GET; samples 20 GET; NAS I/O: 2 files, 0.35 s
+
+The full metrics can also be written as JSON, see RunMetrics.write.
+"""
+
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from urllib.parse import urlsplit
+
+NAS_ROOT = "/srv/ngi-nas-ns"
+# Upper bounds of the latency histogram buckets, in ms, the last one is open
+LATENCY_BUCKETS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000)
+
+# RunMetrics the NAS I/O is accounted for, see RunMetrics.instrument_io
+_active = None
+
+
+def entity_type(url):
+    """Entity type of a REST URI, e.g. artifacts for .../api/v2/artifacts/2-1."""
+    segments = [s for s in urlsplit(url).path.split("/") if s]
+    if "api" in segments:
+        segments = segments[segments.index("api") + 2 :]
+    if not segments:
+        return "api"
+    if "batch" in segments:
+        return segments[0] + "/batch"
+    return segments[0]
+
+
+def _bucket(ms):
+    for upper in LATENCY_BUCKETS:
+        if ms <= upper:
+            return "<={0}ms".format(upper)
+    return ">{0}ms".format(LATENCY_BUCKETS[-1])
+
+
+class _TimedFile(object):
+    """File proxy adding the time spent in it to a RunMetrics."""
+
+    def __init__(self, f, metrics):
+        self._f = f
+        self._metrics = metrics
+
+    def _timed(self, name, *args, **kwargs):
+        start = time.time()
+        try:
+            return getattr(self._f, name)(*args, **kwargs)
+        finally:
+            self._metrics.add_io(time.time() - start)
+
+    def read(self, *args, **kwargs):
+        return self._timed("read", *args, **kwargs)
+
+    def readline(self, *args, **kwargs):
+        return self._timed("readline", *args, **kwargs)
+
+    def readlines(self, *args, **kwargs):
+        return self._timed("readlines", *args, **kwargs)
+
+    def write(self, *args, **kwargs):
+        return self._timed("write", *args, **kwargs)
+
+    def close(self):
+        return self._timed("close")
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        return self._timed("__next__")
+
+    def __getattr__(self, name):
+        return getattr(self._f, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+        return False
+
+
+class RunMetrics(object):
+    """Counters of the LIMS requests and NAS file I/O of one run."""
+
+    def __init__(self):
+        self.start = time.time()
+        self.requests = {}
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.request_time = 0.0
+        # Entity type -> {method: count}
+        self.per_type = {}
+        # Entity type -> {bucket: count}
+        self.latency = {}
+        self.io_files = 0
+        self.io_time = 0.0
+        self._lock = threading.Lock()
+        self._io_root = None
+        self._lims = None
+
+    def add_response(self, response):
+        request = response.request
+        method = request.method
+        etype = entity_type(request.url)
+        elapsed = response.elapsed.total_seconds()
+        body = request.body or b""
+        length = response.headers.get("Content-Length")
+        if length is not None:
+            received = int(length)
+        elif getattr(response, "_content_consumed", False):
+            received = len(response.content or b"")
+        else:
+            # Streamed file downloads, do not consume them here
+            received = 0
+        with self._lock:
+            self.requests[method] = self.requests.get(method, 0) + 1
+            self.bytes_out += len(body) if isinstance(body, (bytes, str)) else 0
+            self.bytes_in += received
+            self.request_time += elapsed
+            counts = self.per_type.setdefault(etype, {})
+            counts[method] = counts.get(method, 0) + 1
+            buckets = self.latency.setdefault(etype, {})
+            bucket = _bucket(elapsed * 1000)
+            buckets[bucket] = buckets.get(bucket, 0) + 1
+
+    def add_io(self, seconds, opened=False):
+        with self._lock:
+            self.io_time += seconds
+            self.io_files += int(opened)
+
+    def instrument(self, lims):
+        """Account for every response validated by lims, i.e. every request."""
+        original = lims.validate_response
+
+        def validate_response(response, accept_status_codes=[200]):
+            self.add_response(response)
+            return original(response, accept_status_codes)
+
+        lims.validate_response = validate_response
+        self._lims = lims
+        return lims
+
+    def instrument_io(self, root=NAS_ROOT):
+        """Account for the nas_open and nas_io calls on paths under root,
+        until uninstrument_io is called."""
+        global _active
+        self._io_root = root
+        _active = self
+
+    def uninstrument_io(self):
+        global _active
+        if _active is self:
+            _active = None
+        self._io_root = None
+
+    def _timed_path(self, path):
+        return (
+            isinstance(path, str)
+            and self._io_root is not None
+            and path.startswith(self._io_root)
+        )
+
+    def as_dict(self):
+        with self._lock:
+            metrics = {
+                "wall_time": time.time() - self.start,
+                "requests": dict(self.requests),
+                "bytes_in": self.bytes_in,
+                "bytes_out": self.bytes_out,
+                "request_time": self.request_time,
+                "per_type": {t: dict(c) for t, c in self.per_type.items()},
+                "latency_ms": {t: dict(b) for t, b in self.latency.items()},
+                "nas_io": {"files": self.io_files, "time": self.io_time},
+            }
+        cache = getattr(self._lims, "lims_cache", None)
+        if cache is not None:
+            metrics["cache"] = {
+                "hits": cache.hits,
+                "misses": cache.misses,
+                "revalidated": cache.revalidated,
+            }
+        return metrics
+
+    def summary(self, top=3):
+        """One line summary, listing the entity types with the most requests."""
+        metrics = self.as_dict()
+        total = sum(metrics["requests"].values())
+        methods = ", ".join(
+            "{0} {1}".format(n, m) for m, n in sorted(metrics["requests"].items())
+        )
+        line = "LIMS requests: {0} ({1}), {2:.1f} MB in, {3:.1f} MB out, {4:.2f} s".format(
+            total,
+            methods or "none",
+            metrics["bytes_in"] / 1e6,
+            metrics["bytes_out"] / 1e6,
+            metrics["request_time"],
+        )
+        busiest = sorted(
+            metrics["per_type"].items(), key=lambda item: -sum(item[1].values())
+        )[:top]
+        for etype, counts in busiest:
+            line += "; {0} {1}".format(
+                etype,
+                ", ".join("{0} {1}".format(n, m) for m, n in sorted(counts.items())),
+            )
+        if "cache" in metrics:
+            line += "; cache hits: {0}".format(metrics["cache"]["hits"])
+        line += "; NAS I/O: {0} files, {1:.2f} s; wall time: {2:.2f} s".format(
+            metrics["nas_io"]["files"], metrics["nas_io"]["time"], metrics["wall_time"]
+        )
+        return line
+
+    def write(self, path):
+        """Write the metrics as JSON to path.
+
+        Written to the working directory with a name starting with the LIMS id
+        of a shared result file, the EPP node attaches it to the step.
+        """
+        with open(path, "w") as f:
+            json.dump(self.as_dict(), f, indent=2, sort_keys=True)
+        return os.path.abspath(path)
+
+
+def nas_open(file, *args, **kwargs):
+    """open(), with the time spent opening and in the file accounted for by
+    the active RunMetrics if file is on the NAS."""
+    metrics = _active
+    if metrics is None or not metrics._timed_path(file):
+        return open(file, *args, **kwargs)
+    start = time.time()
+    f = open(file, *args, **kwargs)
+    metrics.add_io(time.time() - start, opened=True)
+    return _TimedFile(f, metrics)
+
+
+@contextmanager
+def nas_io(path):
+    """Account for the time spent in the block as I/O on path, e.g. around a
+    parser reading it, if path is on the NAS."""
+    metrics = _active
+    if metrics is None or not metrics._timed_path(path):
+        yield
+        return
+    start = time.time()
+    try:
+        yield
+    finally:
+        metrics.add_io(time.time() - start, opened=True)
@@ -0,0 +1,127 @@
+"""Atomic, concurrent publishing of a samplesheet to its destinations.
+
+A samplesheet EPP hands the sheet to several places: the NAS directory the
+instruments read from, and the file slot of the step in the LIMS. They used to
+be written one after the other, and the NAS file was written in place, so that
+an instrument could read a half-written sheet. publish() runs every destination
+in its own thread, retries a failing destination a bounded number of times,
+and logs the time spent on each. Files are written with atomic_write, to a
+temporary file in the target directory that is fsynced and renamed over the
+target, so readers see either the previous sheet or the complete new one.
+
+    publish({
+        "NAS": partial(atomic_write, nas_path, content),
+        "LIMS": partial(lims_upload, lims, artifact, local_path),
+    })
+"""
+
+import logging
+import os
+import tempfile
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+from scilifelab_epps.async_lims import replace_files
+from scilifelab_epps.metrics import nas_io
+
+ATTEMPTS = 3
+# Seconds before the first retry, doubled at every retry
+RETRY_DELAY = 1.0
+FILE_MODE = 0o664
+
+Published = namedtuple("Published", ["name", "seconds", "attempts", "error"])
+Published.__doc__ = """Outcome of publishing to one destination.
+
+seconds  -- wall time spent, retries included
+error    -- exception of the last attempt, None on success
+"""
+
+
+def atomic_write(path, content, mode=FILE_MODE):
+    """Write content to path through a fsynced temporary file renamed over it."""
+    with nas_io(path):
+        _atomic_write(path, content, mode)
+
+
+def _atomic_write(path, content, mode):
+    directory = os.path.dirname(os.path.abspath(path))
+    fd, tmp_path = tempfile.mkstemp(
+        prefix=".{0}.".format(os.path.basename(path)), suffix=".tmp", dir=directory
+    )
+    try:
+        with os.fdopen(fd, "w") as f:
+            f.write(content)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp_path, mode)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    # Make the rename itself durable
+    dir_fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(dir_fd)
+    finally:
+        os.close(dir_fd)
+
+
+def atomic_copy(source, path, mode=FILE_MODE):
+    """Copy the file source to path with atomic_write."""
+    with open(source) as f:
+        atomic_write(path, f.read(), mode)
+
+
+def lims_upload(lims, entity, file_to_upload):
+    """Replace the files of entity by file_to_upload.
+
+    The entity is read again first, so that a retry does not try to delete the
+    files removed by a failed attempt.
+    """
+    entity.get(force=True)
+    return replace_files(lims, entity, file_to_upload)
+
+
+def _publish_one(name, func, attempts, delay):
+    start = time.monotonic()
+    error = None
+    for attempt in range(1, attempts + 1):
+        try:
+            func()
+            error = None
+            break
+        except Exception as e:
+            error = e
+            logging.warning(
+                "Publishing to {0} failed (attempt {1}/{2}): {3}".format(name, attempt, attempts, e)
+            )
+            if attempt < attempts:
+                time.sleep(delay * 2 ** (attempt - 1))
+    seconds = time.monotonic() - start
+    if error is None:
+        logging.info("Published to {0} in {1:.2f} s".format(name, seconds))
+    return Published(name, seconds, attempt, error)
+
+
+def publish(destinations, attempts=ATTEMPTS, delay=RETRY_DELAY, raise_errors=False):
+    """Run the callables of destinations, {name: callable}, concurrently.
+
+    Returns the Published of every destination, in the order of destinations.
+    If raise_errors, the error of the first failed destination is raised once
+    all destinations are done.
+    """
+    if not destinations:
+        return []
+    with ThreadPoolExecutor(max_workers=len(destinations)) as executor:
+        futures = [
+            executor.submit(_publish_one, name, func, attempts, delay)
+            for name, func in destinations.items()
+        ]
+        results = [future.result() for future in futures]
+    if raise_errors:
+        for result in results:
+            if result.error is not None:
+                raise result.error
+    return results
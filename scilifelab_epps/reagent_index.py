@@ -0,0 +1,200 @@
+"""Local index of reagent type names to index sequences.
+
+Reagent labels that are not a raw sequence have to be looked up as reagent
+types, and genologics fetches every reagent type it lists one by one. The
+ReagentIndex keeps name -> sequence in an sqlite table, so that a lookup is a
+single indexed read:
+
+- build() lists the reagent types of the LIMS in bulk and fetches, in
+  parallel, the ones that are not in the table yet, so running it again only
+  picks up new reagent types (full=True refetches everything)
+- reagent_sequence() consults the index first and falls back to the API on
+  misses, storing what it finds
+
+The table is refreshed from cron or by hand with
+
+    python -m scilifelab_epps.reagent_index [--full] [--path PATH]
+
+Its location defaults to DEFAULT_PATH, and can be set with the
+SCILIFELAB_EPPS_REAGENT_INDEX environment variable.
+"""
+
+import logging
+import os
+import sqlite3
+import time
+
+from scilifelab_epps.fanout import fan_out, install_pooled_session
+
+ENV_VAR = "SCILIFELAB_EPPS_REAGENT_INDEX"
+DEFAULT_PATH = os.path.join(
+    os.path.expanduser("~"), ".cache", "scilifelab_epps", "reagent_types.sqlite"
+)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS reagent_types (
+    name TEXT PRIMARY KEY,
+    key TEXT NOT NULL,
+    uri TEXT NOT NULL,
+    sequence TEXT,
+    fetched REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS reagent_types_key ON reagent_types (key);
+"""
+
+
+def _key(name):
+    # Labels are matched the way the scripts normalize them
+    return name.upper().replace(" ", "")
+
+
+def _sequence(root):
+    """Index sequence of a reagent type XML, as parsed by genologics."""
+    for t in root.findall("special-type"):
+        if t.attrib.get("name") == "Index":
+            for child in t.findall("attribute"):
+                if child.attrib.get("name") == "Sequence":
+                    return child.attrib.get("value")
+    return None
+
+
+class ReagentIndex(object):
+    """sqlite table of reagent type name -> index sequence."""
+
+    def __init__(self, path=None):
+        self.path = path or os.environ.get(ENV_VAR) or DEFAULT_PATH
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.isdir(directory):
+            os.makedirs(directory, mode=0o700, exist_ok=True)
+        if not os.path.exists(self.path):
+            # Same permissions as the LIMS cache
+            os.close(os.open(self.path, os.O_CREAT | os.O_WRONLY, 0o600))
+        self.db = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        self.db.executescript(_SCHEMA)
+        self.db.commit()
+
+    def __len__(self):
+        return self.db.execute("SELECT COUNT(*) FROM reagent_types").fetchone()[0]
+
+    def lookup(self, name):
+        """Return (found, sequence); sequence may be None for non-index types."""
+        row = self.db.execute(
+            "SELECT sequence FROM reagent_types WHERE name = ?", (name,)
+        ).fetchone()
+        if row is None:
+            row = self.db.execute(
+                "SELECT sequence FROM reagent_types WHERE key = ?", (_key(name),)
+            ).fetchone()
+        if row is None:
+            return False, None
+        return True, row[0]
+
+    def store(self, entries):
+        """Store (name, uri, sequence) entries."""
+        now = time.time()
+        with self.db:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO reagent_types (name, key, uri, sequence, fetched) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(name, _key(name), uri, seq, now) for name, uri, seq in entries],
+            )
+
+    def build(self, lims, full=False, workers=None):
+        """List the reagent types of lims and fetch the ones not indexed yet.
+
+        Returns the number of reagent types fetched.
+        """
+        listed = {}
+        uri = lims.get_uri("reagenttypes")
+        while uri:
+            root = lims.get(uri)
+            for node in root.findall("reagent-type"):
+                listed[node.attrib["name"]] = node.attrib["uri"]
+            next_page = root.find("next-page")
+            uri = next_page.attrib["uri"] if next_page is not None else None
+
+        if full:
+            missing = listed
+        else:
+            known = {row[0] for row in self.db.execute("SELECT name FROM reagent_types")}
+            missing = {name: uri for name, uri in listed.items() if name not in known}
+
+        install_pooled_session(lims)
+        items = list(missing.items())
+        sequences = fan_out(lambda item: _sequence(lims.get(item[1])), items, workers)
+        self.store([(name, uri, seq) for (name, uri), seq in zip(items, sequences)])
+        logging.info(
+            "Indexed {0} new reagent types out of {1}".format(len(items), len(listed))
+        )
+        return len(items)
+
+    def sequence(self, lims, name):
+        """Index sequence of reagent type name, None if there is none.
+
+        Misses are looked up through the API and stored.
+        """
+        found, sequence = self.lookup(name)
+        if found:
+            return sequence
+        reagent_types = lims.get_reagent_types(name=name)
+        if not reagent_types:
+            return None
+        self.store([(rt.name, rt.uri, rt.sequence) for rt in reagent_types])
+        return reagent_types[0].sequence
+
+    def close(self):
+        self.db.close()
+
+
+_default = {}
+
+
+def default_index():
+    """The ReagentIndex at the configured path, opened once per run.
+
+    Returns None if it cannot be opened, e.g. on a read-only file system.
+    """
+    if "index" not in _default:
+        try:
+            _default["index"] = ReagentIndex()
+        except (OSError, sqlite3.Error) as e:
+            logging.warning("Reagent type index not available: {0}".format(e))
+            _default["index"] = None
+    return _default["index"]
+
+
+def reagent_sequence(lims, name, index=None):
+    """Index sequence of reagent type name, from the local index if possible.
+
+    Falls back to lims.get_reagent_types, like the scripts used to do, and
+    returns None if the reagent type is unknown or has no sequence.
+    """
+    index = index or default_index()
+    if index is not None:
+        try:
+            return index.sequence(lims, name)
+        except sqlite3.Error as e:
+            logging.warning("Reagent type index lookup failed: {0}".format(e))
+    reagent_types = lims.get_reagent_types(name=name)
+    return reagent_types[0].sequence if reagent_types else None
+
+
+if __name__ == "__main__":
+    from argparse import ArgumentParser
+
+    from genologics.config import BASEURI, PASSWORD, USERNAME
+    from genologics.lims import Lims
+
+    parser = ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--path", help="Index file, default {0}".format(DEFAULT_PATH))
+    parser.add_argument(
+        "--full", action="store_true", help="Refetch all reagent types"
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    lims = Lims(BASEURI, USERNAME, PASSWORD)
+    lims.check_version()
+    index = ReagentIndex(args.path)
+    index.build(lims, full=args.full)
+    print("{0} reagent types in {1}".format(len(index), index.path))
@@ -0,0 +1,110 @@
+"""Per-step cache of the samplesheet rows resolved for each output artifact.
+
+Operators often re-run the samplesheet EPP after a small edit of a Load to
+Flowcell step, and every run used to resolve the indexes of all samples by
+walking their lineage again. With the incremental mode of samplesheet_generator
+the rows built for an output are stored with the state of that output: a
+digest of its XML (samples, reagent labels, placement), of the name of its
+container (the flowcell id) and of its samples, of the projects of its samples,
+and of the step settings the rows depend on. On the next run, the
+outputs whose state did not change reuse their rows and only the others are
+resolved.
+
+The rows are kept in one JSON file per step, in the directory set by the
+SCILIFELAB_EPPS_SAMPLESHEET_CACHE environment variable, or DEFAULT_DIR.
+"""
+
+import difflib
+import hashlib
+import json
+import logging
+import os
+
+ENV_VAR = "SCILIFELAB_EPPS_SAMPLESHEET_CACHE"
+DEFAULT_DIR = os.path.join(os.path.expanduser("~"), ".cache", "scilifelab_epps", "samplesheets")
+
+
+def artifact_state(artifact, *settings):
+    """Digest of artifact, the names of its container and samples, the
+    projects of its samples and settings.
+
+    The names are not in the XML of the artifact, only the URIs of the
+    container and samples are, so a renamed flowcell or sample changes the
+    state through them.
+    """
+    digest = hashlib.sha1(artifact.xml())
+    if artifact.location and artifact.location[0] is not None:
+        digest.update("container\t{0}\n".format(artifact.location[0].name).encode("utf-8"))
+    projects = {}
+    for sample in artifact.samples:
+        digest.update("sample\t{0}\n".format(sample.name).encode("utf-8"))
+        project = sample.project
+        if project is not None:
+            projects[project.id] = project
+    for project_id in sorted(projects):
+        digest.update(projects[project_id].xml())
+    for setting in settings:
+        digest.update(str(setting).encode("utf-8"))
+    return digest.hexdigest()
+
+
+class RowCache(object):
+    """Rows of the outputs of a step, keyed by artifact id and state."""
+
+    def __init__(self, step_id, directory=None):
+        self.directory = directory or os.environ.get(ENV_VAR) or DEFAULT_DIR
+        self.path = os.path.join(self.directory, "{0}.json".format(step_id))
+        self.hits = 0
+        self.misses = 0
+        self.entries = {}
+        if os.path.exists(self.path):
+            try:
+                with open(self.path) as f:
+                    self.entries = json.load(f)
+            except ValueError as e:
+                logging.warning("Ignoring unreadable samplesheet cache {0}: {1}".format(self.path, e))
+
+    def lookup(self, artifact_id, state):
+        """Stored rows of artifact_id, or None if missing or stale."""
+        entry = self.entries.get(artifact_id)
+        if entry is not None and entry["state"] == state:
+            self.hits += 1
+            return entry["rows"]
+        self.misses += 1
+        return None
+
+    def store(self, artifact_id, state, rows):
+        self.entries[artifact_id] = {"state": state, "rows": rows}
+
+    def save(self):
+        """Write the cache, atomically and readable by its user only."""
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory, mode=0o700, exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        fd = os.open(tmp_path, os.O_CREAT | os.O_WRONLY | os.O_TRUNC, 0o600)
+        with os.fdopen(fd, "w") as f:
+            json.dump(self.entries, f)
+        os.replace(tmp_path, self.path)
+
+
+def uploaded_file(lims, artifact):
+    """Content of the file attached to artifact, or None if there is none."""
+    for f in artifact.files:
+        content = lims.get_file_contents(uri=f.uri)
+        if not isinstance(content, str):
+            content = content.read().decode("utf-8", "replace")
+        return content
+    return None
+
+
+def sheet_diff(old, new, name="samplesheet"):
+    """Unified diff lines from old to new content."""
+    return list(
+        difflib.unified_diff(
+            old.splitlines(),
+            new.splitlines(),
+            fromfile="uploaded/{0}".format(name),
+            tofile="new/{0}".format(name),
+            lineterm="",
+        )
+    )
@@ -0,0 +1,176 @@
+"""Batch pre-fetching of the entities belonging to a LIMS step.
+
+Iterating over process.all_inputs() / all_outputs() / input_output_maps and
+touching .udf, .location or .samples fires one GET per artifact, sample,
+container and project. The StepContext loads all of them up front through
+the batch retrieve endpoints, so that the entities handed out afterwards are
+already populated and no further round-trips are needed.
+"""
+
+import logging
+from xml.etree import ElementTree
+
+from genologics.entities import Process
+
+# The batch endpoints accept large link lists, but keep each request to a
+# size that the server handles comfortably.
+BATCH_SIZE = 500
+
+
+def _chunks(seq, size):
+    for i in range(0, len(seq), size):
+        yield seq[i : i + size]
+
+
+def get_batch(lims, instances, force=False, batch_size=BATCH_SIZE):
+    """Populate instances through the batch retrieve endpoint, in chunks.
+
+    Unlike Lims.get_batch, entities that share a LIMS id but differ in URI
+    (e.g. artifacts with and without a ?state= query) are all populated.
+    If a LimsCache is installed on lims, fresh cached entities are not
+    requested and the retrieved ones are stored in it.
+    Returns the unique instances, in the order they were first given.
+    """
+    by_id = {}
+    for instance in instances:
+        by_id.setdefault(instance.id, []).append(instance)
+
+    representatives = [
+        siblings[0]
+        for siblings in by_id.values()
+        if force or any(s.root is None for s in siblings)
+    ]
+
+    cache = getattr(lims, "lims_cache", None)
+    if cache is not None and not force:
+        uncached = []
+        for instance in representatives:
+            cached = cache.lookup(instance.uri)
+            if cached is not None and cached[3]:
+                instance.root = ElementTree.fromstring(cached[0])
+                cache.hits += 1
+            else:
+                uncached.append(instance)
+        representatives = uncached
+
+    for chunk in _chunks(representatives, batch_size):
+        lims.get_batch(chunk, force=True)
+        if cache is not None:
+            for instance in chunk:
+                if instance.root is not None:
+                    cache.misses += 1
+                    cache.store(
+                        instance.uri,
+                        lims.tostring(ElementTree.ElementTree(instance.root)),
+                    )
+                    cache.note_closed(instance.root)
+
+    for siblings in by_id.values():
+        root = next((s.root for s in siblings if s.root is not None), None)
+        for s in siblings:
+            if s.root is None or force:
+                s.root = root
+    return [siblings[0] for siblings in by_id.values()]
+
+
+class StepContext(object):
+    """Pre-fetched view of a LIMS step.
+
+    On creation, the process and every artifact, sample, container and
+    project it references are loaded with as few requests as possible.
+    Since genologics keeps one instance per URI in lims.cache, the entities
+    returned by the usual Process methods are the pre-populated ones, so
+    existing code can keep using the process object as before:
+
+        ctx = StepContext(lims, args.pid)
+        currentStep = ctx.process
+
+    Arguments:
+    lims      -- Lims instance
+    process   -- Process instance or LIMS id of the process
+
+    Keyword Arguments:
+    prefetch  -- If True (default), load all entities on creation
+    projects  -- If True (default), also load the projects of the samples
+    """
+
+    def __init__(self, lims, process, prefetch=True, projects=True):
+        self.lims = lims
+        if isinstance(process, Process):
+            self.process = process
+        else:
+            self.process = Process(lims, id=process)
+        self.load_projects = projects
+        self.artifacts = []
+        self.samples = []
+        self.containers = []
+        self.projects = []
+        if prefetch:
+            self.prefetch()
+
+    def prefetch(self, force=False):
+        """Fetch the process and all related entities in batch."""
+        self.process.get(force=force)
+
+        io_artifacts = []
+        for io in self.process.input_output_maps:
+            for side in io:
+                if side and side.get("uri") is not None:
+                    io_artifacts.append(side["uri"])
+        # all_inputs()/all_outputs() return stateless instances, make sure
+        # those are populated along with the ones of the io maps
+        stateless = self.process.all_inputs() + self.process.all_outputs()
+        self.artifacts = get_batch(self.lims, io_artifacts + stateless, force)
+
+        samples = [s for art in self.artifacts for s in art.samples]
+        self.samples = get_batch(self.lims, samples, force)
+
+        containers = [art.location[0] for art in self.artifacts if art.location]
+        containers = [c for c in containers if c is not None]
+        self.containers = get_batch(self.lims, containers, force)
+
+        if self.load_projects:
+            # There is no batch endpoint for projects, fetch each one once
+            projects = {}
+            for sample in self.samples:
+                if sample.project is not None:
+                    projects.setdefault(sample.project.id, sample.project)
+            for project in projects.values():
+                project.get(force=force)
+            self.projects = list(projects.values())
+
+        logging.info(
+            "Prefetched {0} artifacts, {1} samples, {2} containers and {3} "
+            "projects for process {4}".format(
+                len(self.artifacts),
+                len(self.samples),
+                len(self.containers),
+                len(self.projects),
+                self.process.id,
+            )
+        )
+        return self
+
+    @property
+    def input_output_maps(self):
+        return self.process.input_output_maps
+
+    def all_inputs(self, type=None):
+        """Unique input artifacts of the step, optionally filtered on type."""
+        arts = self.process.all_inputs()
+        return [a for a in arts if type is None or a.type == type]
+
+    def all_outputs(self, type=None):
+        """Unique output artifacts of the step, optionally filtered on type."""
+        arts = self.process.all_outputs()
+        return [a for a in arts if type is None or a.type == type]
+
+    def analyte_tuples(self):
+        """Input/output tuples where both sides are analytes."""
+        return [
+            io
+            for io in self.process.input_output_maps
+            if io[0]
+            and io[1]
+            and io[0]["uri"].type == io[1]["uri"].type == "Analyte"
+        ]
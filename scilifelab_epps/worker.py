@@ -0,0 +1,353 @@
+"""Resident worker that runs EPP scripts without per-call startup costs.
+
+Every EPP button press starts a new interpreter, imports the heavy stack and
+verifies the LIMS version before doing any work. The worker daemon does all of
+that once: it preloads the package, the index registries and the heavy
+dependencies, and checks the LIMS version. Each job then runs in a process
+forked from the daemon, so it starts with everything loaded, but with its own
+working directory, environment, stdout/stderr and logging handlers.
+
+Start the daemon, listening on a unix socket readable by its user only, in a
+directory of that user (DEFAULT_SOCKET, in $XDG_RUNTIME_DIR or else in
+~/.cache/scilifelab_epps):
+
+    python -m scilifelab_epps.worker serve [--socket PATH] [--workers 4]
+
+and call scripts through the client, instead of running them directly:
+
+    python -m scilifelab_epps.worker run -- scripts/samplesheet_generator.py --pid 24-1234
+
+The client forwards the arguments, working directory and SCILIFELAB_EPPS_*
+environment variables, relays stdout and stderr and exits with the exit status
+of the script. If no daemon is listening, it runs the script itself, so a
+stopped daemon only costs the usual startup time. The socket directory must be
+owned by the user and closed to others, and both ends check that the other one
+runs as the same user (SO_PEERCRED), otherwise the client runs the script
+itself and the daemon drops the connection.
+
+The client only imports the standard library, keep it that way.
+"""
+
+import json
+import os
+import socket
+import stat
+import struct
+import sys
+from argparse import ArgumentParser
+
+ENV_VAR = "SCILIFELAB_EPPS_WORKER_SOCKET"
+DEFAULT_SOCKET = os.path.join(
+    os.environ.get("XDG_RUNTIME_DIR")
+    or os.path.join(os.path.expanduser("~"), ".cache", "scilifelab_epps"),
+    "epps_worker.sock",
+)
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SCRIPTS_DIR = os.path.join(REPO, "scripts")
+# Environment variables forwarded from the client to the job
+FORWARDED_ENV_PREFIX = "SCILIFELAB_EPPS_"
+PRELOAD = (
+    "pandas",
+    "numpy",
+    "genologics.entities",
+    "genologics.lims",
+    "scilifelab_epps.epp",
+    "scilifelab_epps.step_context",
+    "scilifelab_epps.write_buffer",
+    "scilifelab_epps.lims_cache",
+    "scilifelab_epps.fanout",
+    "scilifelab_epps.async_lims",
+    "scilifelab_epps.reagent_index",
+    "epp_utils.barcodes",
+    "epp_utils.index_distance",
+    "epp_utils.udf_tools",
+    "epp_utils.lineage",
+    "epp_utils.formula",
+    "epp_utils.index_registry",
+)
+PRELOAD_DATA = ("QC_criteria.json",)
+
+
+def socket_path():
+    return os.environ.get(ENV_VAR, DEFAULT_SOCKET)
+
+
+def check_socket_dir(path, create=False):
+    """Raise PermissionError unless the directory of the socket path is owned
+    by the user and closed to others. Created with mode 0700 if create."""
+    directory = os.path.dirname(os.path.abspath(path))
+    if create and not os.path.exists(directory):
+        os.makedirs(directory, mode=0o700, exist_ok=True)
+    info = os.lstat(directory)
+    if (
+        not stat.S_ISDIR(info.st_mode)
+        or info.st_uid != os.getuid()
+        or info.st_mode & 0o077
+    ):
+        raise PermissionError(
+            "Socket directory {0} must be owned by the user with mode 0700".format(directory)
+        )
+
+
+def check_peer(sock):
+    """Raise PermissionError unless the other end of the unix socket runs as
+    the same user. Not checked where SO_PEERCRED is not available."""
+    if not hasattr(socket, "SO_PEERCRED"):
+        return
+    creds = struct.Struct("3i")
+    _, uid, _ = creds.unpack(sock.getsockopt(socket.SOL_SOCKET, socket.SO_PEERCRED, creds.size))
+    if uid != os.getuid():
+        raise PermissionError("Worker socket peer runs as uid {0}".format(uid))
+
+
+# Client
+
+
+def _recv_all(sock):
+    chunks = []
+    while True:
+        chunk = sock.recv(65536)
+        if not chunk:
+            break
+        chunks.append(chunk)
+    return b"".join(chunks)
+
+
+def submit(script, argv, path=None):
+    """Run script with argv on the daemon, return (exit status, stdout, stderr).
+
+    Raises OSError if the daemon is not reachable.
+    """
+    job = {
+        "script": os.path.abspath(script),
+        "argv": list(argv),
+        "cwd": os.getcwd(),
+        "env": {k: v for k, v in os.environ.items() if k.startswith(FORWARDED_ENV_PREFIX)},
+    }
+    path = path or socket_path()
+    check_socket_dir(path)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        check_peer(sock)
+        sock.sendall(json.dumps(job).encode("utf-8") + b"\n")
+        sock.shutdown(socket.SHUT_WR)
+        reply = json.loads(_recv_all(sock).decode("utf-8"))
+    finally:
+        sock.close()
+    return reply["exit"], reply["stdout"], reply["stderr"]
+
+
+def run_client(script, argv):
+    try:
+        status, out, err = submit(script, argv)
+    except (OSError, ValueError):
+        # No daemon, run the script the usual way
+        os.execv(sys.executable, [sys.executable, script] + list(argv))
+    sys.stdout.write(out)
+    sys.stderr.write(err)
+    sys.stdout.flush()
+    sys.stderr.flush()
+    return status
+
+
+# Daemon
+
+
+def preload(modules=PRELOAD, data_files=PRELOAD_DATA):
+    """Import modules and load data files, skipping the ones not available."""
+    import importlib
+    import logging
+
+    from epp_utils.lazy import load_data_json
+
+    for name in modules:
+        try:
+            module = importlib.import_module(name)
+            # Force the load of modules imported with lazy_import
+            dir(module)
+        except Exception as e:
+            logging.warning("Not preloaded: {0} ({1})".format(name, e))
+    for file_name in data_files:
+        try:
+            load_data_json(file_name)
+        except (IOError, ValueError) as e:
+            logging.warning("Not preloaded: {0} ({1})".format(file_name, e))
+
+
+def verify_lims():
+    """Check the LIMS version once, and make Lims.check_version a no-op in jobs.
+
+    The request session is closed afterwards, so that no connection is shared
+    between the forked jobs.
+    """
+    from genologics.config import BASEURI, PASSWORD, USERNAME
+    from genologics.lims import Lims
+
+    lims = Lims(BASEURI, USERNAME, PASSWORD)
+    lims.check_version()
+    lims.request_session.close()
+    verified = lims.baseuri
+    original = Lims.check_version
+
+    def check_version(self):
+        if self.baseuri != verified:
+            return original(self)
+
+    Lims.check_version = check_version
+
+
+def _run_job(job, out_path, err_path):
+    """Body of a forked job process, never returns."""
+    import logging
+    import runpy
+    import traceback
+
+    status = 0
+    try:
+        os.chdir(job["cwd"])
+        os.environ.update(job["env"])
+        with open(out_path, "w") as out, open(err_path, "w") as err:
+            os.dup2(out.fileno(), 1)
+            os.dup2(err.fileno(), 2)
+        devnull = os.open(os.devnull, os.O_RDONLY)
+        os.dup2(devnull, 0)
+        sys.stdout = os.fdopen(1, "w", buffering=1)
+        sys.stderr = os.fdopen(2, "w", buffering=1)
+
+        # Start from clean logging, as a new interpreter would
+        root = logging.getLogger()
+        for handler in root.handlers[:]:
+            root.removeHandler(handler)
+        root.setLevel(logging.WARNING)
+
+        script = job["script"]
+        sys.argv = [script] + job["argv"]
+        sys.path.insert(0, os.path.dirname(script))
+        runpy.run_path(script, run_name="__main__")
+    except SystemExit as e:
+        if e.code is None:
+            status = 0
+        elif isinstance(e.code, int):
+            status = e.code
+        else:
+            sys.stderr.write("{0}\n".format(e.code))
+            status = 1
+    except BaseException:
+        traceback.print_exc()
+        status = 1
+    finally:
+        try:
+            logging.shutdown()
+            sys.stdout.flush()
+            sys.stderr.flush()
+        finally:
+            os._exit(status & 0xFF)
+
+
+def serve(path, workers):
+    import logging
+    import multiprocessing
+    import socketserver
+    import tempfile
+    import threading
+
+    fork = multiprocessing.get_context("fork")
+    slots = threading.BoundedSemaphore(workers)
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            try:
+                check_peer(self.connection)
+            except PermissionError as e:
+                logging.warning("Rejected a connection: {0}".format(e))
+                return
+            job = json.loads(self.rfile.readline().decode("utf-8"))
+            script = os.path.realpath(job["script"])
+            if os.path.dirname(script) != os.path.realpath(SCRIPTS_DIR):
+                reply = {"exit": 2, "stdout": "", "stderr": "Not an EPP script: {0}\n".format(script)}
+            else:
+                job["script"] = script
+                reply = self.run(job)
+            self.wfile.write(json.dumps(reply).encode("utf-8"))
+
+        def run(self, job):
+            with tempfile.TemporaryDirectory() as tmp, slots:
+                out_path = os.path.join(tmp, "stdout")
+                err_path = os.path.join(tmp, "stderr")
+                process = fork.Process(target=_run_job, args=(job, out_path, err_path))
+                process.start()
+                process.join()
+                with open(out_path) as out, open(err_path) as err:
+                    reply = {"exit": process.exitcode, "stdout": out.read(), "stderr": err.read()}
+            logging.info(
+                "{0} {1} exited with {2}".format(
+                    os.path.basename(job["script"]), " ".join(job["argv"]), reply["exit"]
+                )
+            )
+            return reply
+
+    class Server(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+        daemon_threads = True
+
+    check_socket_dir(path, create=True)
+    if os.path.lexists(path):
+        if not stat.S_ISSOCK(os.lstat(path).st_mode):
+            raise SystemExit("{0} exists and is not a socket".format(path))
+        os.unlink(path)
+    # Only the user running the daemon may submit jobs
+    old_umask = os.umask(0o177)
+    try:
+        server = Server(path, Handler)
+    finally:
+        os.umask(old_umask)
+    logging.info("EPP worker listening on {0} with {1} workers".format(path, workers))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(path)
+
+
+def main(args):
+    if args.mode == "run":
+        if not args.command:
+            raise SystemExit("No script given")
+        sys.exit(run_client(args.command[0], args.command[1:]))
+
+    import logging
+
+    logging.basicConfig(
+        filename=args.log,
+        level=logging.INFO,
+        format="%(asctime)s:%(levelname)s:%(name)s:%(message)s",
+    )
+    sys.path[:0] = [REPO]
+    preload()
+    if not args.no_lims:
+        verify_lims()
+    serve(args.socket, args.workers)
+
+
+if __name__ == "__main__":
+    parser = ArgumentParser(
+        description=__doc__.split("\n\n")[0],
+        usage="%(prog)s {serve,run} [options] [-- script.py [args]]",
+    )
+    parser.add_argument("mode", choices=["serve", "run"], help="What to do")
+    parser.add_argument("--socket", default=socket_path(), help="Unix socket of the daemon")
+    parser.add_argument("--workers", type=int, default=4, help="Jobs run at the same time")
+    parser.add_argument("--log", help="Log file of the daemon, default stderr")
+    parser.add_argument(
+        "--no_lims", action="store_true", help="Do not check the LIMS version on start"
+    )
+    # Everything after -- is the script to run and its arguments
+    argv = sys.argv[1:]
+    split = argv.index("--") if "--" in argv else len(argv)
+    args = parser.parse_args(argv[:split])
+    args.command = argv[split + 1 :]
+    if args.mode == "run":
+        os.environ[ENV_VAR] = args.socket
+    main(args)
@@ -0,0 +1,118 @@
+"""Write-behind buffer for LIMS entity updates.
+
+Instead of doing one PUT per changed UDF, entities are marked dirty in a
+WriteBuffer and flushed together through the batch update endpoints of
+artifacts, samples, containers and files. Entities without a batch endpoint
+(processes, projects, ...) are still PUT one by one, but only once per flush
+no matter how many times they were changed.
+"""
+
+import logging
+
+from requests import HTTPError
+
+from scilifelab_epps.step_context import BATCH_SIZE
+
+BATCH_TAGS = ("artifact", "container", "file", "sample")
+
+
+class WriteBuffer(object):
+    """Collect dirty entities and flush them in batch.
+
+    Failure handling follows the on_fail convention of epp_utils.udf_tools:
+    every entity is added with an on_fail value. When the entity cannot be
+    written, an exception instance is raised (after all other entities have
+    been flushed) and any other value is recorded as the result for that
+    entity. Errors are always logged per entity.
+
+    Can be used as a context manager, which flushes on a clean exit:
+
+        with WriteBuffer(lims) as buffer:
+            for art in process.all_outputs():
+                art.udf["Conc. Units"] = "ng/ul"
+                buffer.add(art)
+
+    Arguments:
+    lims        -- Lims instance
+
+    Keyword Arguments:
+    batch_size  -- maximum number of entities per batch request
+    """
+
+    def __init__(self, lims, batch_size=BATCH_SIZE):
+        self.lims = lims
+        self.batch_size = batch_size
+        # uri -> (entity, on_fail), insertion ordered
+        self._dirty = {}
+        self.errors = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        if not exc_type:
+            self.flush()
+        return False
+
+    def __len__(self):
+        return len(self._dirty)
+
+    def add(self, entity, on_fail=AssertionError()):
+        """Mark entity as dirty, it will be written on the next flush."""
+        previous = self._dirty.get(entity.uri)
+        if previous is not None and issubclass(type(previous[1]), BaseException):
+            # Keep the strictest failure handling requested for the entity
+            on_fail = previous[1]
+        self._dirty[entity.uri] = (entity, on_fail)
+
+    def discard(self, entity):
+        self._dirty.pop(entity.uri, None)
+
+    def flush(self):
+        """Write all dirty entities.
+
+        Returns a dict of entity id -> on_fail value for the entities that
+        failed. Raises the first failing entity's on_fail if it is an
+        exception instance.
+        """
+        pending = list(self._dirty.values())
+        self._dirty = {}
+        failed = []
+
+        by_tag = {}
+        singles = []
+        for entity, on_fail in pending:
+            if entity._TAG in BATCH_TAGS and entity.root is not None:
+                by_tag.setdefault(entity._TAG, []).append((entity, on_fail))
+            else:
+                singles.append((entity, on_fail))
+
+        for tag, items in by_tag.items():
+            for i in range(0, len(items), self.batch_size):
+                chunk = items[i : i + self.batch_size]
+                try:
+                    self.lims.put_batch([entity for entity, _ in chunk])
+                except HTTPError as e:
+                    # Fall back to single updates to find the failing entities
+                    logging.warning(
+                        "Batch update of {0} {1}s failed, retrying one by one: "
+                        "{2}".format(len(chunk), tag, e)
+                    )
+                    singles.extend(chunk)
+                else:
+                    logging.info("Batch updated {0} {1}s".format(len(chunk), tag))
+
+        for entity, on_fail in singles:
+            try:
+                entity.put()
+            except (TypeError, HTTPError) as e:
+                logging.warning(
+                    "Error while updating element {0}: {1}".format(entity.id, e)
+                )
+                self.errors[entity.id] = e
+                failed.append((entity, on_fail))
+
+        for entity, on_fail in failed:
+            if issubclass(type(on_fail), BaseException):
+                raise on_fail
+        return {entity.id: on_fail for entity, on_fail in failed}
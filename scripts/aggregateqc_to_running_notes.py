@@ -13,14 +13,11 @@ import datetime
 import logging
 import os
 import sys
-import json
 
 from write_notes_to_couchdb import write_note_to_couch
+from epp_utils.lazy import load_data_json
 
-QC_criteria_json = '/opt/gls/clarity/users/glsai/repos/scilifelab_epps/data/QC_criteria.json'
-
-with open(QC_criteria_json,'r') as file:
-    QC_criteria = json.loads(file.read())
+QC_criteria_json = 'QC_criteria.json'
 
 # Prepare a table with all sample details
 def prepare_sample_table(artifacts):
@@ -85,6 +82,7 @@ def prepare_QC_details(project, sample_table, library=False):
     QC_metrics = {}
     # Retrieve the QC metrics from the QC critera file
     library_construction_method = project.udf.get('Library construction method')
+    QC_criteria = load_data_json(QC_criteria_json)
     if library_construction_method in QC_criteria.keys():
         if not library:
             library_prep_option = project.udf.get('Library prep option') if project.udf.get('Library prep option') else 'default'
@@ -3,6 +3,7 @@ from argparse import ArgumentParser
 from genologics.lims import Lims
 from genologics.config import BASEURI,USERNAME,PASSWORD
 from genologics.entities import Process
+from scilifelab_epps.fanout import get_processes_per_artifact
 
 
 def obtain_amount(artifact):
@@ -43,6 +44,12 @@ def main(args):
     log = []
     lims = Lims(BASEURI,USERNAME,PASSWORD)
     process = Process(lims, id=args.pid)
+    # Look up the preps of all inputs concurrently
+    preps_per_input = get_processes_per_artifact(
+        lims,
+        [io[0]['uri'].id for io in process.input_output_maps if io[1]['output-generation-type'] == 'PerInput'],
+        type=["Setup Workset/Plate", "Amount confirmation QC"],
+    )
     for io in process.input_output_maps:
         if io[1]['output-generation-type'] != 'PerInput':
             continue
@@ -55,7 +62,7 @@ def main(args):
         log.append("Starting amount of {} : {} ng".format(io[0]['uri'].samples[0].name, starting_amount))
         current_amount = starting_amount
         #preps
-        preps = lims.get_processes(inputartifactlimsid=io[0]['uri'].id, type=["Setup Workset/Plate", "Amount confirmation QC"])
+        preps = preps_per_input[io[0]['uri'].id]
         for pro in preps:
             if pro.id == args.pid:
                 continue # skip the current step
@@ -7,11 +7,18 @@ from argparse import ArgumentParser
 from genologics.lims import Lims
 from genologics.entities import Process
 from genologics.config import BASEURI, USERNAME, PASSWORD
+from scilifelab_epps.metrics import nas_io
 
 DESC = """EPP for attaching RunInfo.xml and RunParameters.xml from NovaSeq run dir, and copying run parameters from the previous step
 Author: Chuan Wang, Science for Life Laboratory, Stockholm, Sweden
 """
 
+def latest_file(pattern):
+    """Most recently created file matching pattern."""
+    with nas_io(pattern):
+        return max(glob.glob(pattern), key=os.path.getctime)
+
+
 def main(lims, args):
     process = Process(lims, id=args.pid)
 
@@ -25,13 +32,8 @@ def main(lims, args):
                 try:
                     lims.upload_new_file(
                         outart,
-                        max(
-                            glob.glob(
-                                "/srv/ngi-nas-ns/NovaSeqXPlus_data/*{}/RunInfo.xml".format(
-                                    FCID
-                                )
-                            ),
-                            key=os.path.getctime,
+                        latest_file(
+                            "/srv/ngi-nas-ns/NovaSeqXPlus_data/*{}/RunInfo.xml".format(FCID)
                         ),
                     )
                 except:
@@ -40,13 +42,8 @@ def main(lims, args):
                 try:
                     lims.upload_new_file(
                         outart,
-                        max(
-                            glob.glob(
-                                "/srv/ngi-nas-ns/NovaSeqXPlus_data/*{}/RunParameters.xml".format(
-                                    FCID
-                                )
-                            ),
-                            key=os.path.getctime,
+                        latest_file(
+                            "/srv/ngi-nas-ns/NovaSeqXPlus_data/*{}/RunParameters.xml".format(FCID)
                         ),
                     )
                 except:
@@ -68,11 +65,8 @@ def main(lims, args):
                 try:
                     lims.upload_new_file(
                         outart,
-                        max(
-                            glob.glob(
-                                "/srv/ngi-nas-ns/NovaSeq_data/*{}/RunInfo.xml".format(FCID)
-                            ),
-                            key=os.path.getctime,
+                        latest_file(
+                            "/srv/ngi-nas-ns/NovaSeq_data/*{}/RunInfo.xml".format(FCID)
                         ),
                     )
                 except:
@@ -81,13 +75,8 @@ def main(lims, args):
                 try:
                     lims.upload_new_file(
                         outart,
-                        max(
-                            glob.glob(
-                                "/srv/ngi-nas-ns/NovaSeq_data/*{}/RunParameters.xml".format(
-                                    FCID
-                                )
-                            ),
-                            key=os.path.getctime,
+                        latest_file(
+                            "/srv/ngi-nas-ns/NovaSeq_data/*{}/RunParameters.xml".format(FCID)
                         ),
                     )
                 except:
@@ -5,17 +5,21 @@ import logging
 import os
 import sys
 import re
-import pandas as pd
 import zika_methods
 import zika_utils
 from argparse import ArgumentParser
 from genologics.lims import Lims
 from genologics.config import BASEURI, USERNAME, PASSWORD
 from scilifelab_epps.epp import attach_file
-from genologics.entities import Process
-from numpy import minimum
+from scilifelab_epps.fanout import workflow_stages_per_artifact
+from scilifelab_epps.lims_cache import cache_from_env
+from scilifelab_epps.step_context import StepContext
+from epp_utils.barcodes import BarcodeResolver
 from datetime import datetime as dt
 
+from epp_utils.lazy import lazy_import
+
+pd = lazy_import("pandas")
 
 DESC = """EPP used to create csv files for the bravo robot"""
 
@@ -27,10 +31,6 @@ Dilution_preset = {
     "Smarter pico": [1.25, 375.0, 10.0]
 }
 
-# Pre-compile regexes in global scope:
-IDX_PAT = re.compile("([ATCG]{4,})-?([ATCG]*)")
-TENX_PAT = re.compile("SI-GA-[A-H][1-9][0-2]?")
-
 def obtain_previous_volumes(currentStep, lims):
     samples_volumes = {}
     re_well = re.compile("([A-H]):?0?([0-9]{1,2})")
@@ -391,6 +391,12 @@ def default_bravo(lims, currentStep, with_total_vol=True):
         wfs_with_vol_adj = ['SMARTer Pico RNA', 'QIAseq miRNA', 'Amplicon']
         checkTheLog = [False]
         dest_plate = []
+        # Fetch the workflow stages needed by calc_vol for all inputs concurrently
+        workflow_stages_per_artifact(
+            lims,
+            [art_tuple[0]['uri'] for art_tuple in currentStep.input_output_maps
+             if art_tuple[0]['uri'].type == 'Analyte' and art_tuple[1]['uri'].type == 'Analyte'],
+        )
         with open("bravo.csv", "w") as csvContext:
             with open("bravo.log", "w") as logContext:
                 # working directly with the map allows easier input/output handling
@@ -760,7 +766,7 @@ def sample_dilution_before_QC(currentStep):
 
 
 def main(lims, args):
-    currentStep = Process(lims, id=args.pid)
+    currentStep = StepContext(lims, args.pid).process
 
     if currentStep.type.name in ['Library Pooling (HiSeq X) 1.0']:
         check_barcode_collision(currentStep)
@@ -931,48 +937,18 @@ def calc_vol(art_tuple, logContext, checkTheLog, wfs_with_vol_adj):
     return (art_workflows, "#ERROR#", "#ERROR#", "#ERROR#", "#ERROR#", "#ERROR#")
 
 def check_barcode_collision(step):
+    resolver = BarcodeResolver(step.lims)
     for output in step.all_outputs():
         barcodes=[]
         if output.type == "Analyte":
             for io in step.input_output_maps:
                 if io[1]['limsid'] == output.id:
-                    barcode=find_barcode(io[0]['uri'])
+                    barcode=resolver.artifact_index(io[0]['uri'])
                     if barcode not in barcodes:
-                        barcodes.append(find_barcode(io[0]['uri']))
+                        barcodes.append(barcode)
                     else:
                         raise Exception("Similar barcodes {0} in pool {}".format(barcode, output.id))
 
-def find_barcode(artifact):
-        if len(artifact.samples) == 1 and artifact.reagent_labels:
-            reagent_label_name=artifact.reagent_labels[0].upper()
-            idxs = TENX_PAT.findall(reagent_label_name)
-            if idxs:
-                # Put in tuple with empty string as second index to
-                # match expected type:
-                idxs = (idxs[0], "")
-            else:
-                try:
-                    idxs = IDX_PAT.findall(reagent_label_name)[0]
-                except IndexError:
-                    try:
-                        # we only have the reagent label name.
-                        rt = lims.get_reagent_types(name=reagent_label_name)[0]
-                        idxs = IDX_PAT.findall(rt.sequence)[0]
-                    except:
-                        return ("NoIndex","")
-
-            return idxs
-        else:
-            if artifact == artifact.samples[0].artifact:
-                return None
-            else:
-                next_artifact=None
-                for iomap in artifact.parent_process.input_output_maps:
-                    if iomap[1]['uri'].id == artifact.id:
-                        next_artifact=iomap[0]['uri']
-                return find_barcode(next_artifact)
-
-
 if __name__ == "__main__":
     parser = ArgumentParser(description=DESC)
     parser.add_argument('--pid',
@@ -981,4 +957,5 @@ if __name__ == "__main__":
 
     lims = Lims(BASEURI, USERNAME, PASSWORD)
     lims.check_version()
+    cache_from_env(lims)
     main(lims, args)
@@ -17,11 +17,13 @@ from genologics.lims import Lims
 from genologics.config import BASEURI,USERNAME,PASSWORD
 from genologics.entities import Process
 from scilifelab_epps.epp import EppLogger
+from scilifelab_epps.write_buffer import WriteBuffer
 
 
 def calculate_cell_nuclei_conc(pro):
     log=[]
-    artifacts = pro.all_inputs(unique=True)
+    artifacts = pro.all_inputs(unique=True, resolve=True)
+    buffer = WriteBuffer(pro.lims)
 
     for art in artifacts:
         # Fetch data
@@ -37,13 +39,19 @@ def calculate_cell_nuclei_conc(pro):
             art.udf['Concentration'] = conc
             art.udf['Conc. Units'] = 'count/ul'
             art.udf['Amount (ng)'] = 0
-            art.put()
+            buffer.add(
+                art,
+                on_fail=RuntimeError(
+                    "Concentration of sample {} ({}) could not be written".format(sample, art.id)
+                ),
+            )
             log.append("Sample {} concentration set to {} count/ul.".format(sample, conc))
         # Throw error message when there is missing value
         else:
             for k, v in value_dict.items():
                 if not v:
                     log.append("Sample {} is missing {}.".format(sample, k))
+    buffer.flush()
 
     print(''.join(log), file=sys.stderr)
 
@@ -29,6 +29,7 @@ from genologics.config import BASEURI,USERNAME,PASSWORD
 from genologics.entities import Process
 from scilifelab_epps.epp import EppLogger
 from scilifelab_epps.epp import CopyField
+from scilifelab_epps.write_buffer import WriteBuffer
 
 
 def main(lims, args, epp_logger):
@@ -49,6 +50,8 @@ def main(lims, args, epp_logger):
     elif len(dest_udfs) != len(source_udfs):
         logging.error("source_udfs and dest_udfs lists of arguments are uneven.")
         sys.exit(-1)
+    # Each sample is written once, however many udfs are copied to it
+    buffer = WriteBuffer(lims)
     for i in range(len(source_udfs)):
         source_udf = source_udfs[i]
         dest_udf = dest_udfs[i]
@@ -57,13 +60,14 @@ def main(lims, args, epp_logger):
                 if source_udf in artifact.udf:
                     correct_artifacts = correct_artifacts +1
                     copy_sesion = CopyField(artifact, artifact.samples[0], source_udf, dest_udf)
-                    test = copy_sesion.copy_udf(changelog_f)
+                    test = copy_sesion.copy_udf(changelog_f, buffer)
                     if test:
                         no_updated = no_updated + 1
                 else:
                     incorrect_artifacts = incorrect_artifacts + 1
                     logging.warning(("Found artifact for sample {0} with {1} "
                                    "undefined/blank, exiting").format(artifact.samples[0].name, source_udf))
+    buffer.flush()
 
     if incorrect_artifacts == 0:
         warning = "no artifacts"
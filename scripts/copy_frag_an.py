@@ -28,10 +28,10 @@ from argparse import ArgumentParser
 from requests import HTTPError
 from genologics.lims import Lims
 from genologics.config import BASEURI,USERNAME,PASSWORD
-from genologics.entities import Process
 from scilifelab_epps.epp import EppLogger
 from scilifelab_epps.epp import ReadResultFiles
-from scilifelab_epps.epp import set_field
+from scilifelab_epps.step_context import StepContext
+from scilifelab_epps.write_buffer import WriteBuffer
 
 import csv
 import re
@@ -150,6 +150,7 @@ def get_frag_an_csv_data(process):
     #parse the file and get the interesting data out
     data = get_data(file_content, log)
 
+    buffer = WriteBuffer(process.lims)
     for target_file in process.result_files():
         key_dict = {'concentration' : 'Concentration',
                     'rin'           : 'RIN',
@@ -175,16 +176,23 @@ def get_frag_an_csv_data(process):
                     except ValueError:
                         log.append('Bad {} value format for Sample {}.'.format(k, file_sample))
             #actually set the data
-            target_file.put()
-            set_field(target_file)
+            buffer.add(
+                target_file,
+                on_fail=RuntimeError(
+                    "Fragment Analyzer values of sample {} ({}) could not be written".format(
+                        file_sample, target_file.id
+                    )
+                ),
+            )
         else:
             missing_samples += 1
+    buffer.flush()
     if missing_samples:
         log.append('{0}/{1} samples are missing in the Result File.'.format(missing_samples, len(process.result_files())))
     print(''.join(log), file=sys.stderr)
 
 def main(lims, pid, epp_logger):
-    process = Process(lims,id = pid)
+    process = StepContext(lims, pid).process
     get_frag_an_csv_data(process)
 
 if __name__ == "__main__":
@@ -22,7 +22,6 @@ Written by Maya Brandi and Denis Moreno
 import os
 import sys
 import logging
-import numpy as np
 import codecs
 
 from argparse import ArgumentParser
@@ -36,6 +35,10 @@ from scilifelab_epps.epp import set_field
 
 import csv
 
+from epp_utils.lazy import lazy_import
+
+np = lazy_import("numpy")
+
 def get_qbit_file(process):
     content = None
     for outart in process.all_outputs():
@@ -10,6 +10,7 @@ from datetime import datetime
 from genologics.lims import Lims
 from genologics.entities import Process
 from genologics.config import BASEURI, USERNAME, PASSWORD
+from scilifelab_epps.metrics import nas_open
 
 DESC = """EPP for copying run recipe
 Author: Chuan Wang, Science for Life Laboratory, Stockholm, Sweden
@@ -30,7 +31,7 @@ def main(lims, args):
                 raise RuntimeError("Cannot access the run recipe file.")
             break
 
-    with open("/srv/ngi-nas-ns/NovaSeq_data/gls_recipe_novaseq/{}".format(file_name), 'w') as sf:
+    with nas_open("/srv/ngi-nas-ns/NovaSeq_data/gls_recipe_novaseq/{}".format(file_name), 'w') as sf:
         sf.write(content)
 
 if __name__ == "__main__":
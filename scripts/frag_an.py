@@ -4,6 +4,7 @@ from argparse import ArgumentParser
 from genologics.lims import Lims
 from genologics.config import BASEURI, USERNAME, PASSWORD
 from genologics.entities import Process
+from scilifelab_epps.fanout import get_processes_per_artifact
 
 DESC = """EPP diluting the concentration of samples in the fragment analyzer step"""
 
@@ -44,6 +45,15 @@ def main(lims, args):
     except KeyError:
         conc_is_local = True
 
+    if not conc_is_local:
+        # Look up the concentration steps of all inputs concurrently
+        conc_steps = get_processes_per_artifact(
+            lims,
+            [io[0]['limsid'] for io in process.input_output_maps
+             if 'Fragment Analyzer' in io[1]['uri'].name and io[1]['output-generation-type'] == 'PerInput'],
+            type=conc_process_name,
+        )
+
     for io in process.input_output_maps:
         if 'Fragment Analyzer' in io[1]['uri'].name and io[1]['output-generation-type']== 'PerInput':
             base_concentration = None
@@ -54,7 +64,7 @@ def main(lims, args):
                 base_conc_unit = 'ng/uL'
             else:
                 try:
-                    concentration_step = lims.get_processes(type=conc_process_name, inputartifactlimsid=io[0]['limsid'])[0]
+                    concentration_step = conc_steps[io[0]['limsid']][0]
                 except IndexError:
                     log.append("Cannot find a {} step starting with {}".format(conc_process_name, io[0]['limsid']))
                 else:
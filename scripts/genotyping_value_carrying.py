@@ -3,17 +3,24 @@ from argparse import ArgumentParser
 from genologics.lims import Lims
 from genologics.config import BASEURI,USERNAME,PASSWORD
 from genologics.entities import Process
+from scilifelab_epps.fanout import get_processes_per_artifact
 
 
 def main(args):
     log = []
     lims = Lims(BASEURI,USERNAME,PASSWORD)
     process = Process(lims, id=args.pid)
+    # Look up the amount checks of all inputs concurrently
+    amount_checks = get_processes_per_artifact(
+        lims,
+        [iomap[0]['uri'].id for iomap in process.input_output_maps if iomap[1]['output-generation-type'] == 'PerInput'],
+        type='Amount confirmation QC',
+    )
     for swp_iomap in process.input_output_maps:
         if swp_iomap[1]['output-generation-type'] !=  'PerInput':
             continue
         inp_artifact = swp_iomap[0]['uri']
-        amount_check_pros = lims.get_processes(type='Amount confirmation QC', inputartifactlimsid=inp_artifact.id)
+        amount_check_pros = amount_checks[inp_artifact.id]
         amount_check_pros.sort(reverse=True, key=lambda x:x.date_run)
         try:
             correct_amount_check_pro = amount_check_pros[0]
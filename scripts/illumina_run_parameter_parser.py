@@ -11,7 +11,6 @@ from genologics.lims import Lims
 from genologics.entities import Process
 from genologics.config import BASEURI, USERNAME, PASSWORD
 from flowcell_parser.classes import RunParser, RunParametersParser
-from interop import py_interop_run_metrics, py_interop_run, py_interop_summary
 
 
 DESC = """EPP for parsing run paramters for Illumina MiSeq, NextSeq and NovaSeq runs
@@ -105,6 +104,9 @@ def attach_xml(process, run_dir):
 
 
 def parse_illumina_interop(run_dir):
+    # The InterOp bindings are heavy, only load them for the runs parsed here
+    from interop import py_interop_run_metrics, py_interop_run, py_interop_summary
+
     # Read interop
     run_metrics = py_interop_run_metrics.run_metrics()
     valid_to_load = py_interop_run.uchar_vector(py_interop_run.MetricCount, 0)
@@ -8,10 +8,13 @@ from genologics.entities import Process
 from datetime import datetime as dt
 from tabulate import tabulate
 from ont_send_reloading_info_to_db import parse_run
-import pandas as pd
 import sys
 from epp_utils import udf_tools
 
+from epp_utils.lazy import lazy_import
+
+pd = lazy_import("pandas")
+
 
 DESC = """
 Script for the EPP "Log fields" and file slot "Field log".
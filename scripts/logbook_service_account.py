@@ -21,11 +21,6 @@ from genologics.entities import *
 from genologics.lims import *
 from genologics.descriptors import StringDescriptor,EntityDescriptor
 
-import google.auth
-from google.oauth2 import service_account
-from googleapiclient.discovery import build
-from googleapiclient.errors import HttpError
-
 import argparse
 from argparse import ArgumentParser
 
@@ -49,6 +44,9 @@ def get_credentials():
     Returns:
         Credentials, the obtained credential.
     """
+    # The Google API client is slow to import, only load it when needed
+    from google.oauth2 import service_account
+
     try:
         credentials = service_account.Credentials.from_service_account_file(
             SERVICE_ACCOUNT_FILE, scopes=SCOPES)
@@ -58,6 +56,8 @@ def get_credentials():
 
 
 def write_record(content,dest_file):
+    from googleapiclient.discovery import build
+    from googleapiclient.errors import HttpError
 
     credentials = get_credentials()
     service = build('sheets', 'v4', credentials=credentials)
@@ -83,7 +83,7 @@ def write_record(content,dest_file):
     request = service.spreadsheets().batchUpdate(spreadsheetId=spreadsheetId, body=batch_update_spreadsheet_request_body)
     try:
         response = request.execute()
-    except googleapiclient.errors.HttpError:
+    except HttpError:
         sys.exit("Service account has no editing access to the logbook")
 
     # Fill in values
@@ -93,7 +93,7 @@ def write_record(content,dest_file):
     body = {'valueInputOption' : "USER_ENTERED", 'data' : data}
     try:
         result = service.spreadsheets().values().batchUpdate(spreadsheetId=spreadsheetId, body=body).execute()
-    except googleapiclient.errors.HttpError:
+    except HttpError:
         sys.exit("Service account has no editing access to the logbook")
 
 # Fetch UDF details
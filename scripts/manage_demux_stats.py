@@ -14,8 +14,12 @@ Written by Isak Sylvin; isak.sylvin@scilifelab.se"""
 #Fetched from SciLife repos
 from genologics.lims import Lims
 from genologics.config import BASEURI, USERNAME, PASSWORD
-from genologics.entities import Process
-import flowcell_parser.classes as classes
+from scilifelab_epps.lims_cache import cache_from_env
+from scilifelab_epps.async_lims import prefetch_step
+from scilifelab_epps.write_buffer import WriteBuffer
+from epp_utils.demux_stats import DemuxTable, qc_passed, undetermined_percent
+from epp_utils.lanebarcode import iter_rows
+from epp_utils.lazy import lazy_import
 from manage_demux_stats_thresholds import Thresholds
 
 #Standard packages
@@ -26,6 +30,9 @@ import csv
 import sys
 import logging
 from argparse import ArgumentParser
+
+np = lazy_import("numpy")
+
 logger = logging.getLogger('demux_logger')
 
 def my_float(value):
@@ -189,6 +196,34 @@ def fill_process_fields(demux_process, process_stats):
         problem_handler("exit", "Failed to apply process thresholds to LIMS: {}".format(str(e)))
 
 
+def no_index_reads(seq_process, lane_no, paired):
+    """(# Reads, # Read Pairs) of a lane without index, from the sequencing step"""
+    reads = None
+    # For the case of NovaSeq run, parse lane yield from the ResultsFile of all_outputs.
+    if seq_process.type.name in [
+        "AUTOMATED - NovaSeq Run (NovaSeq 6000 v2.0)",
+        "Illumina Sequencing (NextSeq) v1.0",
+        "NovaSeqXPlus Run v1.0",
+    ]:
+        for inp in seq_process.all_outputs():
+            if inp.output_type == "ResultFile" and inp.name.split(' ')[1] == lane_no and "Reads PF (M) R1" in inp.udf:
+                reads = inp.udf["Reads PF (M) R1"]*1000000
+    # For all other cases, parse lane yield from all_inputs
+    else:
+        for inp in seq_process.all_inputs():
+            #If reads in seq step, and the lane is equal to the current lane
+            # Handle special case for MiSeq with noIndex case:
+            inp_location = "1" if inp.location[1][0] == "A" else inp.location[1][0]
+            if inp_location == lane_no and "Clusters PF R1" in inp.udf:
+                reads = inp.udf["Clusters PF R1"]
+    if reads is None:
+        raise KeyError("# Reads")
+    if paired:
+        return (reads*2, reads*2/2)
+    #Since a single ended run has no pairs, pairs is set to equal reads
+    return (reads, reads)
+
+
 def set_sample_values(demux_process, parser_struct, process_stats):
     """Sets artifact = sample values"""
 
@@ -198,11 +233,12 @@ def set_sample_values(demux_process, parser_struct, process_stats):
         process_stats["Paired"],
         process_stats["Read Length"],
     )
-    failed_entries = 0
+    paired = process_stats["Paired"]
     undet_included = False
-    noIndex = False
     undet_lanes = list()
-    proj_pattern = re.compile('(P\w+_\d+)')
+    table = DemuxTable(parser_struct)
+    no_index_lanes = table.no_index_lanes()
+    buffer = WriteBuffer(lims)
 
     #Necessary for noindexruns, should always resolve
     try:
@@ -227,12 +263,17 @@ def set_sample_values(demux_process, parser_struct, process_stats):
         except:
             problem_handler("exit", "Unable to typecast included undetermined lanes. Possibly non-number in list")
 
+    #Lane of every pool, and whether undetermined were included up to it
+    pool_lanes = list()
+    #Undetermined reads added to the samples of a lane
+    included = dict()
+    #Reads of the noIndex lanes, from the sequencing step
+    seq_reads = dict()
+    targets = list()
+    names = list()
+    target_lanes = list()
+    expected = list()
     for pool in demux_process.all_inputs():
-        undet_reads = 0
-        lane_reads = 0
-        undet_lane_reads = 0
-        samplesum = dict()
-
         try:
             outarts_per_lane = demux_process.outputs_per_input(pool.id, ResultFile = True)
         except Exception as e:
@@ -252,245 +293,135 @@ def set_sample_values(demux_process, parser_struct, process_stats):
             problem_handler("exit", "Faulty LIMS setup. Pool in lane {} has no samples: {}".format(lane_no, e))
         logger.info("Expected sample clusters for this lane: {}".format(exp_smp_per_lne))
 
-        #Artifacts in each lane
-        for target_file in outarts_per_lane:
+        if lane_no in no_index_lanes:
+            if undet_included:
+                problem_handler("error", "Logical error, undetermined cannot be included for a noIndex lane!")
             try:
-                current_name = target_file.samples[0].name
+                seq_reads[lane_no] = no_index_reads(seq_process, lane_no, paired)
+                logger.info("{}# Reads".format(seq_reads[lane_no][0]))
+                logger.info("{}# Read Pairs".format(seq_reads[lane_no][1]))
             except Exception as e:
-                problem_handler("exit", "Unable to determine sample name. Incorrect sample variable in process: {}".format(str(e)))
-            for entry in parser_struct:
-                if lane_no == entry["Lane"]:
-
-                    sample = entry["Sample"]
-                    #Finds name subset "P Anything Underscore Digits"
-                    if sample != "Undetermined":
-                        sample = proj_pattern.search(sample).group(0)
-
-                    if entry['Barcode sequence'] == "unknown" and sample != "Undetermined":
-                        noIndex = True
-                        if undet_included:
-                            problem_handler("error", "Logical error, undetermined cannot be included for a noIndex lane!")
-
-                    #Bracket for adding undetermined to results
-                    if not sample == 'Undetermined' and int(lane_no) in undet_lanes:
-                        undet_included = True
-                        #Sanity check for including undetermined
-                        #Next entry is undetermined and previous is for a different lane
-                        current_index = parser_struct.index(entry)
-                        undet = parser_struct[current_index + 1]
-                        if undet['Sample'] == 'Undetermined' and parser_struct[current_index - 1]['Lane'] != lane_no:
-                            try:
-                                clusterType = None
-                                if "PF Clusters" in undet:
-                                    clusterType = "PF Clusters"
-                                else:
-                                    clusterType = "Clusters"
-                                #Paired runs are divided by two within flowcell parser
-                                if process_stats["Paired"]:
-                                    undet_reads = int(undet[clusterType].replace(",",""))*2
-                                #Since a single ended run has no pairs, pairs is set to equal reads
-                                else:
-                                    undet_reads = int(undet[clusterType].replace(",",""))
-                                logger.info("Included undetermined for lane number {}".format(lane_no))
-                            except Exception as e:
-                                problem_handler("exit", "Unable to set values for undetermined #Reads and #Read Pairs: {}".format(str(e)))
-                        else:
-                            problem_handler("exit", "Undetermined for lane {} requested, which has more than one sample".format(lane_no))
-
-                    #Bracket for adding typical sample info
-                    if sample == current_name:
-                        #Sample samplesum construction
-                        if not sample in samplesum:
-                            samplesum[sample] = dict()
-                            samplesum[sample]['count'] = 1
-                        else:
-                            samplesum[sample]['count'] += 1
-
-                        try:
-                            def_atr = {"% of thelane":"% of Raw Clusters Per Lane", "% Perfectbarcode":"% Perfect Index Read",
-                                       "% One mismatchbarcode":"% One Mismatch Reads (Index)", "Yield (Mbases)":"Yield PF (Gb)",
-                                       "% PFClusters":"%PF", "Mean QualityScore":"Ave Q Score", "% >= Q30bases":"% Bases >=Q30"}
-                            for old_attr, attr in def_atr.items():
-                                #Sets default value for unwritten fields
-                                if entry[old_attr] == "" or entry[old_attr] == "NaN":
-                                    if old_attr == "% of Raw Clusters Per Lane":
-                                        default_value = 100.0
-                                    else:
-                                        default_value = 0.0
-
-                                    samplesum[sample][attr] = default_value if not attr in samplesum[sample] \
-                                    else samplesum[sample][attr] + default_value
-                                    logger.info("{} field not found. Setting default value: {}".format(attr, default_value))
-
-                                else:
-                                    #Yields needs division by 1K, is also non-percentage
-                                    if old_attr == "Yield (Mbases)":
-                                        samplesum[sample][attr] = my_float(entry[old_attr].replace(",",""))/1000 if not attr in samplesum[sample] \
-                                        else samplesum[sample][attr] + my_float(entry[old_attr].replace(",",""))/1000
-                                    else:
-                                        samplesum[sample][attr] = my_float(entry[old_attr]) if not attr in samplesum[sample] \
-                                        else samplesum[sample][attr] + my_float(entry[old_attr])
-
-                        except Exception as e:
-                            problem_handler("exit", "Unable to set artifact values. Check laneBarcode.html for odd values: {}".format(str(e)))
-
-                        #Fetches clusters from laneBarcode.html file
-                        if noIndex:
-                            # For the case of NovaSeq run, parse lane yield from the ResultsFile of all_outputs.
-                            if seq_process.type.name in [
-                                "AUTOMATED - NovaSeq Run (NovaSeq 6000 v2.0)",
-                                "Illumina Sequencing (NextSeq) v1.0",
-                                "NovaSeqXPlus Run v1.0",
-                            ]:
-                                try:
-                                    for inp in seq_process.all_outputs():
-                                        if inp.output_type == "ResultFile" and inp.name.split(' ')[1] == lane_no and "Reads PF (M) R1" in inp.udf:
-                                            if process_stats["Paired"]:
-                                                target_file.udf["# Reads"] = inp.udf["Reads PF (M) R1"]*1000000*2
-                                                target_file.udf["# Read Pairs"] = target_file.udf["# Reads"]/2
-                                            else:
-                                                target_file.udf["# Reads"] = inp.udf["Reads PF (M) R1"]*1000000
-                                                target_file.udf["# Read Pairs"] = target_file.udf["# Reads"]
-                                    logger.info("{}# Reads".format(target_file.udf["# Reads"]))
-                                    logger.info("{}# Read Pairs".format(target_file.udf["# Read Pairs"]))
-                                except Exception as e:
-                                    problem_handler("exit", "Unable to set values for #Reads and #Read Pairs for perceived noIndex lane: {}".format(str(e)))
-                            # For all other cases, parse lane yield from all_inputs
-                            else:
-                                try:
-                                    for inp in seq_process.all_inputs():
-                                        #If reads in seq step, and the lane is equal to the current lane
-                                        # Handle special case for MiSeq with noIndex case:
-                                        inp_location = "1" if inp.location[1][0] == "A" else inp.location[1][0]
-                                        if inp_location == lane_no and "Clusters PF R1" in inp.udf:
-                                            if process_stats["Paired"]:
-                                                target_file.udf["# Reads"] = inp.udf["Clusters PF R1"]*2
-                                                target_file.udf["# Read Pairs"] = target_file.udf["# Reads"]/2
-                                            else:
-                                                target_file.udf["# Reads"] = inp.udf["Clusters PF R1"]
-                                                target_file.udf["# Read Pairs"] = target_file.udf["# Reads"]
-                                    logger.info("{}# Reads".format(target_file.udf["# Reads"]))
-                                    logger.info("{}# Read Pairs".format(target_file.udf["# Read Pairs"]))
-                                except Exception as e:
-                                    problem_handler("exit", "Unable to set values for #Reads and #Read Pairs for perceived noIndex lane: {}".format(str(e)))
-
-                        elif not noIndex:
-                            try:
-                                clusterType = None
-                                if "PF Clusters" in entry:
-                                    clusterType = "PF Clusters"
-                                else:
-                                    clusterType = "Clusters"
-                                #Paired runs are divided by two within flowcell parser
-                                basenumber = int(entry[clusterType].replace(",",""))
-                                if process_stats["Paired"]:
-                                    #Undet always 0 unless manually included
-                                    samplesum[sample]["# Reads"] = basenumber*2 + undet_reads if not "# Reads" in samplesum[sample] \
-                                    else samplesum[sample]["# Reads"] + basenumber*2 + undet_reads
-
-                                    samplesum[sample]["# Read Pairs"] = basenumber + undet_reads/2 if not "# Read Pairs" in samplesum[sample] \
-                                    else samplesum[sample]["# Read Pairs"] + basenumber + undet_reads/2
-                                #Since a single ended run has no pairs, pairs is set to equal reads
-                                else:
-                                    #Undet always 0 unless manually included
-                                    samplesum[sample]["# Reads"] = basenumber + undet_reads if not "# Reads" in samplesum[sample] \
-                                    else samplesum[sample]["# Reads"] + basenumber + undet_reads
-
-                                    samplesum[sample]["# Read Pairs"] = samplesum[sample]["# Reads"] if not "# Read Pairs" in samplesum[sample] \
-                                    else samplesum[sample]["# Read Pairs"] + samplesum[sample]["# Reads"]
-                            except Exception as e:
-                                problem_handler("exit", "Unable to set values for #Reads and #Read Pairs: {}".format(str(e)))
-
-                        #Spools samplesum into samples
-                        try:
-                            if samplesum[sample]["count"] > 1:
-                                logger.info("Iteratively pooling samples in same lane.")
-                            for thing in samplesum:
-                                for k,v in samplesum[thing].items():
-                                    if thing == sample and thing == current_name:
-                                        if k is "count":
-                                            logger.info("Setting values for sample {} of lane {}".format(thing, lane_no))
-                                        #Average for percentages
-                                        elif k in ['% One Mismatch Reads (Index)', '% Perfect Index Read', 'Ave Q Score', '%PF',\
-                                            '% of Raw Clusters Per Lane', '% Bases >=Q30']:
-                                            target_file.udf[k] = v/samplesum[thing]["count"]
-                                        elif k is not "count":
-                                            target_file.udf[k] = samplesum[thing][k]
-                                        if samplesum[sample]["count"] > 1:
-                                            logger.info("Pooled total for {} of sample {} is set to {}".format(k, thing, v))
-                                        else:
-                                            logger.info("Attribute {} of sample {} is set to {}".format(k, thing, v))
-                        except Exception as e:
-                            problem_handler("exit", "Unable to set artifact values. Check laneBarcode.html for odd values: {}".format(str(e)))
-
-                        #Applies thresholds to samples
-                        try:
-                            if (demux_process.udf["Threshold for % bases >= Q30"] <= my_float(entry["% >= Q30bases"]) and
-                                int(exp_smp_per_lne) <= target_file.udf["# Read Pairs"] ):
-                                target_file.udf["Include reads"] = "YES"
-                                target_file.qc_flag = "PASSED"
-                            else:
-                                target_file.udf["Include reads"] = "NO"
-                                target_file.qc_flag = "FAILED"
-                                failed_entries = failed_entries + 1
-                            logger.info("Q30 %: {}% found, minimum at {}%".\
-                            format(my_float(entry["% >= Q30bases"]), demux_process.udf["Threshold for % bases >= Q30"]))
-                            logger.info("Expected reads: {} found, minimum at {}".format(target_file.udf["# Read Pairs"], int(exp_smp_per_lne)))
-                            logger.info("Sample QC status set to {}".format(target_file.qc_flag))
-                        except Exception as e:
-                            problem_handler("exit", "Unable to set QC status for sample: {}".format(str(e)))
-
-                        lane_reads = lane_reads + target_file.udf["# Reads"]
-
-                    #Counts undetermined
-                    elif sample == "Undetermined":
-                        if "PF Clusters" in entry:
-                            clusterType = "PF Clusters"
-                        else:
-                            clusterType = "Clusters"
-
-                        if process_stats["Paired"]:
-                            undet_lane_reads = int(entry[clusterType].replace(",",""))*2
-                        else:
-                            undet_lane_reads = int(entry[clusterType].replace(",",""))
-
-            if list(target_file.udf.items()) == [] and current_name != "Undetermined":
-                problem_handler("exit", "Lanebarcode mismatch. Expected sample \"{}\" of lane \"{}\", found \"{}\"".format(current_name, lane_no, sample))
-
-            #Push lane into lims
-            try:
-                target_file.put()
-            except Exception as e:
-                problem_handler("exit", "Failed to apply artifact data to LIMS. Possibly due to data in laneBarcode.html; {}".format(str(e)))
+                problem_handler("exit", "Unable to set values for #Reads and #Read Pairs for perceived noIndex lane: {}".format(str(e)))
+
+        #Bracket for adding undetermined to results
+        positions = table.sample_positions(lane_no)
+        if len(positions) and int(lane_no) in undet_lanes:
+            undet_included = True
+            #Sanity check for including undetermined
+            #Next entry is undetermined and previous is for a different lane
+            for current_index in positions:
+                if (current_index + 1 < len(table) and table.undetermined[current_index + 1]
+                        and table.lane[current_index - 1] != lane_no):
+                    #Paired runs are divided by two within flowcell parser
+                    included[lane_no] = int(table.clusters[current_index + 1])*(2 if paired else 1)
+                    logger.info("Included undetermined for lane number {}".format(lane_no))
+                else:
+                    problem_handler("exit", "Undetermined for lane {} requested, which has more than one sample".format(lane_no))
+        pool_lanes.append((lane_no, undet_included))
 
-        #Counts undetermined per lane
-        if not undet_included:
+        #Artifacts in each lane
+        for target_file in outarts_per_lane:
             try:
-                found_undet = round(
-                    my_float(undet_lane_reads) / (lane_reads + undet_lane_reads) * 100,
-                    2,
-                )
-
-            # Only plausible error situation. Avoids zero division
+                names.append(target_file.samples[0].name)
             except Exception as e:
-                problem_handler(
-                    "error",
-                    "BCLConverter parsing error. No reads detected for lane {}.".format(
-                        lane_no
-                    ),
+                problem_handler("exit", "Unable to determine sample name. Incorrect sample variable in process: {}".format(str(e)))
+            targets.append(target_file)
+            target_lanes.append(lane_no)
+            expected.append(int(exp_smp_per_lne))
+
+    #Aggregates the laneBarcode rows of every artifact, undet always 0 unless manually included
+    stats = table.sample_stats(target_lanes, names, paired, included)
+    target_lanes = np.array(target_lanes, dtype=object)
+    names = np.array(names, dtype=object)
+    matched = stats.rows > 0
+    unmatched = np.flatnonzero(~matched & (names != "Undetermined"))
+    if len(unmatched):
+        i = unmatched[0]
+        problem_handler("exit", "Lanebarcode mismatch. Expected sample \"{}\" of lane \"{}\", found \"{}\"".format(
+            names[i], target_lanes[i], table.last_sample(target_lanes[i])))
+
+    reads = stats.reads.astype(np.float64)
+    read_pairs = stats.read_pairs.copy()
+    for lane_no, (lane_reads, lane_pairs) in seq_reads.items():
+        in_lane = target_lanes == lane_no
+        reads[in_lane] = lane_reads
+        read_pairs[in_lane] = lane_pairs
+
+    #Applies thresholds to samples
+    q30 = stats.udfs["% Bases >=Q30"]
+    q30_threshold = demux_process.udf["Threshold for % bases >= Q30"]
+    passed = qc_passed(q30, read_pairs, q30_threshold, expected)
+    failed_entries = int(np.count_nonzero(matched & ~passed))
+
+    #Spools the table into the artifacts, in one pass
+    for i, target_file in enumerate(targets):
+        if matched[i]:
+            lane_no = target_lanes[i]
+            logger.info("Setting values for sample {} of lane {}".format(names[i], lane_no))
+            if stats.rows[i] > 1:
+                logger.info("Iteratively pooling samples in same lane.")
+            for attr, values in stats.udfs.items():
+                if stats.missing[attr][i]:
+                    logger.info("{} field not found. Setting default value: {}".format(attr, 0.0))
+                target_file.udf[attr] = float(values[i])
+            if lane_no in seq_reads:
+                target_file.udf["# Reads"], target_file.udf["# Read Pairs"] = seq_reads[lane_no]
+            else:
+                target_file.udf["# Reads"] = int(stats.reads[i])
+                target_file.udf["# Read Pairs"] = float(stats.read_pairs[i]) if paired else int(stats.read_pairs[i])
+            for attr, value in target_file.udf.items():
+                logger.info("Attribute {} of sample {} is set to {}".format(attr, names[i], value))
+
+            if passed[i]:
+                target_file.udf["Include reads"] = "YES"
+                target_file.qc_flag = "PASSED"
+            else:
+                target_file.udf["Include reads"] = "NO"
+                target_file.qc_flag = "FAILED"
+            logger.info("Q30 %: {}% found, minimum at {}%".format(q30[i], q30_threshold))
+            logger.info("Expected reads: {} found, minimum at {}".format(read_pairs[i], expected[i]))
+            logger.info("Sample QC status set to {}".format(target_file.qc_flag))
+
+        #Queue lane for the batch update into lims
+        buffer.add(target_file, on_fail=None)
+
+    #Counts undetermined per lane
+    lane_codes, target_codes = np.unique(target_lanes.astype(str), return_inverse=True)
+    reads_per_lane = dict(zip(lane_codes, np.bincount(target_codes, weights=np.where(matched, reads, 0.0), minlength=len(lane_codes))))
+    lane_undet_reads = table.undetermined_reads(paired)
+    undet_lane_reads = [lane_undet_reads.get(lane_no, 0) for lane_no, _ in pool_lanes]
+    found_undet = undetermined_percent(undet_lane_reads, [reads_per_lane.get(lane_no, 0) for lane_no, _ in pool_lanes])
+    for (lane_no, lane_included), undet, found in zip(pool_lanes, undet_lane_reads, found_undet):
+        if lane_included:
+            continue
+        # Only plausible error situation. Avoids zero division
+        if np.isnan(found):
+            problem_handler(
+                "error",
+                "BCLConverter parsing error. No reads detected for lane {}.".format(
+                    lane_no
+                ),
+            )
+        # If undetermined reads are greater than threshold*reads_in_lane
+        elif lane_no not in no_index_lanes:
+            if found > demux_process.udf["Maximum % Undetermined Reads per Lane"]:
+                problem_handler("warning", "Undemultiplexed reads for lane {} was {} ({})% thus exceeding defined limit." \
+                               .format(lane_no, undet, found))
+            else:
+                logger.info(
+                    "Found {} ({}%) undemultiplexed reads for lane {}.".format(
+                        undet, found, lane_no
+                    )
                 )
 
-            # If undetermined reads are greater than threshold*reads_in_lane
-            if not noIndex:
-                if found_undet > demux_process.udf["Maximum % Undetermined Reads per Lane"]:
-                    problem_handler("warning", "Undemultiplexed reads for lane {} was {} ({})% thus exceeding defined limit." \
-                                   .format(lane_no, undet_lane_reads, found_undet))
-                else:
-                    logger.info(
-                        "Found {} ({}%) undemultiplexed reads for lane {}.".format(
-                            undet_lane_reads, found_undet, lane_no
-                        )
-                    )
+    #Push all lanes into lims
+    try:
+        failed = buffer.flush()
+    except Exception as e:
+        problem_handler("exit", "Failed to apply artifact data to LIMS. Possibly due to data in laneBarcode.html; {}".format(str(e)))
+    if failed:
+        problem_handler("exit", "Failed to apply artifact data to LIMS. Possibly due to data in laneBarcode.html; {}".format(
+            "; ".join("{}: {}".format(art_id, buffer.errors[art_id]) for art_id in failed)))
 
     if undet_included:
         problem_handler("warning", "Undetermined reads included in read count!")
@@ -516,34 +447,30 @@ def write_demuxfile(process_stats, demux_id):
         process_stats["Run ID"],
         "laneBarcode.html",
     )
-    try:
-        laneBC = classes.LaneBarcodeParser(lanebc_path)
-    except Exception as e:
-        problem_handler("exit", "Unable to fetch laneBarcode.html from {}: {}".format(lanebc_path, str(e)))
     fname = "{}_demuxstats_{}.csv".format(demux_id, process_stats["Flow Cell ID"])
 
+    #Rows are written as they are parsed, only their compact records are kept
+    sample_data = []
     #Writes less undetermined info than undemultiplex_index.py. May cause problems downstreams
     with open(fname, "w") as csvfile:
         writer = csv.writer(csvfile)
         writer.writerow(["Project", "Sample ID", "Lane", "# Reads", "Index","Index name", "% of >= Q30 Bases (PF)"])
-        for entry in laneBC.sample_data:
-            index_name = ""
-            if "PF Clusters" in entry:
-                reads = entry["PF Clusters"]
-            else:
-                reads = entry["Clusters"]
-
-            if process_stats["Paired"]:
-                reads = int(reads.replace(",",""))*2
-            else:
-                reads = int(reads.replace(",",""))
+        try:
+            for entry in iter_rows(lanebc_path):
+                sample_data.append(entry)
+                index_name = ""
+                if process_stats["Paired"]:
+                    reads = entry.clusters*2
+                else:
+                    reads = entry.clusters
 
-            try:
-                writer.writerow([entry["Project"],entry["Sample"],entry["Lane"],reads, \
-                                 entry["Barcode sequence"],index_name,entry["% >= Q30bases"]])
-            except Exception as e:
-                problem_handler("exit", "Flowcell parser is unable to fetch all necessary fields for demux file: {}".format(str(e)))
-    return laneBC.sample_data
+                writer.writerow([entry.project,entry.sample,entry.lane,reads, \
+                                 entry.barcode,index_name,entry.q30_text])
+        except (OSError, ValueError) as e:
+            problem_handler("exit", "Unable to fetch laneBarcode.html from {}: {}".format(lanebc_path, str(e)))
+        except Exception as e:
+            problem_handler("exit", "Flowcell parser is unable to fetch all necessary fields for demux file: {}".format(str(e)))
+    return sample_data
 
 def main(process_lims_id, demux_id, log_id):
     #Sets up logger
@@ -561,7 +488,7 @@ def main(process_lims_id, demux_id, log_id):
 
     logger.info("--process_lims_id {} --demux_id {} --log_id {}".format(process_lims_id, demux_id, log_id))
 
-    demux_process = Process(lims,id = process_lims_id)
+    demux_process = prefetch_step(lims, process_lims_id)
 
     #Fetches info on "workflow" level
     process_stats = get_process_stats(demux_process)
@@ -590,4 +517,5 @@ if __name__ =="__main__":
     args = parser.parse_args()
     lims = Lims(BASEURI, USERNAME, PASSWORD)
     lims.check_version()
+    cache_from_env(lims)
     main(args.process_lims_id, args.demux_id, args.log_id)
@@ -9,6 +9,7 @@ from datetime import datetime
 from genologics.lims import Lims
 from genologics.entities import Process
 from genologics.config import BASEURI, USERNAME, PASSWORD
+from scilifelab_epps.metrics import nas_open
 
 
 DESC = """EPP used to create run recipe for NovaSeq sequencing
@@ -75,7 +76,7 @@ def main(lims, args):
     # Write json file
     if os.path.exists("/srv/ngi-nas-ns/NovaSeq_data/gls_recipe_novaseq/"):
         try:
-            with open("/srv/ngi-nas-ns/NovaSeq_data/gls_recipe_novaseq/{}.json".format(fc_name), 'w') as sf:
+            with nas_open("/srv/ngi-nas-ns/NovaSeq_data/gls_recipe_novaseq/{}.json".format(fc_name), 'w') as sf:
                 json.dump(output,sf,separators=(',',':'))
         except Exception as e:
             log.append(str(e))
@@ -4,6 +4,7 @@ from genologics.lims import Lims
 from genologics.config import BASEURI, USERNAME, PASSWORD
 from genologics.entities import Process
 from epp_utils import udf_tools, formula
+from epp_utils.lineage import LineageGraph
 import sys
 from datetime import datetime as dt
 
@@ -33,7 +34,8 @@ def main(lims, args):
     currentStep = Process(lims, id=args.pid)
 
     log = []
-    art_tuples = udf_tools.get_art_tuples(currentStep)
+    lineage = LineageGraph()
+    art_tuples = lineage.tuples(currentStep)
 
     for art_tuple in art_tuples:
         art_in = art_tuple[0]["uri"]
@@ -42,7 +44,12 @@ def main(lims, args):
 
         # Get last known length
         size_bp, size_bp_history = udf_tools.fetch_last(
-            currentStep, art_tuple, "Size (bp)", on_fail=None, print_history=True
+            currentStep,
+            art_tuple,
+            "Size (bp)",
+            on_fail=None,
+            print_history=True,
+            lineage=lineage,
         )
         log.append(f"'Size (bp)': {size_bp}\n{size_bp_history}")
 
@@ -6,15 +6,20 @@ from genologics.lims import Lims
 from genologics.config import BASEURI, USERNAME, PASSWORD
 from genologics.entities import Process
 from datetime import datetime as dt
-import pandas as pd
+from functools import partial
 import re
 import sys
-import shutil
 import os
 from datetime import datetime as dt
 from epp_utils import udf_tools
 from epp_utils.formula import well_name2num_96plate as well2num
 
+from epp_utils.lazy import lazy_import
+from scilifelab_epps.publish import atomic_copy, lims_upload, publish
+from scilifelab_epps.reagent_index import reagent_sequence
+
+pd = lazy_import("pandas")
+
 DESC = """ Script for EPP "Generate ONT Sample Sheet" and file slot(s) "ONT sample sheet" (and optionally "Anglerfish sample sheet").
 Used to generate MinKNOW (and Anglerfish) samplesheets.
 """
@@ -72,39 +77,32 @@ def main(lims, args):
         if "MinION QC" in currentStep.type.name:
 
             minknow_samplesheet_file = minknow_samplesheet_for_qc(currentStep)
-            upload_file(
+            publish_samplesheet(
                 minknow_samplesheet_file,
                 "ONT sample sheet",
+                f"/srv/ngi-nas-ns/samplesheets/nanopore/{dt.now().year}",
                 currentStep,
                 lims,
             )
-            shutil.copyfile(
-                minknow_samplesheet_file,
-                f"/srv/ngi-nas-ns/samplesheets/nanopore/{dt.now().year}/{minknow_samplesheet_file}",
-            )
-            os.remove(minknow_samplesheet_file)
 
             anglerfish_samplesheet_file = anglerfish_samplesheet(currentStep)
-            upload_file(
+            publish_samplesheet(
                 anglerfish_samplesheet_file,
                 "Anglerfish sample sheet",
+                f"/srv/ngi-nas-ns/samplesheets/anglerfish/{dt.now().year}",
                 currentStep,
                 lims,
             )
-            shutil.copyfile(
-                anglerfish_samplesheet_file,
-                f"/srv/ngi-nas-ns/samplesheets/anglerfish/{dt.now().year}/{anglerfish_samplesheet_file}",
-            )
-            os.remove(anglerfish_samplesheet_file)
 
         else:
             minknow_samplesheet_file = minknow_samplesheet_default(currentStep)
-            upload_file(minknow_samplesheet_file, "ONT sample sheet", currentStep, lims)
-            shutil.copyfile(
+            publish_samplesheet(
                 minknow_samplesheet_file,
-                f"/srv/ngi-nas-ns/samplesheets/nanopore/{dt.now().year}/{minknow_samplesheet_file}",
+                "ONT sample sheet",
+                f"/srv/ngi-nas-ns/samplesheets/nanopore/{dt.now().year}",
+                currentStep,
+                lims,
             )
-            os.remove(minknow_samplesheet_file)
 
     except AssertionError as e:
         sys.stderr.write(str(e))
@@ -334,6 +332,10 @@ def anglerfish_samplesheet(currentStep):
 
         index_pattern = re.compile("[ACTG]{4,}-?[ACTG]{4,}")
         index_search = re.search(index_pattern, sample.reagent_labels[0])
+        if not index_search:
+            # Label without the sequence in its name, look it up by name
+            sequence = reagent_sequence(currentStep.lims, sample.reagent_labels[0])
+            index_search = re.search(index_pattern, sequence or "")
 
         assert index_search, f"No reagent labels found for samples {sample.name}"
 
@@ -370,9 +372,20 @@ def anglerfish_samplesheet(currentStep):
 def upload_file(file_name, file_slot, currentStep, lims):
     for out in currentStep.all_outputs():
         if out.name == file_slot:
-            for f in out.files:
-                lims.request_session.delete(f.uri)
-            lims.upload_new_file(out, file_name)
+            lims_upload(lims, out, file_name)
+
+
+def publish_samplesheet(file_name, file_slot, nas_dir, currentStep, lims):
+    """Upload file_name to file_slot and copy it to nas_dir concurrently, then
+    remove it. The first error is raised once both are done."""
+    publish(
+        {
+            "LIMS": partial(upload_file, file_name, file_slot, currentStep, lims),
+            "NAS": partial(atomic_copy, file_name, os.path.join(nas_dir, file_name)),
+        },
+        raise_errors=True,
+    )
+    os.remove(file_name)
 
 
 def write_minknow_csv(df, file_name):
@@ -5,11 +5,14 @@ from genologics.config import BASEURI, USERNAME, PASSWORD
 from genologics.entities import Process
 from zika_utils import fetch_sample_data
 from epp_utils import formula
-from numpy import minimum
 from tabulate import tabulate
 from datetime import datetime as dt
 import sys
 
+from epp_utils.lazy import lazy_import
+
+np = lazy_import("numpy")
+
 DESC = """
 EPP "ONT pooling", file slot "ONT pooling log".
 
@@ -73,7 +76,7 @@ def main(lims, args):
                 target_amt_fmol = pool_target_amt_fmol / len(df_pool)
 
                 # Apply molar proportions to target amount to get transfer volumes
-                df_pool["transfer_vol_ul"] = minimum(
+                df_pool["transfer_vol_ul"] = np.minimum(
                     target_amt_fmol / df_pool.conc_nM, df_pool.vol_ul
                 )
                 pool_transfer_vol = sum(df_pool.transfer_vol_ul)
@@ -88,7 +91,7 @@ def main(lims, args):
                 log.append(f"Target vol: {round(pool_target_vol,1)} uL")
 
                 # Apply molar proportions to target volume to get transfer amounts
-                df_pool["transfer_vol_ul"] = minimum(
+                df_pool["transfer_vol_ul"] = np.minimum(
                     pool_target_vol * df_pool.prop_nM_inv, df_pool.vol_ul
                 )
                 pool_transfer_vol = sum(df_pool.transfer_vol_ul)
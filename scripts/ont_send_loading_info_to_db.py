@@ -7,7 +7,6 @@ from genologics.config import BASEURI, USERNAME, PASSWORD
 from genologics.entities import Process
 from ont_send_reloading_info_to_db import get_ONT_db
 import sys
-import pandas as pd
 from io import StringIO
 from datetime import datetime as dt
 import re
@@ -15,6 +14,10 @@ from epp_utils import udf_tools
 from ont_generate_samplesheet import minknow_samplesheet_default
 import os
 
+from epp_utils.lazy import lazy_import
+
+pd = lazy_import("pandas")
+
 DESC = """ Script for EPP "ont_send_loading_info_to_db".
 
 Ensure all samples in the step correspond to an ONT run that was started with the correct samplesheet.
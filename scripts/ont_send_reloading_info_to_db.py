@@ -8,10 +8,13 @@ from genologics.entities import Process
 from datetime import datetime as dt
 import re
 import os
-import couchdb
 import yaml
 import sys
 
+from epp_utils.lazy import lazy_import
+
+couchdb = lazy_import("couchdb")
+
 
 DESC = """ Script for EPP "Send ONT flowcell info to StatusDB".
 Used to record the washing and reloading of ONT flow cells.
@@ -4,6 +4,7 @@ from genologics.lims import Lims
 from genologics.config import BASEURI, USERNAME, PASSWORD
 from genologics.entities import Process
 from epp_utils import formula, udf_tools
+from epp_utils.lineage import LineageGraph
 from datetime import datetime as dt
 import sys
 
@@ -22,7 +23,8 @@ def main(lims, args):
         currentStep = Process(lims, id=args.pid)
 
         log = []
-        art_tuples = udf_tools.get_art_tuples(currentStep)
+        lineage = LineageGraph()
+        art_tuples = lineage.tuples(currentStep)
 
         for art_tuple in art_tuples:
             art_in = art_tuple[0]["uri"]
@@ -46,6 +48,7 @@ def main(lims, args):
                         target_udfs="Size (bp)",
                         print_history=True,
                         on_fail=None,
+                        lineage=lineage,
                     )
                     log.append(f"'Size (bp)': {size_bp}\n{size_bp_history}")
                 else:
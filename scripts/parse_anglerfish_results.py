@@ -11,7 +11,6 @@ Author: Chuan Wang, Science for Life Laboratory, Stockholm, Sweden
 import os
 import sys
 import logging
-import numpy as np
 import codecs
 import re
 import glob
@@ -25,6 +24,11 @@ from genologics.entities import Process
 from scilifelab_epps.epp import EppLogger
 from scilifelab_epps.epp import ReadResultFiles
 from scilifelab_epps.epp import set_field
+from scilifelab_epps.metrics import nas_open
+
+from epp_utils.lazy import lazy_import
+
+np = lazy_import("numpy")
 
 NGITENXSAMPLE_PAT = re.compile("P[0-9]+_[0-9]+_[0-9]+")
 NGISAMPLE_PAT =re.compile("P[0-9]+_[0-9]+")
@@ -44,7 +48,7 @@ def get_anglerfish_output_file(lims, process):
                 # Second try fetching the Anglerfish result file from the storage server
                 if os.path.exists("/srv/ngi-nas-ns/nanopore_results/anglerfish/{}".format(thisyear)):
                     try:
-                        with open("/srv/ngi-nas-ns/nanopore_results/anglerfish/{}/anglerfish_stats_{}.txt".format(thisyear, flowcell_id), 'r') as asf:
+                        with nas_open("/srv/ngi-nas-ns/nanopore_results/anglerfish/{}/anglerfish_stats_{}.txt".format(thisyear, flowcell_id), 'r') as asf:
                             content = asf.readlines()
                         lims.upload_new_file(outart,max(glob.glob("/srv/ngi-nas-ns/nanopore_results/anglerfish/{}/anglerfish_stats_{}.txt".format(thisyear, flowcell_id)),key=os.path.getctime))
                     except:
@@ -28,6 +28,7 @@ from genologics.lims import Lims
 from genologics.config import BASEURI, USERNAME, PASSWORD
 from genologics.entities import Process
 from scilifelab_epps.epp import EppLogger
+from scilifelab_epps.metrics import nas_open
 from scilifelab_epps.epp import set_field
 
 class QualityFilter():
@@ -46,7 +47,7 @@ class QualityFilter():
     def read_QF_file(self):
         """ QF file is read from the file msf system. Path hard coded."""
         file_path = ("/srv/ngi-nas-ns/QF/{0}/{1}.csv".format(self.project_name, self.flowcell_id))
-        of = open(file_path ,'r')
+        of = nas_open(file_path ,'r')
         self.source_file = [row for row in csv.reader(of.read().splitlines())]
         of.close()
 
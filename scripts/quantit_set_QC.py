@@ -47,7 +47,6 @@ Written by Maya Brandi
 import os
 import sys
 import logging
-import numpy as np
 
 from argparse import ArgumentParser
 from requests import HTTPError
@@ -58,6 +57,10 @@ from scilifelab_epps.epp import EppLogger
 from scilifelab_epps.epp import set_field
 from scilifelab_epps.epp import ReadResultFiles
 
+from epp_utils.lazy import lazy_import
+
+np = lazy_import("numpy")
+
 class QuantitQC():
     def __init__(self, process):
         self.result_files = process.result_files()
@@ -50,7 +50,6 @@ Written by Maya Brandi
 import os
 import sys
 import logging
-import numpy as np
 
 from argparse import ArgumentParser
 from requests import HTTPError
@@ -61,6 +60,10 @@ from scilifelab_epps.epp import EppLogger
 from scilifelab_epps.epp import set_field
 from scilifelab_epps.epp import ReadResultFiles
 
+from epp_utils.lazy import lazy_import
+
+np = lazy_import("numpy")
+
 class QuantitConc():
     def __init__(self, process, file_handler):
         self.file_handler = file_handler
@@ -8,6 +8,7 @@ from argparse import ArgumentParser
 from genologics.lims import Lims
 from genologics.config import BASEURI,USERNAME,PASSWORD
 from scilifelab_epps.epp import attach_file, EppLogger
+from scilifelab_epps.fanout import fan_out, install_pooled_session
 import logging
 import sys
 import os
@@ -24,13 +25,21 @@ def main(lims, args, logger):
     errnb=0
     summary={}
     logart=None
+    #sum the reads of all solo sample outputs concurrently, the lookups are independent
+    install_pooled_session(lims)
+    solo_samples = [art.samples[0] for art in p.all_outputs() if art.type=='Analyte' and len(art.samples)==1]
+    for sample in solo_samples:
+        summary.setdefault(sample.name, {})
+    total_reads_per_sample = dict(zip(
+        [sample.id for sample in solo_samples],
+        fan_out(lambda sample: sumreads(sample, summary), solo_samples)))
     for output_artifact in p.all_outputs():
         #filter to only keep solo sample demultiplexing output artifacts
         if output_artifact.type=='Analyte' and len(output_artifact.samples)==1:
             sample=output_artifact.samples[0]
             samplenb+=1
             #update the total number of reads
-            total_reads=sumreads(sample, summary)
+            total_reads=total_reads_per_sample[sample.id]
             sample.udf['Total Reads (M)']=total_reads
             output_artifact.udf['Set Total Reads']=total_reads
             logging.info("Total reads is {0} for sample {1}".format(sample.udf['Total Reads (M)'],sample.name))
@@ -1,9 +1,9 @@
 #!/usr/bin/env python
 
+import csv
 import re
 import os
 import sys
-import pandas as pd
 
 try:
     from io import StringIO
@@ -12,21 +12,42 @@ except ImportError:
 
 from argparse import ArgumentParser
 from datetime import datetime
+from functools import partial
 from genologics.lims import Lims
-from genologics.entities import Process
 from genologics.config import BASEURI, USERNAME, PASSWORD
-
-from data.Chromium_10X_indexes import Chromium_10X_indexes
+from scilifelab_epps.lims_cache import cache_from_env
+from scilifelab_epps.async_lims import prefetch_step
+from scilifelab_epps.publish import atomic_write, lims_upload, publish
+from scilifelab_epps.reagent_index import reagent_sequence
+from scilifelab_epps.samplesheet_cache import RowCache, artifact_state, sheet_diff, uploaded_file
+
+from epp_utils.barcodes import (
+    TENX_DUAL_PAT,
+    TENX_SINGLE_PAT,
+    BarcodeResolver,
+    find_barcode,
+)
+from epp_utils.bclconvert import validate_rows, write_bclconvert
+from epp_utils.index_distance import close_pairs
+from epp_utils.index_registry import registry
+from epp_utils.lane_assignment import Pool, assign_lanes, describe
+from epp_utils.project_memo import ProjectMemo
+
+from epp_utils.lazy import lazy_import
+
+pd = lazy_import("pandas")
 
 DESC = """EPP used to create samplesheets for Illumina sequencing platforms"""
 
+# Indexes of the samples, shared by the lookups of the run
+BARCODES = BarcodeResolver()
+# Project fields of the samples, shared by the row builders
+PROJECTS = ProjectMemo()
+# Sequences of the 10X and SMARTSEQ3 index kits
+INDEX_KITS = registry()
+
 # Pre-compile regexes in global scope:
-IDX_PAT = re.compile("([ATCG]{4,}N*)-?([ATCG]*)")
-TENX_SINGLE_PAT = re.compile("SI-(?:GA|NA)-[A-H][1-9][0-2]?")
-TENX_DUAL_PAT = re.compile("SI-(?:TT|NT|NN|TN|TS)-[A-H][1-9][0-2]?")
-SMARTSEQ_PAT = re.compile('SMARTSEQ[1-9]?-[1-9][0-9]?[A-P]')
 NGISAMPLE_PAT =re.compile("P[0-9]+_[0-9]+")
-SEQSETUP_PAT =re.compile("[0-9]+-[0-9A-z]+-[0-9A-z]+-[0-9]+")
 
 def check_index_distance(data, log):
     lanes=set([x['lane'] for x in data])
@@ -34,187 +55,230 @@ def check_index_distance(data, log):
         indexes = [x.get('idx1','')+x.get('idx2','') for x in data if x['lane'] == l]
         if not indexes or len(indexes) == 1:
             return None
-        for i,b in enumerate(indexes[:-1]):
-            start=i+1
-            for b2 in indexes[start:]:
-                d=my_distance(b,b2)
-                if d<2:
-                    log.append("Found indexes {} and {} in lane {}, indexes are too close".format(b,b2,l))
-
-
-def my_distance(idx1, idx2):
-    short=min((idx1, idx2), key=len)
-    lon= idx1 if short == idx2 else idx2
-
-    diffs=0
-    for  i, c in enumerate(short):
-        if c != lon[i]:
-            diffs+=1
-    return diffs
-
-
-def gen_Novaseq_lane_data(pro):
+        for i, j, d in close_pairs([indexes]):
+            log.append("Found indexes {} and {} in lane {}, indexes are too close".format(indexes[i],indexes[j],l))
+
+
+def expected_reads(sample):
+    """Expected reads of sample in millions, from its 'Reads Min' UDF or the
+    one of its project, None if neither is set."""
+    reads = sample.udf.get('Reads Min')
+    if reads:
+        return float(reads)
+    project = PROJECTS.get(sample)
+    if project is not None and project.reads_min:
+        return float(project.reads_min) / 1000000
+    return None
+
+
+def pool_weights(samples_of_pool, log):
+    """{pool: expected reads in millions} of the pools, the samples without
+    expected reads counting as the mean of the others. Empty if no sample has
+    expected reads."""
+    reads = {
+        pool: [expected_reads(sample) for sample in samples]
+        for pool, samples in samples_of_pool.items()
+    }
+    known = [r for values in reads.values() for r in values if r is not None]
+    if not known:
+        log.append("No expected reads set for the samples, the lanes are balanced by pool copies only")
+        return {}
+    default = sum(known) / len(known)
+    return {pool: sum(default if r is None else r for r in values) for pool, values in reads.items()}
+
+
+def propose_lanes(pro, data, log):
+    """Log a placement of the pools of the flowcell on its lanes that avoids the
+    index conflicts found by check_index_distance, balancing the expected reads
+    of the lanes."""
+    pool_of_lane = {}
+    samples_of_pool = {}
+    for inp, outp in pro.input_output_maps:
+        if outp and outp['output-type'] == 'Analyte':
+            lane = outp['uri'].location[1].split(':')[0].replace(',','')
+            pool_of_lane[lane] = inp['uri'].name
+            samples_of_pool[inp['uri'].name] = outp['uri'].samples
+    lanes_of_pool = {}
+    for lane in sorted(set(x['lane'] for x in data)):
+        lanes_of_pool.setdefault(pool_of_lane.get(lane, lane), []).append(lane)
+    pools = {}
+    for x in data:
+        pool = pool_of_lane.get(x['lane'], x['lane'])
+        # The samples of a pool loaded on several lanes are the same on all
+        if x['lane'] == lanes_of_pool[pool][0]:
+            pools.setdefault(pool, {}).setdefault(x['sn'], []).append(x.get('idx1','')+x.get('idx2',''))
+    weights = pool_weights(samples_of_pool, log)
+    default = sum(weights.values()) / max(sum(len(samples) for samples in samples_of_pool.values()), 1)
+
+    def weight(name, samples):
+        if not weights:
+            return float(len(lanes_of_pool[name]))
+        return weights.get(name, default * len(samples))
+
+    try:
+        assignment = assign_lanes(
+            [Pool(name, samples, weight(name, samples), len(lanes_of_pool[name])) for name, samples in pools.items()],
+            len(set(x['lane'] for x in data)),
+        )
+    except Exception as e:
+        log.append("Cannot propose a placement of the pools on the lanes: {}".format(e))
+        return
+    log.append("Proposed placement of the pools on the lanes:")
+    log.extend(describe(assignment))
+
+
+LANE_DATA_HEADER = [
+    "FCID",
+    "Lane",
+    "Sample_ID",
+    "Sample_Name",
+    "Sample_Ref",
+    "index",
+    "index2",
+    "Description",
+    "Control",
+    "Recipe",
+    "Operator",
+    "Sample_Project",
+]
+
+
+class LaneDataAdapter:
+    """Platform specifics of the lane data samplesheets (NovaSeqXPlus)."""
+
+    header = LANE_DATA_HEADER
+    upper_idx1 = True
+    # InstrumentPlatform of the BCL Convert samplesheets
+    platform = "NovaSeqXSeries"
+
+    def idx2(self, pro, idx):
+        return idx.replace(',', '').upper()
+
+    def settings(self, pro):
+        """Step UDFs the rows depend on, for the incremental mode."""
+        return ''
+
+    def columns(self, line):
+        """Values of a row, in the order of the header."""
+        return [line['fc'], line['lane'], line['sn'], line['sn'], line['ref'], line['idx1'], line['idx2'], line['pj'], line['ct'], line['rc'], line['op'], line['pj']]
+
+
+class NovaseqAdapter(LaneDataAdapter):
+    """The i5 index is reverse-complemented for v1.0 reagents."""
+
+    platform = None
+
+    def idx2(self, pro, idx):
+        if pro.udf['Reagent Version'] == 'v1.5':
+            return idx.replace(',', '').upper()
+        elif pro.udf['Reagent Version'] == 'v1.0':
+            compl = {'A': 'T', 'C': 'G', 'G': 'C', 'T': 'A'}
+            return ''.join(reversed([compl.get(b, b) for b in idx.replace(',', '').upper()]))
+        raise ValueError("Unknown Reagent Version {}".format(pro.udf['Reagent Version']))
+
+    def settings(self, pro):
+        return pro.udf.get('Reagent Version', '')
+
+
+class NextseqAdapter(LaneDataAdapter):
+    """The i7 index is written as found in the LIMS."""
+
+    upper_idx1 = False
+    platform = None
+
+
+def gen_output_rows(pro, out, adapter):
+    """Rows of the samples of one lane of a Load to Flowcell step."""
+    rows = []
+    for sample in out.samples:
+        sample_idxs = set()
+        find_barcode(sample_idxs, sample, pro, BARCODES)
+        for idxs in sample_idxs:
+            sp_obj = {}
+            sp_obj['lane'] = out.location[1].split(':')[0].replace(',', '')
+            if NGISAMPLE_PAT.findall(sample.name):
+                sp_obj['sid'] = "Sample_{}".format(sample.name).replace(',', '')
+                sp_obj['sn'] = sample.name.replace(',', '')
+                project = PROJECTS.get(sample)
+                sp_obj['pj'] = project.name.replace('.', '__').replace(',', '')
+                sp_obj['ref'] = project.reference.replace(',', '')
+                sp_obj['rc'] = project.recipe
+            else:
+                sp_obj['sid'] = "Sample_{}".format(sample.name).replace('(', '').replace(')', '').replace('.', '').replace(' ', '_')
+                sp_obj['sn'] = sample.name.replace('(', '').replace(')', '').replace('.', '').replace(' ', '_')
+                sp_obj['pj'] = 'Control'
+                sp_obj['ref'] = 'Control'
+                sp_obj['rc'] = '0-0'
+            sp_obj['ct'] = 'N'
+            sp_obj['op'] = pro.technician.name.replace(" ", "_").replace(',', '')
+            sp_obj['fc'] = out.location[0].name.replace(',', '')
+            sp_obj['sw'] = out.location[1].replace(',', '')
+            sp_obj['idx1'] = idxs[0].replace(',', '')
+            if adapter.upper_idx1:
+                sp_obj['idx1'] = sp_obj['idx1'].upper()
+            sp_obj['idx2'] = adapter.idx2(pro, idxs[1]) if idxs[1] else ''
+            rows.append(sp_obj)
+    return rows
+
+
+def gen_lane_data(pro, adapter, cache=None):
+    """Rows of the samples of the lanes of a Load to Flowcell step.
+
+    With a RowCache, the rows of the lanes that did not change since the
+    previous run are reused instead of resolved again.
+    """
     data = []
-    header_ar = [
-        "FCID",
-        "Lane",
-        "Sample_ID",
-        "Sample_Name",
-        "Sample_Ref",
-        "index",
-        "index2",
-        "Description",
-        "Control",
-        "Recipe",
-        "Operator",
-        "Sample_Project",
-    ]
     for out in pro.all_outputs():
-        if  out.type == "Analyte":
-            for sample in out.samples:
-                sample_idxs = set()
-                find_barcode(sample_idxs, sample, pro)
-                for idxs in sample_idxs:
-                    sp_obj = {}
-                    sp_obj['lane'] = out.location[1].split(':')[0].replace(',','')
-                    if NGISAMPLE_PAT.findall(sample.name):
-                        sp_obj['sid'] = "Sample_{}".format(sample.name).replace(',','')
-                        sp_obj['sn'] = sample.name.replace(',','')
-                        sp_obj['pj'] = sample.project.name.replace('.','__').replace(',','')
-                        sp_obj['ref'] = sample.project.udf.get('Reference genome','').replace(',','')
-                        seq_setup = sample.project.udf.get('Sequencing setup', '')
-                        if SEQSETUP_PAT.findall(seq_setup):
-                            sp_obj['rc'] = '{}-{}'.format(seq_setup.split('-')[0], seq_setup.split('-')[3])
-                        else:
-                            sp_obj['rc'] = '0-0'
-                    else:
-                        sp_obj['sid'] = "Sample_{}".format(sample.name).replace('(','').replace(')','').replace('.','').replace(' ','_')
-                        sp_obj['sn'] = sample.name.replace('(','').replace(')','').replace('.','').replace(' ','_')
-                        sp_obj['pj'] = 'Control'
-                        sp_obj['ref'] = 'Control'
-                        sp_obj['rc'] = '0-0'
-                    sp_obj['ct'] = 'N'
-                    sp_obj['op'] = pro.technician.name.replace(" ","_").replace(',','')
-                    sp_obj['fc'] = out.location[0].name.replace(',','')
-                    sp_obj['sw'] = out.location[1].replace(',','')
-                    sp_obj['idx1'] = idxs[0].replace(',','').upper()
-                    if idxs[1]:
-                        if pro.udf['Reagent Version'] == 'v1.5':
-                            sp_obj['idx2'] = idxs[1].replace(',','').upper()
-                        elif pro.udf['Reagent Version'] == 'v1.0':
-                            compl = {'A': 'T', 'C': 'G', 'G': 'C', 'T': 'A'}
-                            sp_obj['idx2'] = ''.join( reversed( [compl.get(b,b) for b in idxs[1].replace(',','').upper() ] ) )
-                    else:
-                        sp_obj['idx2'] = ''
-                    data.append(sp_obj)
-    header = "{}\n".format(",".join(header_ar))
-    str_data = ""
-    for line in sorted(data, key=lambda x: x['lane']):
-        l_data = [line['fc'], line['lane'], line['sn'], line['sn'], line['ref'], line['idx1'], line['idx2'], line['pj'], line['ct'], line['rc'], line['op'], line['pj']]
-        str_data = str_data + ",".join(l_data) + "\n"
+        if out.type == "Analyte":
+            if cache is None:
+                data.extend(gen_output_rows(pro, out, adapter))
+                continue
+            state = artifact_state(out, pro.technician.name, adapter.settings(pro))
+            rows = cache.lookup(out.id, state)
+            if rows is None:
+                rows = gen_output_rows(pro, out, adapter)
+                cache.store(out.id, state, rows)
+            data.extend(rows)
+    return data
+
+
+def lane_sort_key(line):
+    # Lanes are numbers, ties between the indexes of a sample are kept in a
+    # stable order
+    lane = line['lane']
+    return (int(lane) if lane.isdigit() else float('inf'), lane, line['sn'], line['idx1'], line['idx2'])
+
+
+def write_lane_data(data, adapter, stream):
+    """Write the rows of data, sorted by lane and sample, to stream as CSV."""
+    writer = csv.writer(stream, lineterminator='\n')
+    writer.writerow(adapter.header)
+    for line in sorted(data, key=lane_sort_key):
+        writer.writerow(adapter.columns(line))
+
+
+def render_lane_data(pro, adapter, cache=None, bclconvert=False):
+    """Return (content, data) of the lane data samplesheet of pro, in the
+    bcl2fastq layout or as a BCL Convert v2 samplesheet."""
+    data = gen_lane_data(pro, adapter, cache)
+    content = StringIO()
+    if bclconvert:
+        write_bclconvert(data, content, lane_sort_key, adapter.platform)
+    else:
+        write_lane_data(data, adapter, content)
+    return (content.getvalue(), data)
 
-    content = "{}{}".format(header, str_data)
-    df = pd.read_csv(StringIO(content))
-    df = df.sort_values(['Lane', 'Sample_ID'])
-    content = df.to_csv(index=False)
 
-    return (content, data)
+def gen_Novaseq_lane_data(pro, cache=None, bclconvert=False):
+    return render_lane_data(pro, NovaseqAdapter(), cache, bclconvert)
 
 
-def gen_NovaSeqXPlus_lane_data(pro):
-    data = []
-    header_ar = [
-        "FCID",
-        "Lane",
-        "Sample_ID",
-        "Sample_Name",
-        "Sample_Ref",
-        "index",
-        "index2",
-        "Description",
-        "Control",
-        "Recipe",
-        "Operator",
-        "Sample_Project",
-    ]
-    for out in pro.all_outputs():
-        if out.type == "Analyte":
-            for sample in out.samples:
-                sample_idxs = set()
-                find_barcode(sample_idxs, sample, pro)
-                for idxs in sample_idxs:
-                    sp_obj = {}
-                    sp_obj["lane"] = out.location[1].split(":")[0].replace(",", "")
-                    if NGISAMPLE_PAT.findall(sample.name):
-                        sp_obj["sid"] = "Sample_{}".format(sample.name).replace(",", "")
-                        sp_obj["sn"] = sample.name.replace(",", "")
-                        sp_obj["pj"] = sample.project.name.replace(".", "__").replace(
-                            ",", ""
-                        )
-                        sp_obj["ref"] = sample.project.udf.get(
-                            "Reference genome", ""
-                        ).replace(",", "")
-                        seq_setup = sample.project.udf.get("Sequencing setup", "")
-                        if SEQSETUP_PAT.findall(seq_setup):
-                            sp_obj["rc"] = "{}-{}".format(
-                                seq_setup.split("-")[0], seq_setup.split("-")[3]
-                            )
-                        else:
-                            sp_obj["rc"] = "0-0"
-                    else:
-                        sp_obj["sid"] = (
-                            "Sample_{}".format(sample.name)
-                            .replace("(", "")
-                            .replace(")", "")
-                            .replace(".", "")
-                            .replace(" ", "_")
-                        )
-                        sp_obj["sn"] = (
-                            sample.name.replace("(", "")
-                            .replace(")", "")
-                            .replace(".", "")
-                            .replace(" ", "_")
-                        )
-                        sp_obj["pj"] = "Control"
-                        sp_obj["ref"] = "Control"
-                        sp_obj["rc"] = "0-0"
-                    sp_obj["ct"] = "N"
-                    sp_obj["op"] = pro.technician.name.replace(" ", "_").replace(
-                        ",", ""
-                    )
-                    sp_obj["fc"] = out.location[0].name.replace(",", "")
-                    sp_obj["sw"] = out.location[1].replace(",", "")
-                    sp_obj["idx1"] = idxs[0].replace(",", "").upper()
-                    if idxs[1]:
-                        sp_obj["idx2"] = idxs[1].replace(",", "").upper()
-                    else:
-                        sp_obj["idx2"] = ""
-                    data.append(sp_obj)
-    header = "{}\n".format(",".join(header_ar))
-    str_data = ""
-    for line in sorted(data, key=lambda x: x["lane"]):
-        l_data = [
-            line["fc"],
-            line["lane"],
-            line["sn"],
-            line["sn"],
-            line["ref"],
-            line["idx1"],
-            line["idx2"],
-            line["pj"],
-            line["ct"],
-            line["rc"],
-            line["op"],
-            line["pj"],
-        ]
-        str_data = str_data + ",".join(l_data) + "\n"
+def gen_NovaSeqXPlus_lane_data(pro, cache=None, bclconvert=False):
+    return render_lane_data(pro, LaneDataAdapter(), cache, bclconvert)
 
-    content = "{}{}".format(header, str_data)
-    df = pd.read_csv(StringIO(content))
-    df = df.sort_values(["Lane", "Sample_ID"])
-    content = df.to_csv(index=False)
 
-    return (content, data)
+def gen_Nextseq_lane_data(pro, cache=None, bclconvert=False):
+    return render_lane_data(pro, NextseqAdapter(), cache, bclconvert)
 
 
 def gen_Miseq_header(pro):
@@ -222,7 +286,7 @@ def gen_Miseq_header(pro):
     chem = "Default"
     for io in pro.input_output_maps:
         sample_idxs = set()
-        find_barcode(sample_idxs, io[1]["uri"].samples[0], pro)
+        find_barcode(sample_idxs, io[1]["uri"].samples[0], pro, BARCODES)
         idxs = list(sample_idxs)[0]
         if len(idxs) == 2:
            chem="amplicon"
@@ -255,7 +319,7 @@ def gen_Miseq_data(pro):
             continue
         for sample in out.samples:
             sample_idxs = set()
-            find_barcode(sample_idxs, sample, pro)
+            find_barcode(sample_idxs, sample, pro, BARCODES)
             if not sample_idxs:
                 noindex = True
                 header_ar.remove('index')
@@ -268,8 +332,9 @@ def gen_Miseq_data(pro):
                 if NGISAMPLE_PAT.findall(sample.name):
                     sp_obj['sid'] = "Sample_{}".format(sample.name).replace(',','')
                     sp_obj['sn'] = sample.name.replace(',','')
-                    sp_obj['pj'] = sample.project.name.replace('.','_').replace(',','')
-                    pj_type = 'by user' if sample.project.udf['Library construction method'] == 'Finished library (by user)' else 'inhouse'
+                    project = PROJECTS.get(sample)
+                    sp_obj['pj'] = project.name.replace('.','_').replace(',','')
+                    pj_type = 'by user' if project.library_method == 'Finished library (by user)' else 'inhouse'
                 else:
                     sp_obj['sid'] = "Sample_{}".format(sample.name).replace('(','').replace(')','').replace('.','').replace(' ','_')
                     sp_obj['sn'] = sample.name.replace('(','').replace(')','').replace('.','').replace(' ','_')
@@ -287,8 +352,9 @@ def gen_Miseq_data(pro):
                     if NGISAMPLE_PAT.findall(sample.name):
                         sp_obj['sid'] = "Sample_{}".format(sample.name).replace(',','')
                         sp_obj['sn'] = sample.name.replace(',','')
-                        sp_obj['pj'] = sample.project.name.replace('.','_').replace(',','')
-                        pj_type = 'by user' if sample.project.udf['Library construction method'] == 'Finished library (by user)' else 'inhouse'
+                        project = PROJECTS.get(sample)
+                        sp_obj['pj'] = project.name.replace('.','_').replace(',','')
+                        pj_type = 'by user' if project.library_method == 'Finished library (by user)' else 'inhouse'
                     else:
                         sp_obj['sid'] = "Sample_{}".format(sample.name).replace('(','').replace(')','').replace('.','').replace(' ','_')
                         sp_obj['sn'] = sample.name.replace('(','').replace(')','').replace('.','').replace(' ','_')
@@ -300,17 +366,17 @@ def gen_Miseq_data(pro):
 
                     if TENX_DUAL_PAT.findall(idxs[0]):
                         dualindex=True
-                        sp_obj['idx1'] = Chromium_10X_indexes[TENX_DUAL_PAT.findall(idxs[0])[0]][0].replace(',','')
-                        sp_obj['idx1ref'] = Chromium_10X_indexes[TENX_DUAL_PAT.findall(idxs[0])[0]][0].replace(',','')
+                        sp_obj['idx1'] = INDEX_KITS[TENX_DUAL_PAT.findall(idxs[0])[0]][0].replace(',','')
+                        sp_obj['idx1ref'] = INDEX_KITS[TENX_DUAL_PAT.findall(idxs[0])[0]][0].replace(',','')
                         compl = {'A': 'T', 'C': 'G', 'G': 'C', 'T': 'A'}
-                        sp_obj['idx2'] = ''.join( reversed( [compl.get(b,b) for b in Chromium_10X_indexes[TENX_DUAL_PAT.findall(idxs[0])[0]][1].replace(',','').upper() ] ) )
-                        sp_obj['idx2ref'] = ''.join( reversed( [compl.get(b,b) for b in Chromium_10X_indexes[TENX_DUAL_PAT.findall(idxs[0])[0]][1].replace(',','').upper() ] ) )
+                        sp_obj['idx2'] = ''.join( reversed( [compl.get(b,b) for b in INDEX_KITS[TENX_DUAL_PAT.findall(idxs[0])[0]][1].replace(',','').upper() ] ) )
+                        sp_obj['idx2ref'] = ''.join( reversed( [compl.get(b,b) for b in INDEX_KITS[TENX_DUAL_PAT.findall(idxs[0])[0]][1].replace(',','').upper() ] ) )
                         data.append(sp_obj)
                     elif TENX_SINGLE_PAT.findall(idxs[0]):
                         if 'index2' in header_ar and 'I5_Index_ID' in header_ar:
                             header_ar.remove('index2')
                             header_ar.remove('I5_Index_ID')
-                        for tenXidx in Chromium_10X_indexes[TENX_SINGLE_PAT.findall(idxs[0])[0]]:
+                        for tenXidx in INDEX_KITS[TENX_SINGLE_PAT.findall(idxs[0])[0]]:
                             sp_obj_sub = {}
                             sp_obj_sub['lane'] = sp_obj['lane']
                             sp_obj_sub['sid'] = sp_obj['sid']
@@ -361,57 +427,6 @@ def gen_Miseq_data(pro):
     return (content, data)
 
 
-def gen_Nextseq_lane_data(pro):
-    data=[]
-    header_ar = ["FCID","Lane","Sample_ID","Sample_Name","Sample_Ref","index","index2","Description","Control","Recipe","Operator","Sample_Project"]
-    for out in pro.all_outputs():
-        if  out.type == "Analyte":
-            for sample in out.samples:
-                sample_idxs = set()
-                find_barcode(sample_idxs, sample, pro)
-                for idxs in sample_idxs:
-                    sp_obj = {}
-                    sp_obj['lane'] = out.location[1].split(':')[0].replace(',','')
-                    if NGISAMPLE_PAT.findall(sample.name):
-                        sp_obj['sid'] = "Sample_{}".format(sample.name).replace(',','')
-                        sp_obj['sn'] = sample.name.replace(',','')
-                        sp_obj['pj'] = sample.project.name.replace('.','__').replace(',','')
-                        sp_obj['ref'] = sample.project.udf.get('Reference genome','').replace(',','')
-                        seq_setup = sample.project.udf.get('Sequencing setup', '')
-                        if SEQSETUP_PAT.findall(seq_setup):
-                            sp_obj['rc'] = '{}-{}'.format(seq_setup.split('-')[0], seq_setup.split('-')[3])
-                        else:
-                            sp_obj['rc'] = '0-0'
-                    else:
-                        sp_obj['sid'] = "Sample_{}".format(sample.name).replace('(','').replace(')','').replace('.','').replace(' ','_')
-                        sp_obj['sn'] = sample.name.replace('(','').replace(')','').replace('.','').replace(' ','_')
-                        sp_obj['pj'] = 'Control'
-                        sp_obj['ref'] = 'Control'
-                        sp_obj['rc'] = '0-0'
-                    sp_obj['ct'] = 'N'
-                    sp_obj['op'] = pro.technician.name.replace(" ","_").replace(',','')
-                    sp_obj['fc'] = out.location[0].name.replace(',','')
-                    sp_obj['sw'] = out.location[1].replace(',','')
-                    sp_obj['idx1'] = idxs[0].replace(',','')
-                    if idxs[1]:
-                        sp_obj['idx2'] = idxs[1].replace(',','').upper()
-                    else:
-                        sp_obj['idx2'] = ''
-                    data.append(sp_obj)
-    header = "{}\n".format(",".join(header_ar))
-    str_data = ""
-    for line in sorted(data, key=lambda x: x['lane']):
-        l_data = [line['fc'], line['lane'], line['sn'], line['sn'], line['ref'], line['idx1'], line['idx2'], line['pj'], line['ct'], line['rc'], line['op'], line['pj']]
-        str_data = str_data + ",".join(l_data) + "\n"
-
-    content = "{}{}".format(header, str_data)
-    df = pd.read_csv(StringIO(content))
-    df = df.sort_values(['Lane', 'Sample_ID'])
-    content = df.to_csv(index=False)
-
-    return (content, data)
-
-
 def gen_MinION_QC_data(pro):
     keep_idx_flag = True if pro.type.name == 'MinION QC' else False
     data=[]
@@ -426,10 +441,22 @@ def gen_MinION_QC_data(pro):
             sp_obj['sn'] = sample_name
             sp_obj['npbs'] = nanopore_barcode_seq
 
+            # Labels other than the 10X index sets are looked up in the
+            # reagent type index first, the label name is parsed otherwise
+            sequence = None
+            if idxs and idxs != 'NoIndex' and not (TENX_SINGLE_PAT.findall(idxs) or TENX_DUAL_PAT.findall(idxs)):
+                sequence = reagent_sequence(pro.lims, idxs)
+
+            #Case of a sequence from the reagent type index
+            if sequence:
+                sp_obj['idxt'] = 'truseq_dual' if '-' in sequence else 'truseq'
+                sp_obj['idx'] = sequence
+                data.append(sp_obj)
             #Case of 10X indexes
-            if TENX_SINGLE_PAT.findall(idxs):
-                for tenXidx in Chromium_10X_indexes[TENX_SINGLE_PAT.findall(idxs)[0]]:
-                    tenXidx_no = Chromium_10X_indexes[TENX_SINGLE_PAT.findall(idxs)[0]].index(tenXidx)+1
+            elif TENX_SINGLE_PAT.findall(idxs):
+                tenXidxs = INDEX_KITS[TENX_SINGLE_PAT.findall(idxs)[0]]
+                for tenXidx in tenXidxs:
+                    tenXidx_no = tenXidxs.index(tenXidx)+1
                     sp_obj_sub = {}
                     sp_obj_sub['sn'] = sp_obj['sn']+'_'+str(tenXidx_no)
                     sp_obj_sub['npbs'] = sp_obj['npbs']
@@ -439,7 +466,7 @@ def gen_MinION_QC_data(pro):
             #Case of 10X dual indexes
             elif TENX_DUAL_PAT.findall(idxs):
                 sp_obj['idxt'] = 'truseq_dual'
-                sp_obj['idx'] = Chromium_10X_indexes[TENX_DUAL_PAT.findall(idxs)[0]][0]+'-'+Chromium_10X_indexes[TENX_DUAL_PAT.findall(idxs)[0]][1]
+                sp_obj['idx'] = INDEX_KITS[TENX_DUAL_PAT.findall(idxs)[0]][0]+'-'+INDEX_KITS[TENX_DUAL_PAT.findall(idxs)[0]][1]
                 data.append(sp_obj)
             #Case of NoIndex
             elif idxs == 'NoIndex' or idxs == '' or not idxs:
@@ -477,36 +504,6 @@ def gen_MinION_QC_data(pro):
 
     return str_data
 
-def find_barcode(sample_idxs, sample, process):
-    # print "trying to find {} barcode in {}".format(sample.name, process.name)
-    for art in process.all_inputs():
-        if sample in art.samples:
-            if len(art.samples) == 1 and art.reagent_labels:
-                reagent_label_name=art.reagent_labels[0].upper().replace(' ', '')
-                idxs = TENX_SINGLE_PAT.findall(reagent_label_name) or TENX_DUAL_PAT.findall(reagent_label_name) or SMARTSEQ_PAT.findall(reagent_label_name)
-                if idxs:
-                    # Put in tuple with empty string as second index to
-                    # match expected type:
-                    sample_idxs.add((idxs[0], ""))
-                else:
-                    try:
-                        idxs = IDX_PAT.findall(reagent_label_name)[0]
-                        sample_idxs.add(idxs)
-                    except IndexError:
-                        try:
-                            # we only have the reagent label name.
-                            rt = lims.get_reagent_types(name=reagent_label_name)[0]
-                            idxs = IDX_PAT.findall(rt.sequence)[0]
-                            sample_idxs.add(idxs)
-                        except:
-                            sample_idxs.add(("NoIndex",""))
-            else:
-                if art == sample.artifact or not art.parent_process:
-                    pass
-                else:
-                    find_barcode(sample_idxs, sample, art.parent_process)
-
-
 def test():
     log=[]
     d=[{'lane':1,'idx1':'ATTT', 'idx2':''},{'lane':1,'idx1':'ATCTATCG', 'idx2':''},{'lane':1,'idx1':'ATCG', 'idx2':'ATCG'},]
@@ -514,41 +511,53 @@ def test():
     print(log)
 
 
+def print_sheet_diff(lims, ss_art, content, name, cache):
+    """Print the changes of the samplesheet since the uploaded one."""
+    print("Reused the rows of {} lanes, resolved {}".format(cache.hits, cache.misses))
+    previous = uploaded_file(lims, ss_art)
+    if previous is None:
+        print("No samplesheet uploaded yet")
+    else:
+        diff = sheet_diff(previous, content, name)
+        print("\n".join(diff) if diff else "No change to the uploaded samplesheet")
+
+
 def main(lims, args):
     log=[]
     thisyear=datetime.now().year
     content = None
+    nas_path = None
     if args.mytest:
         test()
     else:
-        process = Process(lims, id=args.pid)
+        process = prefetch_step(lims, args.pid)
+        cache = RowCache(process.id) if args.incremental else None
 
         if "Load to Flowcell (NovaSeq 6000 v2.0)" == process.type.name:
-            (content, obj) = gen_Novaseq_lane_data(process)
+            (content, obj) = gen_Novaseq_lane_data(process, cache, args.bclconvert)
+            if args.bclconvert:
+                log.extend(validate_rows(obj))
+            conflicts = len(log)
             check_index_distance(obj, log)
+            if len(log) > conflicts:
+                propose_lanes(process, obj, log)
             if os.path.exists("/srv/ngi-nas-ns/samplesheets/novaseq/{}".format(thisyear)):
-                try:
-                    with open("/srv/ngi-nas-ns/samplesheets/novaseq/{}/{}.csv".format(thisyear, obj[0]['fc']), 'w') as sf:
-                        sf.write(content)
-                except Exception as e:
-                    log.append(str(e))
+                nas_path = "/srv/ngi-nas-ns/samplesheets/novaseq/{}/{}.csv".format(thisyear, obj[0]['fc'])
 
         elif "Load to Flowcell (NovaSeqXPlus)" in process.type.name:
-            (content, obj) = gen_NovaSeqXPlus_lane_data(process)
+            (content, obj) = gen_NovaSeqXPlus_lane_data(process, cache, args.bclconvert)
+            if args.bclconvert:
+                log.extend(validate_rows(obj))
+            conflicts = len(log)
             check_index_distance(obj, log)
+            if len(log) > conflicts:
+                propose_lanes(process, obj, log)
             if os.path.exists(
                 "/srv/ngi-nas-ns/samplesheets/NovaSeqXPlus/{}".format(thisyear)
             ):
-                try:
-                    with open(
-                        "/srv/ngi-nas-ns/samplesheets/NovaSeqXPlus/{}/{}.csv".format(
-                            thisyear, obj[0]["fc"]
-                        ),
-                        "w",
-                    ) as sf:
-                        sf.write(content)
-                except Exception as e:
-                    log.append(str(e))
+                nas_path = "/srv/ngi-nas-ns/samplesheets/NovaSeqXPlus/{}/{}.csv".format(
+                    thisyear, obj[0]["fc"]
+                )
 
         elif process.type.name == "Denature, Dilute and Load Sample (MiSeq) 4.0":
             header = gen_Miseq_header(process)
@@ -559,27 +568,27 @@ def main(lims, args):
             content = "{}{}{}{}".format(header, reads, settings, data)
 
         elif process.type.name == 'Load to Flowcell (NextSeq v1.0)':
-            (content, obj) = gen_Nextseq_lane_data(process)
+            (content, obj) = gen_Nextseq_lane_data(process, cache, args.bclconvert)
+            if args.bclconvert:
+                log.extend(validate_rows(obj))
+            conflicts = len(log)
             check_index_distance(obj, log)
+            if len(log) > conflicts:
+                propose_lanes(process, obj, log)
             nextseq_fc = process.udf['Flowcell Series Number'] if process.udf['Flowcell Series Number'] else obj[0]['fc']
             if os.path.exists("/srv/ngi-nas-ns/samplesheets/nextseq/{}".format(thisyear)):
-                try:
-                    with open("/srv/ngi-nas-ns/samplesheets/nextseq/{}/{}.csv".format(thisyear, nextseq_fc), 'w') as sf:
-                        sf.write(content)
-                except Exception as e:
-                    log.append(str(e))
+                nas_path = "/srv/ngi-nas-ns/samplesheets/nextseq/{}/{}.csv".format(thisyear, nextseq_fc)
 
         elif process.type.name in ['MinION QC', 'Load Sample and Sequencing (MinION) 1.0']:
             content = gen_MinION_QC_data(process)
             run_type = 'QC' if process.type.name == 'MinION QC' else 'DELIVERY'
             fc_name = run_type + "_" + process.udf['Nanopore Kit'] + "_" + process.udf['Flowcell ID'].upper() + "_" + "Samplesheet" + "_" + process.id
             if os.path.exists("/srv/ngi-nas-ns/samplesheets/nanopore/{}".format(thisyear)):
-                try:
-                    with open("/srv/ngi-nas-ns/samplesheets/nanopore/{}/{}.csv".format(thisyear, fc_name), 'w') as sf:
-                        sf.write(content)
-                except Exception as e:
-                    log.append(str(e))
+                nas_path = "/srv/ngi-nas-ns/samplesheets/nanopore/{}/{}.csv".format(thisyear, fc_name)
 
+        destinations = {}
+        if nas_path is not None:
+            destinations["NAS"] = partial(atomic_write, nas_path, content)
         if not args.test:
             for out in process.all_outputs():
                 if out.name == "Scilifelab SampleSheet" :
@@ -597,12 +606,19 @@ def main(lims, args):
                 else:
                     fc_name = "Samplesheet" + "_" + process.id
 
-            with open("{}.csv".format(fc_name), "w", 0o664) as f:
-                f.write(content)
-            os.chmod("{}.csv".format(fc_name),0o664)
-            for f in ss_art.files:
-                lims.request_session.delete(f.uri)
-            lims.upload_new_file(ss_art, "{}.csv".format(fc_name))
+            atomic_write("{}.csv".format(fc_name), content)
+            if cache is not None:
+                print_sheet_diff(lims, ss_art, content, "{}.csv".format(fc_name), cache)
+            destinations["LIMS"] = partial(lims_upload, lims, ss_art, "{}.csv".format(fc_name))
+
+        # The NAS copy and the upload run concurrently
+        for result in publish(destinations):
+            if result.error is not None:
+                log.append("Cannot publish the samplesheet to {}: {}".format(result.name, result.error))
+
+        if not args.test:
+            if cache is not None:
+                cache.save()
             if log:
                 with open("{}_{}_Error.log".format(log_id, fc_name), "w") as f:
                     f.write('\n'.join(log))
@@ -623,8 +639,13 @@ if __name__ == "__main__":
                         help='do not upload the samplesheet')
     parser.add_argument('--mytest', action="store_true",
                         help='mytest')
+    parser.add_argument('--incremental', action="store_true",
+                        help='only resolve the lanes changed since the previous run, and show the changes of the samplesheet')
+    parser.add_argument('--bclconvert', action="store_true",
+                        help='write the lane data samplesheets for BCL Convert (v2 format) instead of bcl2fastq')
     args = parser.parse_args()
 
     lims = Lims(BASEURI, USERNAME, PASSWORD)
     lims.check_version()
+    cache_from_env(lims)
     main(lims, args)
@@ -23,6 +23,7 @@ from genologics.config import BASEURI, USERNAME, PASSWORD
 from genologics.entities import Process
 from scilifelab_epps.epp import EppLogger
 from scilifelab_epps.epp import set_field
+from scilifelab_epps.metrics import nas_open
 
 class AppQC():
     def __init__(self, process):
@@ -39,7 +40,8 @@ class AppQC():
     def get_app_QC_file(self):
         """ App QC file is read from the file msf system. Path hard coded."""
         file_path = ("/srv/ngi-nas-ns/app_QC/{0}.json".format(self.project_name))
-        json_data = open(file_path).read()
+        with nas_open(file_path) as f:
+            json_data = f.read()
         self.app_QC = json.loads(json_data)
 
     def set_result_file_udfs(self):
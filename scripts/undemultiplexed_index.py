@@ -33,7 +33,6 @@ import sys
 import logging
 import glob
 import csv
-import numpy as np
 
 from argparse import ArgumentParser
 from genologics.lims import Lims
@@ -41,7 +40,13 @@ from genologics.config import BASEURI, USERNAME, PASSWORD
 from genologics.entities import Process
 from scilifelab_epps.epp import EppLogger
 from scilifelab_epps.epp import set_field
+from scilifelab_epps.metrics import nas_io
 from scilifelab_parsers.qc.qc import FlowcellRunMetricsParser
+
+from epp_utils.lazy import lazy_import
+
+np = lazy_import("numpy")
+
 #from qc_parsers import FlowcellRunMetricsParser
 
 class RunQC():
@@ -153,13 +158,15 @@ class RunQC():
         FRMP = FlowcellRunMetricsParser()
         try:
             fp_dem = self.file_path + 'Demultiplex_Stats.htm'
-            self.dem_stat = FRMP.parse_demultiplex_stats_htm(fp_dem)
+            with nas_io(fp_dem):
+                self.dem_stat = FRMP.parse_demultiplex_stats_htm(fp_dem)
             logging.info("Parsed file {0}".format(fp_dem))
         except:
             sys.exit("Failed to find or parse Demultiplex_Stats.htm.")
         try:
             fp_und = self.file_path + 'Undemultiplexed_stats.metrics'
-            self.undem_stat = FRMP.parse_undemultiplexed_barcode_metrics(fp_und)
+            with nas_io(fp_und):
+                self.undem_stat = FRMP.parse_undemultiplexed_barcode_metrics(fp_und)
             logging.info("Parsed file {0}".format(fp_und))
         except:
             sys.exit("Failed to find or parse Undemultiplexed_stats.metrics")
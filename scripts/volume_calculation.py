@@ -3,14 +3,18 @@
 import os
 import sys
 import yaml
-import psycopg2
 from argparse import ArgumentParser
 from datetime import datetime
 from scilifelab_epps.epp import attach_file
+from scilifelab_epps.fanout import workflow_stages_per_artifact
 from genologics.lims import Lims
 from genologics.entities import Process
 from genologics.config import BASEURI, USERNAME, PASSWORD
 
+from epp_utils.lazy import lazy_import
+
+psycopg2 = lazy_import("psycopg2")
+
 DESC = """EPP for calculating volume for the OmniC protocol
 Author: Chuan Wang, Science for Life Laboratory, Stockholm, Sweden
 """
@@ -24,8 +28,7 @@ factors = {
     "mg/ml": 0.001,
 }
 
-with open("/opt/gls/clarity/users/glsai/config/genosqlrc.yaml", "r") as f:
-    config = yaml.safe_load(f)
+GENOSQL_CONFIG = "/opt/gls/clarity/users/glsai/config/genosqlrc.yaml"
 
 
 # Verify that inputs have necessary measurements for calculation
@@ -113,6 +116,9 @@ def calculate_volume_postgres(process):
     error_messages = []
     log = []
 
+    with open(GENOSQL_CONFIG, "r") as f:
+        config = yaml.safe_load(f)
+
     connection = psycopg2.connect(
         user=config["username"],
         host=config["url"],
@@ -195,8 +201,9 @@ def main(lims, pid):
     process = Process(lims, id=pid)
 
     art_workflows = set()
-    for inp in process.all_inputs():
-        for stage in inp.workflow_stages_and_statuses:
+    stages_per_input = workflow_stages_per_artifact(lims, process.all_inputs())
+    for stages in stages_per_input.values():
+        for stage in stages:
             if stage[1] == "IN_PROGRESS":
                 art_workflows.add(stage[0].workflow.name)
 
@@ -10,6 +10,7 @@ from genologics.lims import Lims
 from genologics.config import BASEURI,USERNAME,PASSWORD
 from genologics.entities import *
 from scilifelab_epps.epp import attach_file
+from scilifelab_epps.reagent_index import reagent_sequence
 
 
 def generate_header(step,atype='D'):
@@ -56,7 +57,9 @@ def generate_data(step):
             try:
                 #regent label (barcode) name and sequence
                 reglab_name=out.reagent_labels[0]
-                reglab_seq=lims.get_reagent_types(name=reglab_name)[0].sequence
+                reglab_seq=reagent_sequence(lims, reglab_name)
+                if reglab_seq is None:
+                    raise LookupError(reglab_name)
             except:
                 logger.error("Cannot find the reagent label of output analyte {0}".format(out.id))
                 return None
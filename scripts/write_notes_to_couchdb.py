@@ -3,14 +3,17 @@ DESC="""Module called by other EPP scripts to write notes to couchdb
 """
 import json
 import yaml
-import couchdb
 import smtplib
 import os
 import sys
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 import datetime
-import markdown
+
+from epp_utils.lazy import lazy_import
+
+couchdb = lazy_import("couchdb")
+markdown = lazy_import("markdown")
 
 def write_note_to_couch(pid, timestamp, note, lims):
     configf = '~/.statusdb_cred.yaml'
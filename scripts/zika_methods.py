@@ -7,9 +7,12 @@ Written by Alfred Kedhammar
 """
 
 import zika_utils
-import pandas as pd
 import sys
-import numpy as np
+
+from epp_utils.lazy import lazy_import
+
+pd = lazy_import("pandas")
+np = lazy_import("numpy")
 
 
 def pool(
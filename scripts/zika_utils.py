@@ -10,11 +10,15 @@ applications of the instrument.
 Written by Alfred Kedhammar
 """
 
-import pandas as pd
-import numpy as np
 from datetime import datetime as dt
 import sys
 from epp_utils.udf_tools import fetch_last
+from epp_utils.lineage import LineageGraph
+
+from epp_utils.lazy import lazy_import
+
+pd = lazy_import("pandas")
+np = lazy_import("numpy")
 
 
 def verify_step(currentStep, targets=None):
@@ -130,7 +134,8 @@ def fetch_sample_data(currentStep, to_fetch):
         if art_tuple[0]["uri"].type == art_tuple[1]["uri"].type == "Analyte"
     ]
 
-    # Fetch all target data
+    # Fetch all target data, sharing the lineage lookups between the tuples
+    lineage = LineageGraph()
     list_of_dicts = []
     for art_tuple in art_tuples:
         dict = {}
@@ -141,7 +146,9 @@ def fetch_sample_data(currentStep, to_fetch):
                 except KeyError:
                     dict[header] = None
             else:
-                dict[header] = fetch_last(currentStep, art_tuple, target_info)
+                dict[header] = fetch_last(
+                    currentStep, art_tuple, target_info, lineage=lineage
+                )
         list_of_dicts.append(dict)
 
     # Compile to dataframe